@@ -0,0 +1,251 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_files import read_columnar, write_columnar
+from customer_activity import load_store_levels
+from date_codes import DateTable
+from movie_dimension import ACTIVITY_LEVELS, RATING_CATEGORIES, MovieDimension, rating_category_codes
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+
+# Precomputed aggregate cube of the ratings for the dashboard charts.
+#
+# The pie, bar and stacked bar charts of the app only need the number, sum (and sum of squares)
+# of the ratings per value of a few dimensions. These are accumulated once, at build time, per
+# cell of
+#
+#   cube        decade x activity_level x rating_category x rating_year x rating     (~1,500 cells)
+#   genre cube  genres x rating_year x rating                                         (~1,000 cells)
+#
+# Genres get their own cube because a rating counts once for every genre of its movie: the genre
+# cells do not add up to the ratings. A chart is a groupby over a few thousand cells whatever the
+# number of ratings, so the charts cost the same on the 500k sample and on the 100M ratings of a
+# ratings store. The cells are accumulated with bincounts over flat cell indexes, block by block,
+# and the genre cells are computed from per-movie cells through the genre matrix of the dimension.
+#
+# Ratings without a value are not counted.
+#
+#   data/aggregate_cube.csv, data/genre_cube.csv   (+ typed Arrow copies, see columnar_files.py)
+#
+#   python aggregate_cube.py --store data/ratings_store --data-dir data     (cube of the full corpus)
+
+CUBE_FILE = 'aggregate_cube.csv'
+GENRE_CUBE_FILE = 'genre_cube.csv'
+
+CUBE_DIMENSIONS = ('decade', 'activity_level', 'rating_category', 'rating_year', 'rating')
+GENRE_CUBE_DIMENSIONS = ('genres', 'rating_year', 'rating')
+MEASURES = ('count', 'sum', 'sum_sq')
+
+# ratings are 1 to 5, used directly as positions on the rating axis
+N_RATINGS = 6
+
+
+class CubeBuilder:
+    """Accumulates the cells of the cubes from blocks of ratings."""
+
+    def __init__(self, movies, date_table):
+        self.movies = movies
+        self.date_table = date_table
+        decade_codes, self.decades = pd.factorize(movies.table['decade'], sort=True)
+        # position 0 of every axis holds the missing values (unknown decade, activity, year)
+        self.decade_of = (decade_codes + 1).astype(np.int64)
+        years = date_table.tables['year']
+        self.years = np.arange(years.min(), years.max() + 1)
+        self.shape = (len(self.decades) + 1, len(ACTIVITY_LEVELS) + 1, len(RATING_CATEGORIES) + 1,
+                      len(self.years) + 1, N_RATINGS)
+        self.movie_shape = (len(movies), len(self.years) + 1, N_RATINGS)
+        self.cells = {measure: np.zeros(int(np.prod(self.shape)), dtype=np.float64) for measure in MEASURES}
+        self.movie_cells = {measure: np.zeros(int(np.prod(self.movie_shape)), dtype=np.float64) for measure in MEASURES}
+
+    @classmethod
+    def for_day_codes(cls, movies, day_codes):
+        """Builder whose year axis covers every day code of an array (e.g. the date column of a store)."""
+        return cls(movies, DateTable.for_codes(day_codes))
+
+    def add(self, movie_keys, ratings, day_codes, activity_codes, category_codes):
+        """Adds a block of ratings (movie keys, ratings, day codes and the codes of the levels)."""
+        ratings = np.asarray(ratings, dtype=np.float64)
+        rated = ~np.isnan(ratings) & (ratings >= 1) & (ratings < N_RATINGS)
+        movie_keys = np.asarray(movie_keys, dtype=np.int64)[rated]
+        ratings = ratings[rated]
+        rating_codes = ratings.astype(np.int64)
+
+        # missing days (and days outside the table) have no year: position 0
+        years = self.date_table.lookup(np.asarray(day_codes)[rated], 'year').astype(np.int64)
+        year_codes = np.where(years >= 0, years - self.years[0] + 1, 0)
+
+        flat = np.ravel_multi_index((
+            self.decade_of[movie_keys],
+            np.asarray(activity_codes, dtype=np.int64)[rated] + 1,
+            np.asarray(category_codes, dtype=np.int64)[rated] + 1,
+            year_codes,
+            rating_codes,
+        ), self.shape)
+        movie_flat = np.ravel_multi_index((movie_keys, year_codes, rating_codes), self.movie_shape)
+
+        for cells, index in ((self.cells, flat), (self.movie_cells, movie_flat)):
+            size = len(cells['count'])
+            cells['count'] += np.bincount(index, minlength=size)
+            cells['sum'] += np.bincount(index, weights=ratings, minlength=size)
+            cells['sum_sq'] += np.bincount(index, weights=ratings * ratings, minlength=size)
+        return self
+
+    def _year_labels(self, year_codes):
+        years = pd.array(self.years[np.maximum(year_codes - 1, 0)], dtype='Int64')
+        years[year_codes == 0] = pd.NA
+        return years
+
+    def cube(self):
+        """The AggregateCube of the accumulated ratings (non-empty cells only)."""
+        present = np.flatnonzero(self.cells['count'])
+        decade, activity, category, year, rating = np.unravel_index(present, self.shape)
+        cells = pd.DataFrame({
+            'decade': pd.Series(np.append([None], np.asarray(self.decades, dtype=object))[decade], dtype=object),
+            'activity_level': pd.Categorical.from_codes(activity - 1, categories=ACTIVITY_LEVELS, ordered=True),
+            'rating_category': pd.Categorical.from_codes(category - 1, categories=RATING_CATEGORIES, ordered=True),
+            'rating_year': self._year_labels(year),
+            'rating': rating,
+            **{measure: self.cells[measure][present] for measure in MEASURES},
+        })
+
+        # genre cells: (genres x movies) @ (movies x (year, rating)) cells of every measure
+        matrix = self.movies.genre_matrix().T.astype(np.float64)
+        genre_names = pd.Series(self.movies.genre_vocabulary, dtype=object).str.capitalize()
+        n_cells = self.movie_shape[1] * self.movie_shape[2]
+        genre_measures = {measure: matrix @ self.movie_cells[measure].reshape(len(self.movies), n_cells) for measure in MEASURES}
+        genre, cell = np.nonzero(genre_measures['count'])
+        year, rating = np.unravel_index(cell, self.movie_shape[1:])
+        genre_cells = pd.DataFrame({
+            'genres': genre_names.to_numpy()[genre],
+            'rating_year': self._year_labels(year),
+            'rating': rating,
+            **{measure: genre_measures[measure][genre, cell] for measure in MEASURES},
+        })
+        # genre names that only differ by their case are one genre, like the genre analysis
+        genre_cells = genre_cells.groupby(list(GENRE_CUBE_DIMENSIONS), dropna=False, as_index=False)[list(MEASURES)].sum()
+        for frame in (cells, genre_cells):
+            frame['rating'] = frame['rating'].astype(np.int8)
+            frame['count'] = frame['count'].astype(np.int64)
+        return AggregateCube(cells, genre_cells)
+
+
+class AggregateCube:
+    """Count, sum and sum of squares of the ratings per cell of the dashboard dimensions."""
+
+    def __init__(self, cells, genre_cells):
+        self.cells = cells
+        self.genre_cells = genre_cells
+
+    @property
+    def dimensions(self):
+        return CUBE_DIMENSIONS + ('genres',)
+
+    def __len__(self):
+        return len(self.cells) + len(self.genre_cells)
+
+    def query(self, by, where=None):
+        """
+        rating_count, rating_avg and rating_std (sample standard deviation) per combination of the
+        `by` dimensions, over the cells whose dimensions are in the values of `where`
+        ({dimension: values}). A query on 'genres' is answered by the genre cube.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        use_genres = 'genres' in by or 'genres' in where
+        cells = self.genre_cells if use_genres else self.cells
+        unknown = [dim for dim in [*by, *where] if dim not in cells.columns or dim in MEASURES]
+        if unknown:
+            raise ValueError(f"Dimensions {unknown} are not in the {'genre ' if use_genres else ''}cube.")
+
+        for dim, values in where.items():
+            cells = cells[cells[dim].isin(values)]
+        totals = cells.groupby(by, observed=True)[list(MEASURES)].sum()
+        totals = totals[totals['count'] > 0]
+
+        result = pd.DataFrame({'rating_count': totals['count'].astype(np.int64)}, index=totals.index)
+        result['rating_avg'] = totals['sum'] / totals['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (totals['sum_sq'] - totals['sum'] ** 2 / totals['count']) / (totals['count'] - 1)
+        result['rating_std'] = np.sqrt(variance.clip(lower=0)).where(totals['count'] > 1)
+        return result.reset_index()
+
+    # PERSISTENCE
+
+    def save(self, data_dir):
+        """Writes the cubes as CSV files with their typed copies. Returns the CSV paths."""
+        paths = []
+        for cells, filename in ((self.cells, CUBE_FILE), (self.genre_cells, GENRE_CUBE_FILE)):
+            path = os.path.join(data_dir, filename)
+            cells.to_csv(path, index=False)
+            write_columnar(cells, path)
+            paths.append(path)
+        return paths
+
+    @classmethod
+    def load(cls, data_dir):
+        """Cubes of data_dir, None when they have not been built."""
+        frames = []
+        for filename in (CUBE_FILE, GENRE_CUBE_FILE):
+            path = os.path.join(data_dir, filename)
+            cells = read_columnar(path)
+            if cells is None:
+                if not os.path.exists(path):
+                    return None
+                cells = pd.read_csv(path)
+                cells['rating_year'] = cells['rating_year'].astype('Int64')
+                for dim, categories in (('activity_level', ACTIVITY_LEVELS), ('rating_category', RATING_CATEGORIES)):
+                    if dim in cells.columns:
+                        cells[dim] = pd.Categorical(cells[dim], categories=categories, ordered=True)
+            frames.append(cells)
+        return cls(*frames)
+
+    @classmethod
+    def from_fact_table(cls, fact, movies):
+        """Cube of a fact table (movie_key, rating, rating_day and the level codes, see build_pipeline.py)."""
+        day_codes = fact['rating_day'].to_numpy()
+        builder = CubeBuilder.for_day_codes(movies, day_codes)
+        builder.add(fact['movie_key'].to_numpy(), fact['rating'].to_numpy(dtype=np.float64, na_value=np.nan), day_codes,
+                    _codes(fact['activity_level']), _codes(fact['rating_category']))
+        return builder.cube()
+
+    @classmethod
+    def from_store(cls, store, movies, activity_codes, block_rows=10_000_000):
+        """
+        Cube of every rating of a ratings store, read block by block; activity_codes are the
+        activity levels of the ratings (see customer_activity.load_store_levels).
+        """
+        builder = CubeBuilder.for_day_codes(movies, store.column('date'))
+        for start in range(0, len(store), block_rows):
+            stop = start + block_rows
+            keys = movies.keys_for(store.column('movie_id')[start:stop])
+            known = keys >= 0
+            ratings = np.asarray(store.column('rating')[start:stop])[known]
+            builder.add(keys[known], ratings, np.asarray(store.column('date')[start:stop])[known],
+                        np.asarray(activity_codes[start:stop])[known], rating_category_codes(ratings))
+        return builder.cube()
+
+
+def _codes(values):
+    # level codes of a fact table column: integer codes or an ordered categorical
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy()
+    return values.to_numpy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the aggregate cube of every rating of a ratings store.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help="ratings store with its activity levels (see customer_activity.py)")
+    parser.add_argument('--data-dir', default='data', help="directory of the movie dimension, where the cubes are written")
+    parser.add_argument('--block-rows', type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    movies = MovieDimension.load(args.data_dir)
+    cube = AggregateCube.from_store(RatingsStore(args.store), movies, load_store_levels(args.store), args.block_rows)
+    cube.save(args.data_dir)
+    print(f"{len(cube.cells):,} cells, {len(cube.genre_cells):,} genre cells written to {args.data_dir} "
+          f"in {time.perf_counter() - start_time:.1f}s.")
+    print(cube.query(['decade']).to_string(index=False))
@@ -1,9 +1,7 @@
 import streamlit as st
 from data_loader import load_data, get_df
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
+from dtype_plan import DATE_CODE_COLUMNS
 import pandas as pd 
-import numpy as np
 from plotting_utils import (
     plot_plotly_histogram, 
     plot_plotly_pie, 
@@ -12,7 +10,8 @@ from plotting_utils import (
     plot_genre_rating_heatmap, 
     plot_animated_rating_evolution, 
     plot_stacked_activity_rating_count,
-    load_wordcloud_figure)
+    load_wordcloud_figure,
+    show_wordcloud_figure)
 
 st.set_page_config(
     page_title="Neflix dataset app",
@@ -20,11 +19,25 @@ st.set_page_config(
     layout="wide"
 )
 
-# Data loading - load the data (that are contained in a dict) and define dfs 
+# Data loading - the data store is lazy: every df is loaded (and derived ones computed) when first asked for.
+# df is the fact table as stored (integer keys and codes, shown in part 1); every chart asks
+# get_df for the main_df columns it uses only
 data_store = load_data()
 df = get_df(data_store, 'main_df')
 movies_by_rating = get_df(data_store, 'movies_by_rating')
-genre_analysis_df = get_df(data_store, 'genre_analysis_df')
+
+
+def chart_df(*columns):
+    """main_df with the given columns (and movie_key), stored ones only: movie attributes are resolved by the charts."""
+    return get_df(data_store, 'main_df', columns=[col for col in columns if col in df.columns])
+
+
+# movie dimension: title, year, decade and genres are resolved from it by movie_key (see movie_dimension.py)
+movies = data_store.get('movies') if data_store else None
+movie_columns = movies.columns if movies is not None else []
+
+# aggregate cube written by build_pipeline.py: the pie, bar and stacked charts are read from it (see aggregate_cube.py)
+cube = data_store.get('cube') if data_store else None
 
 
 # Title and presentation text 
@@ -114,7 +127,9 @@ HISTOGRAM_COLS = ['rating', 'year', 'rating_date']
 
 
 
-available_cols = [col for col in HISTOGRAM_COLS if col in df.columns]
+# rating_date is not stored, it is rebuilt from the day codes (see dtype_plan.py)
+available_cols = [col for col in HISTOGRAM_COLS
+                  if col in df.columns or col in movie_columns or DATE_CODE_COLUMNS.get(col) in df.columns]
 
 
 # Selectbox: 
@@ -154,10 +169,11 @@ histogram_bins = st.sidebar.slider(
 # Call the plotly plot 
 with st.container():
     plot_plotly_histogram(
-        df=df, 
+        df=chart_df(histogram_x_col, DATE_CODE_COLUMNS.get(histogram_x_col)), 
         x_col=histogram_x_col, 
         bins=histogram_bins,
-        title=f"Distribution of {histogram_x_col.title()} (Bins: {histogram_bins})"
+        title=f"Distribution of {histogram_x_col.title()} (Bins: {histogram_bins})",
+        movies=movies
     )
 
 
@@ -177,7 +193,7 @@ st.sidebar.subheader("Pie Chart Controls")
 PIECHART_COLS = ['decade', 'rating_category', 'activity_level']
 
 
-available_pie_cols = [col for col in PIECHART_COLS if col in df.columns]
+available_pie_cols = [col for col in PIECHART_COLS if col in df.columns or col in movie_columns]
 
 #Selectbox 
 # Set the default selection to 'decade' if available, otherwise the first available column
@@ -196,9 +212,11 @@ pie_category_col = st.sidebar.selectbox(
 # Call the plotly plot 
 with st.container():
     plot_plotly_pie(
-        df=df,
+        df=chart_df('rating', pie_category_col),
         category_col=pie_category_col,
-        title=f"Distribution by {pie_category_col.replace('_', ' ').title()}"
+        title=f"Distribution by {pie_category_col.replace('_', ' ').title()}",
+        movies=movies,
+        cube=cube
     )
 
 
@@ -213,7 +231,7 @@ st.subheader(" Metric Comparison (Count or Average)")
 st.sidebar.subheader(" Metric Plot Controls")
 
 METRIC_COLS = ['decade', 'activity_level', 'genres'] 
-available_metric_cols = [col for col in METRIC_COLS if col in df.columns]
+available_metric_cols = [col for col in METRIC_COLS if col in df.columns or col in movie_columns]
 
 if not available_metric_cols:
     st.warning("No suitable columns found for Metric Comparison.")
@@ -238,11 +256,14 @@ metric_category_col = st.sidebar.selectbox(
 # Call the plotly plot 
 with st.container():
     plot_plotly_bar(
-        df=df,
+        df=chart_df('rating', metric_category_col),
         category_col=metric_category_col,
         metric_type=metric_type,
         title=f"{metric_type} by {metric_category_col.replace('_', ' ').title()}",
-        genre_analysis_df=genre_analysis_df
+        # the genre analysis is only computed when the genres are selected
+        genre_analysis_df=get_df(data_store, 'genre_analysis_df') if metric_category_col == 'genres' and cube is None else None,
+        movies=movies,
+        cube=cube
     )
 
 st.markdown("---")
@@ -259,8 +280,9 @@ st.subheader("Ratings by customer activity level")
 if not df.empty:
     with st.container():
         plot_stacked_activity_rating_count(
-            df=df, 
-            title="Total Ratings Count by Activity Level and Rating Category"
+            df=chart_df('activity_level', 'rating_category'), 
+            title="Total Ratings Count by Activity Level and Rating Category",
+            cube=cube
         )
 else:
     st.warning("Main DataFrame is required for this stacked bar chart.")
@@ -279,8 +301,9 @@ st.info("The heatmap below shows the correlation between the movie rating, and t
 
 with st.container():
     plot_genre_rating_heatmap(
-        df=df, 
-        title="Correlation Matrix: Rating and Genres"
+        df=chart_df('rating'), 
+        title="Correlation Matrix: Rating and Genres",
+        movies=movies
     )
 
 st.markdown("---")
@@ -336,16 +359,42 @@ st.markdown("---")
 
 st.subheader("Animated Rating Evolution of Top 10 Movies")
 st.info("Watch the yearly average rating change for the Top 10 highest-rated movies (by Weighted Rating).")
+
+# rating years of the Netflix Prize data (ratings from November 1999 to December 2005)
+RATING_YEARS = (1999, 2005)
+
+st.sidebar.subheader("Animated Chart Controls")
+rating_years = st.sidebar.slider(
+    "Rating years:",
+    min_value=RATING_YEARS[0],
+    max_value=RATING_YEARS[1],
+    value=RATING_YEARS,
+    step=1,
+    key='animated_years'
+)
 # check  required dataframes 
 if not df.empty and not movies_by_rating.empty:
     # call plot 
     with st.container():
         plot_animated_rating_evolution(
             # df_main is the full history of all ratings
-            df_main=df, 
+            df_main=chart_df('rating', 'rating_day', 'rating_date'), 
             
             # movies_by_rating is the stats DF used to determine the top 10 movies
-            movies_by_rating=movies_by_rating
+            movies_by_rating=movies_by_rating,
+
+            # movie_index gives the rows of each movie without scanning df_main
+            movie_index=data_store.get('movie_index'),
+
+            # movies resolves the titles of the movie keys
+            movies=movies,
+
+            # SQL engine: the yearly aggregates of the top movies are one filtered query (None without duckdb)
+            engine=data_store.engine,
+
+            # partitioned ratings store: only the partitions of the selected years are read (None when not built)
+            partitioned=data_store.partitioned_store,
+            years=rating_years
         )
 else:
     st.warning("Cannot display animated chart: Both main data (df) and movie statistics (movies_by_rating) are required.")
@@ -382,8 +431,7 @@ try:
     
     #  Display the result
     if figure:
-        st.pyplot(figure)
-        plt.close(figure)
+        show_wordcloud_figure(figure)
         
     else:
         # Fallback for scraping failure
@@ -3,10 +3,8 @@ import string
 import unicodedata
 from typing import List, Set
 
-import requests
-from bs4 import BeautifulSoup
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+# requests, BeautifulSoup, wordcloud and matplotlib are imported by the functions using them:
+# importing this module (e.g. for the stopwords or the text cleaning) does not load them
 
 
 # Define stopwords list 
@@ -89,6 +87,9 @@ def generate_wordcloud(words: List[str]):
     matplotlib.figure.Figure
         The matplotlib figure containing the word cloud.
     """
+    from wordcloud import WordCloud
+    import matplotlib.pyplot as plt
+
     joined = " ".join(words)
     wc = WordCloud(width=1200, height=800, background_color="white")
     wc = wc.generate(joined)
@@ -118,6 +119,9 @@ def get_wordcloud_figure_from_url(url: str):
         )
     }
 
+    import requests
+    from bs4 import BeautifulSoup
+
     response = requests.get(url, headers=HEADERS)
     soup = BeautifulSoup(response.text, "html.parser")
     article = soup.find("article")
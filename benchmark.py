@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from netflix_parser import parse_file
+from ratings_store import RatingsStore, write_store_from_files
+from sampling import RatingReservoir, SamplingConfig, parse_size, run_sampling
+
+# Ingestion benchmark.
+#
+# Generates synthetic files in the exact combined_data format (movie headers followed by
+# customer,rating,date lines, with skewed movie and customer popularity) and times every ingest
+# path on them, stage by stage: parse, frame build, sample, write. Each path runs in a fresh
+# process so peak RSS is measured per path. Results are printed and written as JSON.
+#
+#   python benchmark.py --scales 1M 10M --out bench_results.json
+
+N_MOVIES = 17770
+MAX_CUSTOMER_ID = 2649429
+N_CUSTOMERS = 480189
+FIRST_DAY = np.datetime64('1999-11-11')
+LAST_DAY = np.datetime64('2005-12-31')
+
+DEFAULT_WORK_DIR = os.path.join('.cache', 'bench')
+PATHS = ('legacy', 'vectorized', 'store', 'reservoir')
+
+# sample size used by the benchmark, as a fraction of the lines (500k out of 100M in the project)
+SAMPLE_FRACTION = 0.005
+
+
+# SYNTHETIC DATA
+
+def _zipf_weights(n, exponent, rng):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def generate_combined_files(out_dir, n_lines, n_files=4, seed=0):
+    """
+    Writes n_files combined_data_<i>.txt files holding about n_lines rating lines in total.
+    Movies and customers follow zipf-like popularity, dates get denser towards 2005 like the real data.
+    Returns the list of written files and the number of rating lines written.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    movie_weights = _zipf_weights(N_MOVIES, 1.0, rng)
+    customer_ids = np.sort(rng.choice(np.arange(1, MAX_CUSTOMER_ID + 1), N_CUSTOMERS, replace=False))
+    customer_weights = _zipf_weights(N_CUSTOMERS, 0.6, rng)
+
+    n_days = int((LAST_DAY - FIRST_DAY).astype(int)) + 1
+    day_strings = np.datetime_as_string(FIRST_DAY + np.arange(n_days))
+
+    # number of ratings per movie, a movie cannot have more ratings than customers
+    per_movie = np.minimum(rng.multinomial(n_lines, movie_weights), N_CUSTOMERS)
+    movie_files = np.array_split(np.arange(1, N_MOVIES + 1), n_files)
+
+    paths = []
+    n_written = 0
+    for file_idx, movies in enumerate(movie_files, start=1):
+        path = os.path.join(out_dir, f'combined_data_{file_idx}.txt')
+        with open(path, 'w') as f:
+            # write the movies in chunks of about 1M lines
+            for chunk in np.array_split(movies, max(1, int(per_movie[movies - 1].sum() // 1_000_000) + 1)):
+                counts = per_movie[chunk - 1]
+                movie_col = np.repeat(chunk, counts)
+                customers = customer_ids[rng.choice(N_CUSTOMERS, len(movie_col), p=customer_weights)]
+
+                # a customer rates a movie only once
+                order = np.lexsort((customers, movie_col))
+                movie_col, customers = movie_col[order], customers[order]
+                unique = np.r_[True, (movie_col[1:] != movie_col[:-1]) | (customers[1:] != customers[:-1])]
+                movie_col, customers = movie_col[unique], customers[unique]
+
+                ratings = rng.choice(np.arange(1, 6), len(movie_col), p=[0.05, 0.10, 0.29, 0.34, 0.22])
+                days = np.minimum((n_days * np.sqrt(rng.random(len(movie_col)))).astype(np.int64), n_days - 1)
+
+                # each movie's first line is preceded by its 'NNN:' header
+                is_first = np.r_[True, movie_col[1:] != movie_col[:-1]]
+                headers = (pd.Series(movie_col).astype(str) + ':\n').where(is_first, '')
+                lines = pd.Series(customers).astype(str) + ',' + pd.Series(ratings).astype(str) + ',' + day_strings[days] + '\n'
+                f.write(''.join((headers + lines).to_numpy()))
+                n_written += len(lines)
+        paths.append(path)
+    return paths, n_written
+
+
+def synthetic_dataset(work_dir, n_lines, seed=0):
+    """
+    Generates (or reuses) the synthetic files of a scale.
+    Returns the data directory and the actual number of rating lines (duplicates pairs are dropped).
+    """
+    data_dir = os.path.join(work_dir, f'data_{n_lines}_{seed}')
+    done_flag = os.path.join(data_dir, '.complete')
+    if not os.path.exists(done_flag):
+        _, n_written = generate_combined_files(data_dir, n_lines, seed=seed)
+        with open(done_flag, 'w') as f:
+            json.dump({'lines': n_written}, f)
+    with open(done_flag) as f:
+        return data_dir, json.load(f)['lines']
+
+
+# MEASUREMENTS
+
+def current_rss():
+    """Resident memory of the current process in bytes."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class StageTimer:
+    """Times the stages of a path and records the peak RSS reached during each of them."""
+
+    def __init__(self, n_lines, interval=0.01):
+        self.n_lines = n_lines
+        self.interval = interval
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        peak = [current_rss()]
+        stop = threading.Event()
+
+        def poll():
+            while not stop.wait(self.interval):
+                peak[0] = max(peak[0], current_rss())
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_time
+            stop.set()
+            thread.join()
+            peak[0] = max(peak[0], current_rss())
+            self.stages.append({
+                'stage': name,
+                'wall_seconds': round(wall, 4),
+                'lines_per_second': round(self.n_lines / wall) if wall > 0 else None,
+                'peak_rss_mb': round(peak[0] / 2 ** 20, 1),
+            })
+
+
+# PATHS
+
+def _legacy_parse(file_path):
+    # the original per-line loop of sampling.py
+    data_rows = []
+    current_film_id = None
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith(':'):
+                current_film_id = int(line[:-1])
+            elif line:
+                try:
+                    customer_id, rating, date = line.split(',')
+                    data_rows.append([current_film_id, int(customer_id), int(rating), date])
+                except ValueError:
+                    continue
+    return data_rows
+
+
+def run_path(path_name, data_dir, work_dir, n_lines, seed=42):
+    """Runs one ingest path on a dataset and returns its stage measurements."""
+    files = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir) if name.startswith('combined_data_'))
+    sample_size = max(1, int(n_lines * SAMPLE_FRACTION))
+    output_file = os.path.join(work_dir, f'sample_{path_name}.csv')
+    timer = StageTimer(n_lines)
+
+    if path_name == 'legacy':
+        with timer.stage('parse'):
+            rows = [row for file_path in files for row in _legacy_parse(file_path)]
+        with timer.stage('frame build'):
+            df = pd.DataFrame(rows, columns=['movie_id', 'customer_id', 'rating', 'date'])
+            del rows
+        with timer.stage('sample'):
+            sample = df.sample(n=min(sample_size, len(df)), random_state=seed)
+    elif path_name in ('vectorized', 'store'):
+        if path_name == 'store':
+            store_dir = os.path.join(work_dir, f'store_{os.path.basename(data_dir)}')
+            if not os.path.exists(store_dir):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    write_store_from_files(files, store_dir)
+            with timer.stage('parse'):
+                store = RatingsStore(store_dir)
+                columns = {col: np.asarray(store.column(col)) for col in ('movie_id', 'customer_id', 'rating')}
+                columns['date'] = store.dates()
+        else:
+            with timer.stage('parse'):
+                parts = [parse_file(file_path) for file_path in files]
+                columns = {col: np.concatenate([part[col] for part in parts]) for col in parts[0]}
+                del parts
+        with timer.stage('frame build'):
+            df = pd.DataFrame(columns)
+            del columns
+        with timer.stage('sample'):
+            reservoir = RatingReservoir(sample_size, seed=seed)
+            reservoir.add({col: df[col].to_numpy() for col in df.columns})
+            sample = reservoir.to_frame()
+    elif path_name == 'reservoir':
+        # streaming path of sampling.py: parse and sample are fused, no frame of the whole data
+        with timer.stage('parse + sample'), contextlib.redirect_stdout(io.StringIO()):
+            sample = run_sampling(SamplingConfig(total=sample_size, seed=seed), data_dir=data_dir,
+                                  output_file=os.devnull)
+    else:
+        raise ValueError(f"Unknown benchmark path '{path_name}'.")
+
+    with timer.stage('write'):
+        sample.to_csv(output_file, index=False)
+
+    return {
+        'path': path_name,
+        'lines': n_lines,
+        'sample_size': len(sample),
+        'total_wall_seconds': round(sum(stage['wall_seconds'] for stage in timer.stages), 4),
+        'stages': timer.stages,
+    }
+
+
+def _run_path_task(args):
+    return run_path(*args)
+
+
+def run_benchmark(scales, paths=PATHS, work_dir=DEFAULT_WORK_DIR, seed=0):
+    """Runs every path on every scale (each path in a fresh process) and returns the results."""
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for n_lines in scales:
+        print(f"Preparing synthetic data ({n_lines:,} lines)...")
+        data_dir, n_written = synthetic_dataset(work_dir, n_lines, seed)
+        for path_name in paths:
+            print(f"Running {path_name} on {n_written:,} lines...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(_run_path_task, (path_name, data_dir, work_dir, n_written)).result()
+            result['scale'] = n_lines
+            results.append(result)
+            for stage in result['stages']:
+                print(f"  {stage['stage']:<15} {stage['wall_seconds']:>9.3f}s "
+                      f"{stage['lines_per_second'] or 0:>14,} lines/s {stage['peak_rss_mb']:>9.1f} MB peak RSS")
+    return results
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the ingestion paths on synthetic combined_data files.")
+    parser.add_argument('--scales', nargs='+', type=parse_size, default=[1_000_000],
+                        help="number of rating lines of each synthetic dataset, e.g. 1M 10M 100M")
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS))
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help="where the synthetic data and samples are written")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument('--out', default='bench_results.json', help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.scales, args.paths, args.work_dir, args.seed)
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment_info(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.out}.")
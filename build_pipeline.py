@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from date_codes import encode_date_strings
+from customer_activity import CustomerActivity
+from columnar_files import columnar_path, write_columnar
+from aggregate_cube import AggregateCube
+from movie_dimension import MovieDimension, rating_category_codes, typed_fact_table
+from movie_stats import MovieStats
+from parse_cache import file_content_hash
+from ratings_store import METADATA_FILE, RatingsStore
+
+# Build of the app data (data/main_df.csv, data/movies.csv and data/movies_by_rating.csv).
+#
+# This is the data management part of netflix_data_manag_v2.ipynb packaged as stages:
+#
+#   load       read the sampled ratings (CSV, or a ratings store), the movie titles and the genres
+#   merge      build the movie dimension and key the ratings by movie_key, drop ratings without year / genres
+#   derive     decade per movie, day codes, rating_category and activity_level per rating
+#   aggregate  movie statistics with the weighted rating (C = mean rating, m = 90th percentile of the counts)
+#   export     write the CSV files used by the streamlit app, with typed Arrow copies (see columnar_files.py)
+#
+# The data is a star schema (see movie_dimension.py): main_df.csv only holds integer keys and codes,
+# the movie attributes are stored once per movie in movies.csv.
+#
+# The output of every stage is cached in .cache/build under a key made of the stage code, the code
+# of the repo modules it runs (see STAGE_DEPENDENCIES), its parameters and the keys of its inputs (content hashes for the input files), so a stage only
+# runs again when something it depends on changed.
+#
+#   python build_pipeline.py --ratings netflix_sampled_500k_proportional.csv
+#   python build_pipeline.py --store data/ratings_store      (ratings read from a store, see ratings_store.py)
+
+DEFAULT_CACHE_DIR = os.path.join('.cache', 'build')
+DEFAULT_OUTPUT_DIR = 'data'
+
+DEFAULT_PARAMS = {
+    'ratings_path': 'netflix_sampled_500k_proportional.csv',
+    # ratings store read instead of ratings_path when given (memory-mapped columns, no text parsing)
+    'store_dir': None,
+    'titles_path': 'movie_titles.csv',
+    'genres_path': 'netflix_genres.csv',
+    'output_dir': DEFAULT_OUTPUT_DIR,
+    # quantile of the rating counts used as minimum votes threshold m of the weighted rating
+    'min_votes_quantile': 0.90,
+    # customers are divided in quantiles of their number of ratings (duplicate edges are dropped)
+    'activity_quantiles': 5,
+}
+
+# decades of the movies: the release years go from 1896 to 2005
+FIRST_DECADE, LAST_YEAR = 1890, 2005
+
+EXPORT_STAMP = '.build_stamp.json'
+
+
+# STAGES
+
+def load_stage(params):
+    """Reads the sampled ratings (from the CSV file or the ratings store), the movie titles and the genres."""
+    if params['store_dir']:
+        # typed columns of the store, the dates already are day codes
+        store = RatingsStore(params['store_dir'])
+        df_ratings = pd.DataFrame({col: store.column(col) for col in ('movie_id', 'customer_id', 'rating')})
+        df_ratings['rating_day'] = store.column('date')
+    else:
+        df_ratings = pd.read_csv(params['ratings_path'])
+
+    #Read and clean the movie titles file (titles can contain commas, so only split the first two)
+    titles_rows = []
+    with open(params['titles_path'], 'r', encoding='latin-1') as f:
+        for line in f:
+            parts = line.strip().split(',', 2)
+            if len(parts) == 3:
+                film_id, year, title = parts
+                titles_rows.append([int(film_id), year, title])
+    df_titles = pd.DataFrame(titles_rows, columns=['movie_id', 'year', 'title'])
+
+    df_genres = pd.read_csv(params['genres_path'])
+    return {'ratings': df_ratings, 'titles': df_titles, 'genres': df_genres}
+
+
+def merge_stage(loaded, params):
+    """
+    Builds the movie dimension (titles + genres, one row per movie) and keys the ratings by movie.
+    Ratings of movies without year or genres are dropped, like the dropna after the merges of the notebook.
+    """
+    movies = pd.merge(loaded['titles'], loaded['genres'], how='left', left_on='movie_id', right_on='movieId').drop('movieId', axis=1)
+
+    # year is a string in the titles file ('NULL' for a few titles)
+    movies['year'] = pd.to_numeric(movies['year'], errors='coerce')
+    movies = movies.dropna(subset=['year'])
+    movies = movies.dropna(subset=['genres'])
+    movies = movies.sort_values('movie_id').reset_index(drop=True)
+
+    ratings = loaded['ratings']
+    movie_keys = MovieDimension(movies).keys_for(ratings['movie_id'].to_numpy())
+    known = movie_keys >= 0
+    fact = pd.DataFrame({
+        'movie_key': movie_keys[known].astype(np.int32),
+        'customer_id': ratings['customer_id'].to_numpy()[known],
+        'rating': ratings['rating'].to_numpy()[known],
+    })
+    # date strings of the CSV, day codes of a ratings store
+    date_col = 'rating_day' if 'rating_day' in ratings.columns else 'date'
+    fact[date_col] = ratings[date_col].to_numpy()[known]
+    return {'movies': movies, 'ratings': fact}
+
+
+def derive_stage(merged, params):
+    """Creates the decade (per movie), rating_category and activity_level (per rating) variables."""
+    movies = merged['movies'].copy()
+    year = movies['year'].astype(int)
+    movies['year'] = year
+
+    # decade of release, e.g. 1994 -> '1990s'
+    decade = (year // 10 * 10).astype(str) + 's'
+    in_range = (year >= FIRST_DECADE) & (year <= LAST_YEAR)
+    movies['decade'] = decade.where(in_range, 'Out of Range')
+
+    ratings = merged['ratings']
+    fact = ratings[['movie_key', 'customer_id', 'rating']].copy()
+    # dates become uint16 day codes (see date_codes.py)
+    fact['rating_day'] = ratings['rating_day'] if 'rating_day' in ratings.columns else encode_date_strings(ratings['date'])
+
+    # rating category, stored as the code of RATING_CATEGORIES
+    rating = fact['rating'].to_numpy()
+    fact['rating_category'] = rating_category_codes(rating)
+
+    # divide users based on activity levels (quantiles of their number of ratings), stored as the
+    # code of ACTIVITY_LEVELS (see customer_activity.py, which does the same over a whole ratings store)
+    customer_ids = fact['customer_id'].to_numpy()
+    activity = CustomerActivity.from_ratings(customer_ids, rating, params['activity_quantiles'])
+    fact['activity_level'] = activity.levels_for(customer_ids)
+    return {'movies': movies, 'ratings': fact}
+
+
+def aggregate_stage(derived, params):
+    """Adds the rating statistics and the weighted rating to the movie dimension."""
+    table = derived['movies'].copy()
+    ratings = derived['ratings']
+
+    # sufficient statistics per movie_key (see movie_stats.py)
+    stats = MovieStats(np.zeros(len(table), dtype=np.int64), min_votes_quantile=params['min_votes_quantile'])
+    stats.add_batch(ratings['movie_key'].to_numpy(), ratings['rating'].to_numpy())
+
+    # C: overall average rating, m: minimum votes threshold (over the rated movies)
+    table['rating_count'] = stats.count
+    table['avg_rating'] = stats.avg_rating()
+    table['weighted_rating'] = stats.weighted_rating()
+    return {'movies': table, 'C': stats.mean_rating(), 'm': stats.min_votes()}
+
+
+def export_stage(derived, aggregates, params):
+    """Writes the files read by data_loader.py."""
+    output_dir = params['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    movies = MovieDimension(aggregates['movies'])
+    paths = {
+        'main_df': os.path.join(output_dir, 'main_df.csv'),
+        'movies': movies.save(output_dir),
+        'movies_by_rating': os.path.join(output_dir, 'movies_by_rating.csv'),
+    }
+    derived['ratings'].to_csv(paths['main_df'], index=False)
+    # typed copy read by the app (dtypes of data_loader.py, no casts on load)
+    if write_columnar(typed_fact_table(derived['ratings'].copy()), paths['main_df']):
+        paths['main_df_arrow'] = columnar_path(paths['main_df'])
+        paths['movies_arrow'] = columnar_path(paths['movies'])
+    # dashboard aggregates (see aggregate_cube.py): the charts never group the ratings
+    paths['aggregate_cube'], paths['genre_cube'] = AggregateCube.from_fact_table(derived['ratings'], movies).save(output_dir)
+    # ranking of the rated movies, same layout as the notebook export
+    movies.ranking_frame().drop(columns='movie_key').to_csv(paths['movies_by_rating'], index=False)
+
+    # statistics by movie id, the base that daily rating batches are added to (python movie_stats.py --append);
+    # restricted to the movies of the dimension like the ratings above
+    ratings = derived['ratings']
+    stats = MovieStats(min_votes_quantile=params['min_votes_quantile'], movie_ids=movies.table['movie_id'].to_numpy())
+    stats.add_batch(movies.lookup(ratings['movie_key'].to_numpy(), 'movie_id'), ratings['rating'].to_numpy(),
+                    source=params['store_dir'] or params['ratings_path'])
+    paths['movie_stats'] = os.path.join(output_dir, 'movie_stats')
+    stats.save(paths['movie_stats'])
+    return paths
+
+
+# CACHE
+
+# code run by a stage besides its own function: the modules defining these objects, and the repo
+# modules they import, are part of the stage key (an edit of any of them reruns the stage)
+STAGE_DEPENDENCIES = {
+    'load': (RatingsStore,),
+    'merge': (MovieDimension,),
+    'derive': (encode_date_strings, CustomerActivity, rating_category_codes),
+    'aggregate': (MovieStats,),
+    'export': (MovieDimension, typed_fact_table, write_columnar, AggregateCube, MovieStats),
+}
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _repo_modules(module, found):
+    """Adds module and the repo modules it imports (directly or not) to found, by file path."""
+    path = os.path.abspath(module.__file__)
+    if path in found:
+        return found
+    found[path] = module
+    for value in vars(module).values():
+        dependency = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+        dependency_path = getattr(dependency, '__file__', None)
+        if dependency_path and os.path.dirname(os.path.abspath(dependency_path)) == _REPO_DIR:
+            _repo_modules(dependency, found)
+    return found
+
+
+def _code_hash(func, dependencies=()):
+    """Hash of the code of a function and of the modules of its dependencies (see STAGE_DEPENDENCIES)."""
+    digest = hashlib.blake2b(inspect.getsource(func).encode(), digest_size=8)
+    modules = {}
+    for dependency in dependencies:
+        _repo_modules(inspect.getmodule(dependency), modules)
+    # sorted by path: the same key whether this file runs as a script or is imported
+    for path in sorted(modules):
+        digest.update(inspect.getsource(modules[path]).encode())
+    return digest.hexdigest()
+
+
+def stage_key(name, func, *parts):
+    """Key of a stage output: stage name, code of the stage and of its dependencies, everything it depends on."""
+    payload = json.dumps([name, _code_hash(func, STAGE_DEPENDENCIES[name]), *parts], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class StageCache:
+    """Pickled stage outputs in cache_dir, one file per stage key."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, force=False):
+        self.cache_dir = cache_dir
+        self.force = force
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def run(self, name, key, compute):
+        path = os.path.join(self.cache_dir, f'{name}-{key}.pkl')
+        start_time = time.perf_counter()
+        if not self.force and os.path.exists(path):
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            print(f"[{name}] cached ({time.perf_counter() - start_time:.2f}s)")
+            return result
+
+        result = compute()
+        # write then rename so an interrupted build never leaves a truncated cache file
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+        # older outputs of the same stage are not needed anymore
+        for old_file in os.listdir(self.cache_dir):
+            if old_file.startswith(f'{name}-') and old_file != os.path.basename(path):
+                os.remove(os.path.join(self.cache_dir, old_file))
+
+        print(f"[{name}] computed ({time.perf_counter() - start_time:.2f}s)")
+        return result
+
+
+# PIPELINE
+
+def run_pipeline(params=None, cache_dir=DEFAULT_CACHE_DIR, force=False):
+    """
+    Runs the stages, reusing the cached output of every stage whose inputs, parameters and code did
+    not change. Returns a dict with the main DataFrame, the aggregates and the exported paths.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    cache = StageCache(cache_dir, force)
+
+    # a store is keyed by its metadata, rewritten (with its creation time) whenever the store is
+    ratings_source = os.path.join(params['store_dir'], METADATA_FILE) if params['store_dir'] else params['ratings_path']
+    input_hashes = {'ratings': file_content_hash(ratings_source),
+                    **{name: file_content_hash(params[name]) for name in ('titles_path', 'genres_path')}}
+
+    load_key = stage_key('load', load_stage, input_hashes)
+    loaded = cache.run('load', load_key, lambda: load_stage(params))
+
+    merge_key = stage_key('merge', merge_stage, load_key)
+    merged = cache.run('merge', merge_key, lambda: merge_stage(loaded, params))
+
+    derive_key = stage_key('derive', derive_stage, merge_key, params['activity_quantiles'], FIRST_DECADE, LAST_YEAR)
+    derived = cache.run('derive', derive_key, lambda: derive_stage(merged, params))
+
+    aggregate_key = stage_key('aggregate', aggregate_stage, derive_key, params['min_votes_quantile'])
+    aggregates = cache.run('aggregate', aggregate_key, lambda: aggregate_stage(derived, params))
+
+    export_key = stage_key('export', export_stage, derive_key, aggregate_key)
+    paths = export(derived, aggregates, params, export_key, force)
+    return {'main_df': derived['ratings'], 'movies': aggregates['movies'], 'aggregates': aggregates, 'paths': paths}
+
+
+def export(derived, aggregates, params, key, force=False):
+    """Export stage: the files are rewritten only when their content would change."""
+    stamp_path = os.path.join(params['output_dir'], EXPORT_STAMP)
+    if not force and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            stamp = json.load(f)
+        if stamp.get('key') == key and all(os.path.exists(path) for path in stamp['paths'].values()):
+            print("[export] up to date")
+            return stamp['paths']
+
+    start_time = time.perf_counter()
+    paths = export_stage(derived, aggregates, params)
+    with open(stamp_path, 'w') as f:
+        json.dump({'key': key, 'paths': paths}, f, indent=2)
+    print(f"[export] written ({time.perf_counter() - start_time:.2f}s)")
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the data files of the streamlit app from the sampled ratings.")
+    parser.add_argument('--ratings', default=DEFAULT_PARAMS['ratings_path'], help="sampled ratings CSV (see sampling.py)")
+    parser.add_argument('--store', help="read the ratings from this ratings store instead of --ratings (see ratings_store.py)")
+    parser.add_argument('--titles', default=DEFAULT_PARAMS['titles_path'])
+    parser.add_argument('--genres', default=DEFAULT_PARAMS['genres_path'])
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--min-votes-quantile', type=float, default=DEFAULT_PARAMS['min_votes_quantile'])
+    parser.add_argument('--activity-quantiles', type=int, default=DEFAULT_PARAMS['activity_quantiles'])
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--force', action='store_true', help="recompute every stage")
+    args = parser.parse_args()
+
+    result = run_pipeline({
+        'ratings_path': args.ratings,
+        'store_dir': args.store,
+        'titles_path': args.titles,
+        'genres_path': args.genres,
+        'output_dir': args.output_dir,
+        'min_votes_quantile': args.min_votes_quantile,
+        'activity_quantiles': args.activity_quantiles,
+    }, cache_dir=args.cache_dir, force=args.force)
+
+    aggregates = result['aggregates']
+    print(f"main_df: {len(result['main_df']):,} ratings, {len(result['movies']):,} movies, C = {aggregates['C']:.3f}, m = {aggregates['m']:.1f}")
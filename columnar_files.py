@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # without pyarrow only the CSV files are written and read
+    feather = None
+
+# Typed columnar copies of the app data files.
+#
+# A CSV file keeps no types: every cold start of the app parsed the text again, then rebuilt the
+# datetimes, the nullable integers and the ordered categoricals. The build also writes every table
+# as an Arrow IPC (Feather v2) file next to its CSV file (data/main_df.csv -> data/main_df.arrow).
+# The file stores the pandas dtypes (Int64, uint16, datetime64, ordered categoricals as dictionary
+# columns), so data_loader.py gets columns ready to use and reads only the columns it asks for.
+# The files are not compressed: a column is read as it is laid out in memory (Parquet, which has
+# to decode its pages, was ~2.5x slower to load on the 500k sample).
+#
+# The CSV files stay the readable export (and the output of the notebook); they are read when
+# there is no copy or when the copy is older than the CSV file (e.g. a CSV re-exported by the
+# notebook after a build).
+#
+# map_columnar returns the columns without reading them: every column is written as a single
+# record batch, so a column of the memory-mapped file is one contiguous buffer and the DataFrame
+# is made of read-only NumPy views of the file (the Int64 ratings get a mask that is never
+# written to, so it costs no resident memory either). The pages of the file are shared by the
+# page cache: the sessions of the app and the processes of several replicas on one host attach
+# to the same copy, the memory does not grow with the number of users. Columns that cannot be
+# viewed (missing values, older files written in several batches) are copied.
+
+COLUMNAR_SUFFIX = '.arrow'
+
+# pandas dtypes stored as a masked array (values + boolean mask)
+_MASKED_DTYPES = {'Int8', 'Int16', 'Int32', 'Int64', 'UInt8', 'UInt16', 'UInt32', 'UInt64', 'Float32', 'Float64'}
+
+
+def columnar_path(csv_path):
+    return os.path.splitext(csv_path)[0] + COLUMNAR_SUFFIX
+
+
+def write_columnar(df, csv_path):
+    """Writes the typed copy of a table (next to csv_path). Returns its path, None without pyarrow."""
+    if feather is None:
+        return None
+    path = columnar_path(csv_path)
+    # one record batch: every column is contiguous in the file (see map_columnar)
+    df.reset_index(drop=True).to_feather(path + '.tmp', compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_columnar(csv_path, columns=None):
+    """
+    Reads the typed copy of a table with only the given columns (the ones it has), or returns
+    None when the CSV file has to be read instead (no copy, older copy, no pyarrow).
+    """
+    table = _mapped_table(csv_path, columns)
+    return None if table is None else table.to_pandas()
+
+
+def map_columnar(csv_path, columns=None):
+    """
+    Like read_columnar, but the columns are read-only views of the memory-mapped file instead of
+    copies (zero copy, shared by every process mapping the file). The frame must not be modified.
+    """
+    table = _mapped_table(csv_path, columns)
+    if table is None:
+        return None
+
+    # nullable integer columns (e.g. Int64 ratings): pyarrow copies them to build their mask,
+    # a column without missing values is viewed with a mask of zeros instead
+    dtypes = {col['name']: col['numpy_type'] for col in (table.schema.pandas_metadata or {}).get('columns', [])}
+    masked = {}
+    for name in table.column_names:
+        column = table.column(name)
+        dtype = dtypes.get(name)
+        if dtype in _MASKED_DTYPES and column.num_chunks == 1 and column.null_count == 0:
+            values = column.chunk(0).to_numpy(zero_copy_only=True)
+            # np.zeros pages are only allocated when written to
+            masked[name] = pd.api.types.pandas_dtype(dtype).construct_array_type()(values, np.zeros(len(values), dtype=bool))
+
+    # split_blocks: one block per column, viewing the buffer of the file when its layout allows it
+    viewed = table.drop_columns(list(masked)).to_pandas(split_blocks=True)
+    # a dict of columns builds the frame without consolidating (copying) them
+    return pd.DataFrame({name: masked[name] if name in masked else viewed[name] for name in table.column_names}, copy=False)
+
+
+def _mapped_table(csv_path, columns=None):
+    # memory-mapped Arrow table of the typed copy with the selected columns, None if it cannot be used
+    path = columnar_path(csv_path)
+    if feather is None or not os.path.exists(path):
+        return None
+    if os.path.exists(csv_path) and os.path.getmtime(path) < os.path.getmtime(csv_path):
+        return None
+    table = feather.read_table(path, memory_map=True)
+    if columns is not None:
+        table = table.select([col for col in columns if col in table.column_names])
+    return table
@@ -0,0 +1,188 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from movie_dimension import ACTIVITY_LEVELS
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+
+# Customer activity segmentation.
+#
+# Customers are labelled Low / Medium / High by quantile of their number of ratings (pd.qcut with
+# q=5 and duplicate edges dropped, as in the notebook; when more than 3 bins are left, e.g. on the
+# full corpus, the bins between the first and the last one are Medium). Instead of a groupby over a DataFrame of
+# every rating, the number and the sum of the ratings of every customer are accumulated block by
+# block into arrays indexed by customer id, so the 100M ratings of a ratings store are segmented
+# with a few arrays of the size of the customer ids (2.6M) in memory.
+#
+# The customers with ratings are then mapped to a dense index (customer ids in increasing order,
+# like the groupby), labelled, and the label of every rating is written block by block next to
+# the store:
+#
+#   ratings_store/activity/
+#       customer_ids.npy, num_ratings.npy, rating_sums.npy, level_codes.npy   (one entry per customer)
+#       activity_level.bin   int8 code of ACTIVITY_LEVELS for every rating of the store
+#
+#   python customer_activity.py --store data/ratings_store
+
+ACTIVITY_DIR = 'activity'
+LEVELS_FILE = 'activity_level.bin'
+CUSTOMER_ARRAYS = ('customer_ids', 'num_ratings', 'rating_sums', 'level_codes')
+
+# customers are divided in quantiles of their number of ratings (duplicate edges are dropped)
+ACTIVITY_QUANTILES = 5
+
+
+def activity_levels(num_ratings, quantiles=ACTIVITY_QUANTILES, bins=None):
+    """
+    Labels the customers by quantile of their number of ratings. Duplicate quantile edges are
+    dropped (most customers of the sample have 1 rating); when 3 bins are left they are the labels,
+    like the notebook, otherwise the first bin is Low, the last one High and the bins between them
+    Medium (a single bin is Medium). Precomputed edges (e.g. read from a quantile sketch, see
+    quantile_sketch.py) can be given as bins.
+    """
+    if bins is None:
+        _, bins = pd.qcut(num_ratings, q=quantiles, labels=False, duplicates='drop', retbins=True)
+    n_bins = len(bins) - 1
+    if n_bins == len(ACTIVITY_LEVELS):
+        return pd.cut(num_ratings, bins, labels=ACTIVITY_LEVELS, include_lowest=True)
+
+    bin_codes = pd.cut(np.asarray(num_ratings), bins, labels=False, include_lowest=True)
+    bin_codes = np.where(np.isnan(bin_codes), -1, bin_codes).astype(np.int64)
+    level_codes = np.where(bin_codes < 0, -1, 1)
+    if n_bins > 1:
+        level_codes[bin_codes == 0] = 0
+        level_codes[bin_codes == n_bins - 1] = len(ACTIVITY_LEVELS) - 1
+    levels = pd.Categorical.from_codes(level_codes, categories=ACTIVITY_LEVELS, ordered=True)
+    if isinstance(num_ratings, pd.Series):
+        return pd.Series(levels, index=num_ratings.index, name=num_ratings.name)
+    return levels
+
+
+class CustomerActivity:
+    """Number and sum of the ratings of every customer (dense index) with their activity level code."""
+
+    def __init__(self, customer_ids, num_ratings, rating_sums, quantiles=ACTIVITY_QUANTILES, level_codes=None, bins=None):
+        self.customer_ids = np.asarray(customer_ids)
+        self.num_ratings = np.asarray(num_ratings)
+        self.rating_sums = np.asarray(rating_sums)
+        self.quantiles = quantiles
+
+        # customer id -> dense index
+        max_id = int(self.customer_ids.max()) if len(self.customer_ids) else -1
+        self._index_of = np.full(max_id + 1, -1, dtype=np.int32)
+        self._index_of[self.customer_ids] = np.arange(len(self.customer_ids), dtype=np.int32)
+
+        # quantiles=None only accumulates, the customers are not labelled
+        if level_codes is None and quantiles is None and bins is None:
+            level_codes = np.full(len(self.customer_ids), -1)
+        elif level_codes is None:
+            levels = activity_levels(pd.Series(self.num_ratings, index=self.customer_ids), quantiles, bins)
+            level_codes = levels.cat.codes.to_numpy()
+        self.level_codes = np.asarray(level_codes, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.customer_ids)
+
+    @classmethod
+    def from_blocks(cls, blocks, quantiles=ACTIVITY_QUANTILES, bins=None):
+        """
+        Accumulates (customer_ids, ratings) blocks into arrays indexed by customer id (grown when
+        a block brings a higher id), then keeps the customers having ratings.
+        """
+        counts = np.zeros(0, dtype=np.int64)
+        sums = np.zeros(0, dtype=np.float64)
+        for customer_ids, ratings in blocks:
+            customer_ids = np.asarray(customer_ids, dtype=np.int64)
+            n_ids = max(len(counts), int(customer_ids.max()) + 1 if len(customer_ids) else 0)
+            if n_ids > len(counts):
+                counts = np.concatenate([counts, np.zeros(n_ids - len(counts), dtype=np.int64)])
+                sums = np.concatenate([sums, np.zeros(n_ids - len(sums), dtype=np.float64)])
+            counts += np.bincount(customer_ids, minlength=n_ids)
+            sums += np.bincount(customer_ids, weights=np.asarray(ratings, dtype=np.float64), minlength=n_ids)
+
+        customer_ids = np.flatnonzero(counts).astype(np.int32)
+        return cls(customer_ids, counts[customer_ids], sums[customer_ids], quantiles, bins=bins)
+
+    @classmethod
+    def from_ratings(cls, customer_ids, ratings, quantiles=ACTIVITY_QUANTILES):
+        """Segmentation of in-memory arrays (e.g. the ratings of the sample)."""
+        return cls.from_blocks([(customer_ids, ratings)], quantiles)
+
+    @classmethod
+    def from_store(cls, store, block_rows=10_000_000, quantiles=ACTIVITY_QUANTILES, bins=None):
+        """Segmentation of every rating of a ratings store, streamed block by block."""
+        blocks = (
+            (store.column('customer_id')[start:start + block_rows], store.column('rating')[start:start + block_rows])
+            for start in range(0, len(store), block_rows)
+        )
+        return cls.from_blocks(blocks, quantiles, bins)
+
+    def avg_rating(self):
+        return self.rating_sums / self.num_ratings
+
+    def levels_for(self, customer_ids):
+        """Activity level code of every customer id (-1 for the unknown customers)."""
+        customer_ids = np.asarray(customer_ids)
+        inside = (customer_ids >= 0) & (customer_ids < len(self._index_of))
+        index = np.where(inside, self._index_of[np.where(inside, customer_ids, 0)], -1)
+        return np.where(index >= 0, self.level_codes[index], -1).astype(np.int8)
+
+    def summary(self):
+        """Number of customers, ratings and range of ratings per customer of every activity level."""
+        summary = pd.DataFrame({
+            'activity_level': pd.Categorical.from_codes(self.level_codes, categories=ACTIVITY_LEVELS, ordered=True),
+            'num_ratings': self.num_ratings,
+        }).groupby('activity_level', observed=False)['num_ratings'].agg(['count', 'sum', 'min', 'max'])
+        return summary.rename(columns={'count': 'customers', 'sum': 'ratings'})
+
+    def save(self, activity_dir):
+        os.makedirs(activity_dir, exist_ok=True)
+        for name in CUSTOMER_ARRAYS:
+            np.save(os.path.join(activity_dir, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, activity_dir, quantiles=ACTIVITY_QUANTILES):
+        arrays = {name: np.load(os.path.join(activity_dir, f'{name}.npy')) for name in CUSTOMER_ARRAYS}
+        return cls(quantiles=quantiles, **arrays)
+
+
+def write_store_levels(store_dir=DEFAULT_STORE_DIR, block_rows=10_000_000, quantiles=ACTIVITY_QUANTILES, bins=None):
+    """
+    Segments the customers of a ratings store and writes the activity level of every rating
+    under <store_dir>/activity/, one block at a time (bounded memory).
+    """
+    store = RatingsStore(store_dir)
+    activity = CustomerActivity.from_store(store, block_rows, quantiles, bins)
+
+    activity_dir = os.path.join(store_dir, ACTIVITY_DIR)
+    activity.save(activity_dir)
+    levels_path = os.path.join(activity_dir, LEVELS_FILE)
+    with open(levels_path + '.tmp', 'wb') as f:
+        for start in range(0, len(store), block_rows):
+            f.write(activity.levels_for(store.column('customer_id')[start:start + block_rows]).tobytes())
+    os.replace(levels_path + '.tmp', levels_path)
+    return activity
+
+
+def load_store_levels(store_dir=DEFAULT_STORE_DIR):
+    """Activity level codes of every rating of a store (memory-mapped), see write_store_levels."""
+    path = os.path.join(store_dir, ACTIVITY_DIR, LEVELS_FILE)
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=np.int8)
+    return np.memmap(path, dtype=np.int8, mode='r')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Customer activity segmentation of every rating of a ratings store.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--quantiles', type=int, default=ACTIVITY_QUANTILES)
+    parser.add_argument('--block-rows', type=int, default=10_000_000, help="ratings read per block")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    activity = write_store_levels(args.store, args.block_rows, args.quantiles)
+    print(f"{len(activity):,} customers segmented in {time.perf_counter() - start_time:.1f}s.")
+    print(activity.summary().to_string())
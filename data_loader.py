@@ -1,131 +1,390 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+from ratings_index import frame_index
+from columnar_files import columnar_path, map_columnar
+from disk_cache import DERIVED_CACHE, cache_key
+from dtype_plan import DATE_CODE_COLUMNS, apply_dtype_plan, date_column, format_memory_report, memory_report
+from aggregate_cube import CUBE_FILE, AggregateCube
+from customer_activity import ACTIVITY_DIR, LEVELS_FILE, load_store_levels
+from query_engine import QueryEngine
+from partitioned_store import DEFAULT_PARTITIONED_DIR, MANIFEST_FILE, PartitionedStore
+from movie_dimension import DIMENSION_FILE, MovieDimension, store_fact_table, to_fact_table, typed_fact_table
+
+DATA_DIR = 'data'
+
+FILES_TO_LOAD = {
+    'main_df': 'main_df.csv',
+    'movies_by_rating': 'movies_by_rating.csv',
+}
+
+# datasets of a DataStore: main_df, the movie dimension and the frames derived from them
+DATASETS = ('main_df', 'movies', 'movies_by_rating', 'genre_analysis_df', 'movie_index', 'cube')
+
+
+def load_data(columns=None):
+    """
+    Returns a DataStore giving lazy access to the app datasets, or None when the data files are
+    missing. Nothing is read here: a dataset is loaded the first time it is asked for (see get_df).
+    columns selects the columns of main_df returned by default (all of them when None).
+
+    The data is a star schema (see movie_dimension.py): main_df holds the ratings with integer keys
+    and 'movies' the movie dimension, movie attributes (title, year, decade, genres) are
+    resolved by indexing the dimension with movie_key. A main_df exported with the movie attributes
+    on every rating (netflix_data_manag_v2.ipynb) is converted on load. Without a main_df file,
+    main_df is built from the ratings store (data/ratings_store, see ratings_store.py) keyed by the
+    movie dimension data/movies.csv.
+
+    Unlike the denormalized export, the main_df returned without columns is the fact table as
+    stored: the movie attributes are not on its rows anymore. Code reading e.g. main_df['genres']
+    asks for them explicitly: get_df(store, 'main_df', columns=['genres']).
+    """
+    file_path = os.path.join(DATA_DIR, FILES_TO_LOAD['main_df'])
+    if not os.path.exists(file_path) and not os.path.exists(columnar_path(file_path)) and not _has_store_source(DATA_DIR):
+        st.error(f"Error: File '{file_path}' not found. Did you run build_pipeline.py (or your Jupyter export script)?")
+        return None
+    return DataStore(DATA_DIR, columns)
+
+
+class DataStore:
+    """
+    Lazy access to the datasets of a data directory. main_df is read with only the requested
+    columns, the derived datasets (genre_analysis_df, indexes ...) are computed on first use, and
+    every result is kept for the next calls. The files are read by st.cache_data functions, so
+    the next runs of the app do not read them again either, and the derived datasets are also
+    kept on disk (see disk_cache.py) for the next starts of the app.
+
+    main_df and the indexes are shared, not copied: every session gets the same read-only columns
+    (memory-mapped from the typed Arrow copy, see columnar_files.map_columnar), a DataStore only
+    holds references to them. They must not be modified in place.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, columns=None):
+        # absolute: the files are read later, possibly after a change of working directory
+        self.data_dir = os.path.abspath(data_dir)
+        self.columns = None if columns is None else tuple(columns)
+        self._loaded = {}
+        self._plan_reported = False
+
+    def __contains__(self, key):
+        return key in DATASETS
+
+    def __getitem__(self, key):
+        if key not in DATASETS:
+            raise KeyError(key)
+        return self.get(key)
+
+    def get(self, key, default=None, columns=None):
+        """
+        Dataset `key` (default when unknown). For main_df, columns selects the columns: movie
+        attributes (e.g. 'genres', 'title') are resolved from the dimension by movie_key and
+        rating_date is rebuilt from the day codes.
+        """
+        if key not in DATASETS:
+            return default
+        if key == 'main_df':
+            return self._main_df(self.columns if columns is None else tuple(columns))
+        if key not in self._loaded:
+            self._loaded[key] = getattr(self, f'_load_{key}')()
+        return self._loaded[key]
+
+    def _main_df(self, columns):
+        if ('main_df', columns) not in self._loaded:
+            self._loaded[('main_df', columns)] = _main_df_columns(self.data_dir, columns)
+            self._report_dtype_plan()
+        return self._loaded[('main_df', columns)]
+
+    def _report_dtype_plan(self):
+        # shown once per run, whatever the number of column selections read
+        if not self._plan_reported:
+            self._plan_reported = True
+            summary = _load_main_df(self.data_dir)[1]
+            if summary:
+                st.info(f"Memory-optimized dtypes applied, {summary}. Per-column report: python dtype_plan.py")
+
+    def _load_movies(self):
+        return _read_movies(self.data_dir)
+
+    def _load_movies_by_rating(self):
+        # the movie statistics are part of the dimension
+        return self.get('movies').ranking_frame()
+
+    def _load_genre_analysis_df(self):
+        return _genre_analysis(self.data_dir)
+
+    def _load_movie_index(self):
+        # CSR index: the rows of one movie become an O(1) slice instead of a mask
+        return _index(self.data_dir, 'movie_key')
+
+    @property
+    def engine(self):
+        """SQL engine over main_df, the movie dimension and the ratings store (None without duckdb)."""
+        return _query_engine(self.data_dir)
+
+    @property
+    def partitioned_store(self):
+        """Ratings store partitioned by rating year (None if it has not been built), see partitioned_store.py."""
+        return load_partitioned_store()
+
+    def query(self, sql, params=None):
+        """Result of a SQL query on the views of query_engine.py (ratings, movies, movie_genres, store_ratings)."""
+        return self.engine.sql(sql, params)
+
+    def _load_cube(self):
+        # aggregates of the charts, None when the build did not write them (e.g. notebook export)
+        return _read_cube(self.data_dir)
+
+
+def _data_files(data_dir):
+    # files the datasets are read from: keys of the derived datasets in the disk cache
+    paths = [os.path.join(data_dir, filename) for filename in (*FILES_TO_LOAD.values(), DIMENSION_FILE)]
+    return paths + [columnar_path(path) for path in paths] + [os.path.abspath(os.path.join(DEFAULT_STORE_DIR, 'metadata.json'))]
+
+
+def _has_store_source(data_dir):
+    # main_df can be built from the ratings store when the movie dimension has been built
+    return load_ratings_store() is not None and os.path.exists(os.path.join(data_dir, DIMENSION_FILE))
+
+
+def _is_star_schema(data_dir):
+    # main_df.csv written by build_pipeline.py (movie_key) or by the notebook (movie attributes)
+    file_path = os.path.join(data_dir, FILES_TO_LOAD['main_df'])
+    if not os.path.exists(file_path):
+        return True
+    return 'movie_key' in pd.read_csv(file_path, nrows=0).columns
+
 
 @st.cache_data
-def load_data():
-    """
-    Loads all DataFrames from CSV files, performs necessary type conversions,
-    and caches the result.
-    """
-    data_dict = {}
-    
-    files_to_load = {
-        'main_df': 'main_df.csv',
-        'movies_by_rating': 'movies_by_rating.csv',
-        
-    }
-    
-    load_successful = True
-    
-    for key, filename in files_to_load.items():
-        file_path = os.path.join('data', filename)
-        try:
-            df = pd.read_csv(file_path)
-            
-            # --- CRITICAL CSV TYPE CONVERSION & ORDERED CATEGORICALS ---
-            if key == 'main_df':
-                
-                # Date, Year, and Rating Conversions
-                if 'date' in df.columns:
-                    df['date'] = pd.to_datetime(df['date'], errors='coerce') 
-                    df.rename(columns={'date': 'rating_date'}, inplace=True)
-                
-                if 'year' in df.columns:
-                    df['year'] = pd.to_numeric(df['year'], errors='coerce').astype('Int64') 
-                                
-                if 'rating' in df.columns:
-                    df['rating'] = pd.to_numeric(df['rating'], errors='coerce').astype('Int64')
-                
-                # Define and apply ORDERED CATEGORICAL TYPES (Activity Level, Rating Category)
-                if 'activity_level' in df.columns:
-                    level_order = ['Low', 'Medium', 'High']
-                    df['activity_level'] = pd.Categorical(df['activity_level'], categories=level_order, ordered=True)
-
-                if 'rating_category' in df.columns:
-                    category_order = ['Low', 'Neutral', 'High']
-                    df['rating_category'] = pd.Categorical(df['rating_category'], categories=category_order, ordered=True)
-                
-            
-            data_dict[key] = df
-            
-        except FileNotFoundError:
-            st.error(f"Error: File '{file_path}' not found. Did you run your Jupyter export script?")
-            load_successful = False
-            break
-            
-    if not load_successful:
+def _read_movies(data_dir):
+    """Movie dimension: written by build_pipeline.py, or rebuilt from a denormalized export."""
+    if _is_star_schema(data_dir):
+        return MovieDimension.load(data_dir)
+    df = pd.read_csv(os.path.join(data_dir, FILES_TO_LOAD['main_df']))
+    movies_path = os.path.join(data_dir, FILES_TO_LOAD['movies_by_rating'])
+    movies_by_rating = pd.read_csv(movies_path) if os.path.exists(movies_path) else None
+    return MovieDimension.from_denormalized(df, movies_by_rating)
+
+
+def _select_columns(df, columns):
+    # columns of a frame without copying them (df[list] copies the data)
+    return pd.DataFrame({col: df[col] for col in columns if col in df.columns}, copy=False)
+
+
+@st.cache_resource
+def _main_df_columns(data_dir, columns=None):
+    """
+    main_df with the given columns, movie attributes (e.g. 'genres', 'title') resolved from the
+    dimension by movie_key and rating_date rebuilt from the day codes (see dtype_plan.py). Shared by
+    the sessions: the attributes are resolved once per process.
+    """
+    if columns is None:
+        return _read_main_df(data_dir)
+    movies = _read_movies(data_dir)
+    attributes = [col for col in columns if col in movies.columns]
+    dates = [col for col in columns if col in DATE_CODE_COLUMNS]
+    # movie_key is always read: it links the ratings to the dimension and the indexes
+    stored = ['movie_key', *[col for col in columns if col not in attributes and col not in dates]]
+    stored = tuple(dict.fromkeys(stored + [DATE_CODE_COLUMNS[col] for col in dates]))
+    # shallow copy: the shared columns are referenced, only the attributes are added
+    df = _read_main_df(data_dir, stored).copy(deep=False)
+    for col in attributes:
+        df[col] = movies.resolve(df, col)
+    for col in dates:
+        df[col] = date_column(df, col)
+    return df
+
+
+@st.cache_resource
+def _read_main_df(data_dir, columns=None):
+    """
+    Ratings of main_df with only the given columns: mapped from the typed Arrow copy written by
+    build_pipeline.py, read from the CSV file with the necessary type conversions, or, without
+    either, built from the memory-mapped columns of the ratings store.
+
+    cache_resource, not cache_data: every session gets this frame itself instead of an unpickled
+    copy, so the ratings are in memory once per process (and, mapped from the Arrow copy, once
+    per host). Callers must not modify it.
+    """
+    if columns is None:
+        return _load_main_df(data_dir)[0]
+
+    # typed copy: the dtypes are stored, nothing is parsed, cast or even copied
+    df = map_columnar(os.path.join(data_dir, FILES_TO_LOAD['main_df']), list(columns))
+    if df is not None:
+        # copies written before the dtype plan (Int64 ratings, rating_date) are converted
+        return apply_dtype_plan(df)
+    # the CSV file is read once, the column selections reference its columns
+    return _select_columns(_read_main_df(data_dir), columns)
+
+
+@st.cache_resource
+def _load_main_df(data_dir):
+    """
+    Every column of main_df and the one line memory report of the dtype plan (None when the plan
+    converted nothing). The report is shown by DataStore, once per run: a message shown by a cached
+    function would be replayed by every call.
+    """
+    file_path = os.path.join(data_dir, FILES_TO_LOAD['main_df'])
+    before = map_columnar(file_path)
+    if before is not None:
+        after = apply_dtype_plan(before)
+    elif not os.path.exists(file_path):
+        # no build output: the ratings store is read instead of parsing text, already in the plan dtypes
+        store = load_ratings_store()
+        return store_fact_table(store, _read_movies(data_dir), _store_activity_codes(store)), None
+    else:
+        before = pd.read_csv(file_path)
+        df = before if 'movie_key' in before.columns else to_fact_table(before, _read_movies(data_dir))
+        # --- CRITICAL CSV TYPE CONVERSION & ORDERED CATEGORICALS ---
+        after = typed_fact_table(df.copy())
+    return after, _plan_summary(before, after)
+
+
+def _plan_summary(before, after):
+    # the memory report is only computed (a deep memory_usage of the string columns) when the plan
+    # converted or dropped columns
+    changed = list(before.columns) != list(after.columns) or any(
+        after[col].dtype != before[col].dtype for col in after.columns)
+    if not changed:
         return None
-    
-    if 'main_df' in data_dict:
-        df = data_dict['main_df']
-    
+    return format_memory_report(memory_report(before, after)).splitlines()[-1]
+
+
+@st.cache_data
+def _read_cube(data_dir):
+    """
+    Aggregate cube written by build_pipeline.py, see aggregate_cube.py. None if there is none or if
+    it is older than main_df (e.g. a main_df re-exported by the notebook): the charts group main_df.
+    """
+    cube_path = os.path.join(data_dir, CUBE_FILE)
+    main_path = os.path.join(data_dir, FILES_TO_LOAD['main_df'])
+    if os.path.exists(cube_path) and os.path.exists(main_path) and os.path.getmtime(cube_path) < os.path.getmtime(main_path):
+        return None
+    return AggregateCube.load(data_dir)
+
+
+@st.cache_resource
+def _index(data_dir, col):
+    """
+    CSR index of a column of main_df (None without the column), kept on disk across restarts and
+    shared by the sessions like main_df.
+    """
+    def build():
+        df = _read_main_df(data_dir, (col,))
+        return frame_index(df, col) if col in df.columns else None
+    key = cache_key(f'{col}_index', (frame_index, _read_main_df), _data_files(data_dir), col)
+    return DERIVED_CACHE.get_or_compute(key, build)
+
+
+@st.cache_data
+def _genre_analysis(data_dir):
+    """Genre analysis of main_df, kept on disk across restarts (see _compute_genre_analysis)."""
+    key = cache_key('genre_analysis_df', (_compute_genre_analysis, _read_main_df, MovieDimension), _data_files(data_dir))
+    return DERIVED_CACHE.get_or_compute(key, lambda: _compute_genre_analysis(data_dir))
+
+
+def _compute_genre_analysis(data_dir):
+    """Number and average of the ratings per genre (only movie_key and rating are read)."""
+    df = _read_main_df(data_dir, ('movie_key', 'rating'))
+    movies = _read_movies(data_dir)
+
     # Check for required columns BEFORE starting the analysis
-        if 'rating' not in df.columns or 'genres' not in df.columns:
-            st.warning("Skipping genre analysis: 'rating' or 'genres' column not found.")
-            data_dict['genre_analysis_df'] = pd.DataFrame()
-            return data_dict # Return early to prevent indexing errors
-
-        # 1. Select columns and handle NaNs
-        # We need both 'rating' and 'genres' to be present and non-null
-        df_genre_analysis = df[['rating', 'genres']].copy().dropna(subset=['rating', 'genres'])
-        
-        # Check if any data remains after dropna
-        if df_genre_analysis.empty:
-            st.warning("Genre analysis: No rows remaining after dropping NaNs in 'rating'/'genres'.")
-            data_dict['genre_analysis_df'] = pd.DataFrame()
-            return data_dict
-
-        # 2. Split + Explode: Prepare genres for grouping
-        
-
-        df_genre_analysis['genres'] = df_genre_analysis['genres'].str.strip()
-        df_genre_analysis['genres'] = df_genre_analysis['genres'].str.split("|")
-        
-        # Explode the list into new rows
-        df_genre_analysis = df_genre_analysis.explode("genres")
-        
-        # CRUCIAL POST-EXPLODE CLEANING: Strip and Capitalize for perfect grouping
-        df_genre_analysis['genres'] = df_genre_analysis['genres'].str.strip()
-        df_genre_analysis['genres'] = df_genre_analysis['genres'].str.capitalize()
-        
-        # 3. Groupby + Aggregate (Mean and Count)
-        # The grouping logic here is correct and relies on the clean 'genres' column
-        df_genre_analysis = (
-            df_genre_analysis
-            .groupby("genres")["rating"]
-            .agg(['mean', 'count']) 
-            .reset_index()
-        )
-
-        # 4. Rename columns
-        df_genre_analysis = df_genre_analysis.rename(
-            columns={"mean": "rating_avg", "count": "rating_count"}
-        )
-        
-        # 5. Sort + reset index
-        df_genre_analysis = (
-            df_genre_analysis
-            .sort_values(by="rating_avg", ascending=False)
-            .reset_index(drop=True)
-        )
-        
-        # Add the result to the data dictionary
-        data_dict['genre_analysis_df'] = df_genre_analysis
-        
-        # OPTIONAL DEBUG: The debug print block must also follow the same indentation
-        if 'genre_analysis_df' in data_dict:
-            print("\n--- Genre Analysis Data Check ---")
-            print("Columns:", data_dict['genre_analysis_df'].columns.tolist())
-            print("Head:", data_dict['genre_analysis_df'].head())
-            print("Average Rating Unique Values:", data_dict['genre_analysis_df']['rating_avg'].unique())
-            print("-----------------------------------")
-    
-    return data_dict
-
-def get_df(data_dict, key):
- 
+    if 'rating' not in df.columns or not movies.genre_vocabulary:
+        st.warning("Skipping genre analysis: 'rating' or 'genres' column not found.")
+        return pd.DataFrame()
+
+    # 1. Select the rated rows: the genres of every movie are already split into codes
+    # of the dimension, so nothing is split or exploded per rating
+    rated = df['rating'].notna().to_numpy()
+
+    # Check if any data remains after dropna
+    if not rated.any():
+        st.warning("Genre analysis: No rows remaining after dropping NaNs in 'rating'/'genres'.")
+        return pd.DataFrame()
+
+    # 2. Aggregate (Mean and Count): ratings are summed per movie, then per genre of the movies
+    df_genre_analysis = movies.genre_ratings(
+        df['movie_key'].to_numpy()[rated],
+        df['rating'].to_numpy(dtype=np.float64, na_value=0)[rated]
+    )
+
+    # 3. Sort + reset index
+    df_genre_analysis = (
+        df_genre_analysis
+        .sort_values(by="rating_avg", ascending=False)
+        .reset_index(drop=True)
+    )
+
+    # OPTIONAL DEBUG
+    print("\n--- Genre Analysis Data Check ---")
+    print("Columns:", df_genre_analysis.columns.tolist())
+    print("Head:", df_genre_analysis.head())
+    print("Average Rating Unique Values:", df_genre_analysis['rating_avg'].unique())
+    print("-----------------------------------")
+
+    return df_genre_analysis
+
+@st.cache_resource
+def _query_engine(data_dir):
+    """
+    QueryEngine shared by the sessions, over the shared main_df (nothing is copied into the
+    database) and the ratings store when it has been built. None without duckdb.
+    """
+    store = load_ratings_store()
+    try:
+        return QueryEngine(_read_main_df(data_dir), _read_movies(data_dir), store, _store_activity_codes(store))
+    except ImportError:
+        return None
+
+
+def _store_activity_codes(store):
+    # activity level codes of the ratings of the store, None when they have not been written
+    if store is None or not os.path.exists(os.path.join(store.store_dir, ACTIVITY_DIR, LEVELS_FILE)):
+        return None
+    return load_store_levels(store.store_dir)
+
+
+@st.cache_resource
+def load_ratings_store(store_dir=DEFAULT_STORE_DIR):
+    """
+    Opens the columnar ratings store built by ratings_store.py (None if it has not been built).
+    The columns are memory-mapped: nothing is parsed and the pages are shared by every session,
+    which is why this uses cache_resource instead of cache_data (which would pickle a copy).
+    """
+    if not os.path.exists(os.path.join(store_dir, 'metadata.json')):
+        return None
+    return RatingsStore(store_dir)
+
+@st.cache_resource
+def load_partitioned_store(partitioned_dir=DEFAULT_PARTITIONED_DIR):
+    """
+    Opens the ratings store partitioned by rating year (None if it has not been built). Like the
+    ratings store, the partitions are memory-mapped and shared by every session.
+    """
+    if not os.path.exists(os.path.join(partitioned_dir, MANIFEST_FILE)):
+        return None
+    return PartitionedStore(partitioned_dir)
+
+
+def get_df(data_dict, key, columns=None):
+    """
+    Dataset `key` of the store returned by load_data, loaded on first use; for main_df only the
+    given columns are read, movie attributes included (without columns: the stored fact table, see
+    load_data). Empty DataFrame if the key is unknown or loading failed.
+    """
     if data_dict:
-        # Return empty DataFrame if key not found, or if loading failed
-        return data_dict.get(key, pd.DataFrame()) 
-    return pd.DataFrame() # Return empty DataFrame if loading failed
\ No newline at end of file
+        if isinstance(data_dict, DataStore):
+            return data_dict.get(key, pd.DataFrame(), columns=columns)
+        return data_dict.get(key, pd.DataFrame())
+    return pd.DataFrame() # Return empty DataFrame if loading failed
+
+def query_df(data_dict, sql, params=None):
+    """
+    Result of a SQL query on the store returned by load_data (see query_engine.py). Empty
+    DataFrame if loading failed or duckdb is not installed.
+    """
+    if isinstance(data_dict, DataStore) and data_dict.engine is not None:
+        return data_dict.query(sql, params)
+    return pd.DataFrame()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Dictionary encoding of the rating dates.
+#
+# The whole Netflix Prize period (1999-11 to 2005-12) has only ~2,200 distinct days, so dates are
+# stored as uint16 day codes (number of days since DATE_EPOCH). Strings are parsed once per
+# distinct value, and year / month / weekday are read from small lookup tables indexed by the
+# code instead of being computed for every rating.
+
+DATE_EPOCH = np.datetime64('1970-01-01', 'D')
+
+# code used for missing or unparsable dates
+MISSING_DAY = np.iinfo(np.uint16).max
+
+DATE_PARTS = ('year', 'month', 'day', 'weekday')
+
+
+def encode_date_strings(values):
+    """
+    Encodes 'YYYY-MM-DD' strings (any array-like) as uint16 day codes.
+    Only the distinct strings are parsed.
+    """
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    parsed = pd.to_datetime(pd.Series(uniques), errors='coerce', format='%Y-%m-%d')
+    return _encode_unique_dates(codes, parsed.to_numpy().astype('datetime64[D]'))
+
+
+def encode_datetimes(values):
+    """Encodes datetime64 values as uint16 day codes (NaT becomes MISSING_DAY)."""
+    values = np.asarray(values).astype('datetime64[D]')
+    days = (values - DATE_EPOCH).astype(np.int64)
+    missing = np.isnat(values) | (days < 0) | (days >= MISSING_DAY)
+    return np.where(missing, MISSING_DAY, days).astype(np.uint16)
+
+
+def _encode_unique_dates(codes, unique_dates):
+    # unique_dates[i] is the date of factorize code i, codes == -1 are missing
+    table = np.append(encode_datetimes(unique_dates), np.uint16(MISSING_DAY))
+    return table[codes]
+
+
+def codes_to_datetime(codes):
+    """Decodes day codes into datetime64[D] (MISSING_DAY becomes NaT)."""
+    codes = np.asarray(codes)
+    dates = DATE_EPOCH + codes.astype('timedelta64[D]')
+    return np.where(codes == MISSING_DAY, np.datetime64('NaT', 'D'), dates)
+
+
+class DateTable:
+    """
+    Lookup tables of the date parts for a contiguous range of day codes.
+    Built once per dataset (a few thousand entries), then every extraction is an array index.
+    """
+
+    def __init__(self, first_code, last_code):
+        self.first_code = int(first_code)
+        days = DATE_EPOCH + np.arange(self.first_code, int(last_code) + 1).astype('timedelta64[D]')
+        months = days.astype('datetime64[M]')
+        self.tables = {
+            'year': (days.astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16),
+            'month': (months.astype(np.int64) % 12 + 1).astype(np.int8),
+            'day': ((days - months.astype('datetime64[D]')).astype(np.int64) + 1).astype(np.int8),
+            # 1970-01-01 was a thursday, monday = 0 like pandas dt.weekday
+            'weekday': ((np.arange(self.first_code, int(last_code) + 1) + 3) % 7).astype(np.int8),
+        }
+
+    @classmethod
+    def for_codes(cls, codes):
+        """Builds the table covering every (non missing) code of an array."""
+        codes = np.asarray(codes)
+        present = codes[codes != MISSING_DAY]
+        if len(present) == 0:
+            return cls(0, 0)
+        return cls(present.min(), present.max())
+
+    def lookup(self, codes, part):
+        """
+        Returns the date part ('year', 'month', 'day' or 'weekday') of every code.
+        Missing codes give -1.
+        """
+        codes = np.asarray(codes)
+        table = self.tables[part]
+        positions = codes.astype(np.int64) - self.first_code
+        in_range = (codes != MISSING_DAY) & (positions >= 0) & (positions < len(table))
+        return np.where(in_range, table[np.clip(positions, 0, len(table) - 1)], -1)
+
+
+def date_part(codes, part):
+    """Shortcut: date part of every code using a table built for these codes."""
+    return DateTable.for_codes(codes).lookup(codes, part)
@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+from parse_cache import file_content_hash
+
+# Persistent cache of derived artifacts (frames, indexes, figures).
+#
+# st.cache_data only lives as long as the streamlit process: after a restart or a deploy every
+# derived frame was computed again and the article of the word cloud scraped again. Derived
+# artifacts are also pickled in .cache/derived/<key>.pkl, where the key is made of
+#
+#   - a name and the arguments of the computation,
+#   - the content hash of the source files it reads (data/main_df.arrow ...),
+#   - the hash of the source code of the functions / modules that compute it,
+#
+# so an entry is never served after the data or the code changed; it is simply not found.
+# Entries are written to a temporary file and renamed in place (a reader never sees a partial
+# entry), a hit touches the entry, and when the directory grows above max_bytes the least
+# recently used entries are deleted. The modification times are the LRU order, so several
+# processes (app sessions, scripts) can share the directory.
+#
+# Like the manifest of parse_cache.py, hashes.json remembers the content hash of every source file
+# with its size and modification time, so a restarted app does not read the data files to hash them.
+#
+#   python disk_cache.py --stats            (entries, size, age)
+#   python disk_cache.py --clear
+
+DEFAULT_CACHE_DIR = os.path.join('.cache', 'derived')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+ENTRY_SUFFIX = '.pkl'
+HASHES_FILE = 'hashes.json'
+
+# content hashes of the source files by path, valid while their size and modification time do not change
+_source_hashes = None
+
+
+def _hashes_path():
+    return os.path.join(DEFAULT_CACHE_DIR, HASHES_FILE)
+
+
+def source_hash(path):
+    """Content hash of a file (None if it does not exist), computed once per version of the file."""
+    global _source_hashes
+    if not os.path.exists(path):
+        return None
+    if _source_hashes is None:
+        _source_hashes = {}
+        if os.path.exists(_hashes_path()):
+            with open(_hashes_path()) as f:
+                _source_hashes = json.load(f)
+
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    known = _source_hashes.get(path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['hash']
+
+    content_hash = file_content_hash(path)
+    _source_hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash}
+    os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+    tmp_path = f'{_hashes_path()}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_source_hashes, f, indent=2)
+    os.replace(tmp_path, _hashes_path())
+    return content_hash
+
+
+def code_hash(*objects):
+    """Hash of the source code of functions, classes or modules."""
+    digest = hashlib.blake2b(digest_size=8)
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode())
+    return digest.hexdigest()
+
+
+def cache_key(name, code=(), sources=(), *parts):
+    """Key of an artifact: its name, the code computing it, the content of its source files and its arguments."""
+    payload = json.dumps([
+        name,
+        code_hash(*code),
+        [[os.path.basename(path), source_hash(path)] for path in sources],
+        *parts,
+    ], default=str)
+    return f'{name}-' + hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class DiskCache:
+    """Pickled artifacts in cache_dir, one file per key, LRU-evicted above max_bytes."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key, default=None):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # unreadable entry (e.g. pickled by another version of a library): dropped
+            self._remove(path)
+            self.misses += 1
+            return default
+        # most recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        # unique temporary name: other processes may write the same entry at the same time
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_or_compute(self, key, compute):
+        """Cached value of key, or the result of compute() (stored unless it is None)."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        value = compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def entries(self):
+        """(path, size, last use) of every entry, least recently used first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((os.path.join(self.cache_dir, name), stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# cache shared by the app modules (data_loader.py, plotting_utils.py)
+DERIVED_CACHE = DiskCache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspects or clears the persistent cache of derived artifacts.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--stats', action='store_true', help="list the entries (default)")
+    action.add_argument('--clear', action='store_true')
+    args = parser.parse_args()
+
+    cache = DiskCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {args.cache_dir}.")
+    else:
+        now = time.time()
+        for path, size, last_use in cache.entries():
+            print(f"{os.path.basename(path):<60} {size / 1e6:8.2f} MB   used {(now - last_use) / 60:8.1f} min ago")
+        print(f"{len(cache.entries())} entries, {cache.size() / 1e6:.2f} MB (max {cache.max_bytes / 1e6:.0f} MB)")
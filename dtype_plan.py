@@ -0,0 +1,128 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from date_codes import codes_to_datetime, encode_datetimes
+
+# Memory-optimized dtypes of the fact table (main_df).
+#
+# Read as CSV, a rating costs ~30 bytes in main_df even without the movie attributes: int64 keys,
+# a nullable Int64 rating (8 bytes + mask) and a datetime64 next to its day code. The plan below
+# gives every column the dtype its information needs:
+#
+#   movie_key, customer_id    narrowest signed integer holding their values (int16 / int32)
+#   rating                    nullable Int8 (1 byte + mask)
+#   rating_day                uint16 day code; rating_date is not stored but rebuilt from it
+#                             when a chart asks for it (see date_column)
+#   rating_category, ...      ordered categoricals with int8 codes (see movie_dimension.typed_fact_table)
+#   other string columns      categoricals when their values repeat
+#
+# which brings a rating to ~12 bytes. It is applied by build_pipeline.py before the typed Arrow
+# copy is written (so the memory-mapped columns already have these dtypes) and by data_loader.py
+# to frames read from CSV or from older copies, which show the memory report of the change.
+#
+#   python dtype_plan.py --data-dir data     (memory report of main_df: CSV dtypes -> plan)
+
+# column -> dtype; None: the narrowest integer type holding the values of the column
+FACT_DTYPES = {
+    'movie_key': None,
+    'customer_id': None,
+    'rating': 'Int8',
+    'rating_day': np.uint16,
+}
+
+# datetime columns that are kept as day codes only: column -> its day code column
+DATE_CODE_COLUMNS = {'rating_date': 'rating_day'}
+
+# string columns with fewer distinct values than this share of their rows become categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+_INTEGER_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def narrowest_int_dtype(values):
+    """Smallest signed integer dtype holding every value of an integer array."""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.dtype(np.int8)
+    low, high = values.min(), values.max()
+    for dtype in _INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return values.dtype
+
+
+def apply_dtype_plan(df, dtypes=FACT_DTYPES):
+    """
+    Frame with the planned dtypes. Columns that already have them are referenced, not copied
+    (a memory-mapped frame stays mapped), datetimes with a day code column are dropped.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if col in DATE_CODE_COLUMNS:
+            code_col = DATE_CODE_COLUMNS[col]
+            if code_col in df.columns:
+                continue
+            # day codes of the datetimes, under the name of the code column
+            col, values = code_col, pd.Series(encode_datetimes(values.to_numpy()), index=df.index)
+        if col in dtypes:
+            dtype = dtypes[col]
+            if dtype is None:
+                # keys: only narrowed when they are integers (no missing values)
+                dtype = narrowest_int_dtype(values.to_numpy()) if pd.api.types.is_integer_dtype(values) else values.dtype
+            if values.dtype != dtype:
+                values = values.astype(dtype)
+        elif values.dtype == object and values.nunique() < CATEGORY_MAX_RATIO * len(values):
+            values = values.astype('category')
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def date_column(df, col='rating_date'):
+    """Datetime column rebuilt from its day codes (the plan only stores the codes)."""
+    if col in df.columns:
+        return df[col]
+    return pd.Series(codes_to_datetime(df[DATE_CODE_COLUMNS[col]].to_numpy()), index=df.index, name=col)
+
+
+def memory_report(before, after):
+    """dtype and bytes of every column before / after the plan, with the totals."""
+    def column_bytes(df):
+        # deep: the strings of object columns count, like in memory
+        return df.memory_usage(index=False, deep=True)
+
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'bytes_before': column_bytes(before),
+    }).join(pd.DataFrame({
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_after': column_bytes(after),
+    }), how='outer')
+    report[['bytes_before', 'bytes_after']] = report[['bytes_before', 'bytes_after']].fillna(0).astype(np.int64)
+    report.loc['total'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    rows = max(len(before), 1)
+    report['bytes_per_row_before'] = (report['bytes_before'] / rows).round(2)
+    report['bytes_per_row_after'] = (report['bytes_after'] / rows).round(2)
+    return report.fillna('')
+
+
+def format_memory_report(report):
+    total = report.loc['total']
+    ratio = total['bytes_before'] / max(total['bytes_after'], 1)
+    return (f"{report.to_string()}\n"
+            f"main_df: {total['bytes_before'] / 1e6:.1f} MB -> {total['bytes_after'] / 1e6:.1f} MB ({ratio:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    from movie_dimension import typed_fact_table
+
+    parser = argparse.ArgumentParser(description="Memory report of the dtype plan on main_df.")
+    parser.add_argument('--data-dir', default='data')
+    args = parser.parse_args()
+
+    raw = pd.read_csv(os.path.join(args.data_dir, 'main_df.csv'))
+    print(format_memory_report(memory_report(raw, typed_fact_table(raw.copy()))))
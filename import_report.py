@@ -0,0 +1,76 @@
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+# Import-time report of the app modules (cold start).
+#
+# Every module is imported in a fresh interpreter with `python -X importtime`, which logs the time
+# spent importing every module (self and cumulative, in microseconds) with its nesting. The report
+# gives the cumulative import time of each app module and the packages that cost the most, so a
+# heavy import that sneaks back into the start of the app (e.g. seaborn or wordcloud imported at
+# the top of a module instead of in the chart that uses them) shows up.
+#
+#   python import_report.py                          (app modules)
+#   python import_report.py plotting_utils --top 20
+#   python import_report.py --json > import_times.json      (to track the times across changes)
+
+APP_MODULES = ('streamlit', 'data_loader', 'plotting_utils', 'article_netflix')
+
+_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\| ( *)(\S+)')
+
+
+def import_times(module, repeat=3):
+    """
+    (cumulative microseconds, {package: self microseconds}) of importing module in a fresh
+    interpreter, the fastest of `repeat` runs (the first runs warm up the file system cache).
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+        packages = defaultdict(int)
+        total = 0
+        for match in _LINE.finditer(result.stderr):
+            self_us, cumulative_us, indent, name = match.groups()
+            packages[name.split('.')[0]] += int(self_us)
+            if name == module and not indent:
+                total = int(cumulative_us)
+        if best is None or total < best[0]:
+            best = (total, dict(packages))
+    return best
+
+
+def import_report(modules=APP_MODULES, top=10, repeat=3):
+    """Dict module -> {'total_ms', 'packages': [(package, self ms) ...heaviest first]}."""
+    report = {}
+    for module in modules:
+        total, packages = import_times(module, repeat)
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        report[module] = {
+            'total_ms': round(total / 1000, 1),
+            'packages': [(package, round(us / 1000, 1)) for package, us in heaviest],
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import-time report of the app modules (cold start).")
+    parser.add_argument('modules', nargs='*', default=list(APP_MODULES))
+    parser.add_argument('--top', type=int, default=10, help="heaviest packages listed per module")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per module, the fastest is kept")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = import_report(args.modules, args.top, args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, times in report.items():
+            print(f"{module:<20} {times['total_ms']:8.1f} ms")
+            for package, ms in times['packages']:
+                print(f"    {package:<28} {ms:8.1f} ms")
@@ -0,0 +1,316 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from columnar_files import read_columnar, write_columnar
+from date_codes import encode_date_strings
+from dtype_plan import apply_dtype_plan
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+
+# Movie dimension of the star schema.
+#
+# The ratings (fact table, data/main_df.csv) only carry integer keys: movie_key, customer_id,
+# rating, rating_day and the codes of rating_category / activity_level. Everything that describes
+# a movie is stored once per movie in data/movies.csv:
+#
+#   movie_key        dense index of the movie = its row in the table (not written, implicit)
+#   movie_id         Netflix id
+#   title, year, decade, genres
+#   rating_count, avg_rating, weighted_rating   (0 / NaN for the movies without rating)
+#
+# Attributes of the ratings are resolved by array indexing: table[col][movie_key].
+# Both tables also have a typed Arrow copy (data/main_df.arrow, data/movies.arrow), see
+# columnar_files.py.
+#
+# Genres are normalized once per movie into a uint32 bitmask over a sorted vocabulary (27 genres):
+# bit i of genre_masks[k] is set when movie k has the genre genre_vocabulary[i]. Per-genre counts
+# and means, multi-genre filters and the multi-hot matrix are bit operations on the masks, the
+# ratings are never split or exploded per genre.
+#
+#   python movie_dimension.py --store data/ratings_store    (genre analysis of the full corpus)
+
+DIMENSION_FILE = 'movies.csv'
+
+MOVIE_ATTRIBUTES = ['movie_id', 'title', 'year', 'decade', 'genres']
+MOVIE_STATS = ['rating_count', 'avg_rating', 'weighted_rating']
+
+# labels of the rating_category and activity_level codes of the fact table (ordered)
+RATING_CATEGORIES = ['Low', 'Neutral', 'High']
+ACTIVITY_LEVELS = ['Low', 'Medium', 'High']
+
+
+def rating_category_codes(ratings):
+    """Code of RATING_CATEGORIES of every rating: 1-2 Low, 3 Neutral, 4-5 High (-1 otherwise)."""
+    ratings = np.asarray(ratings)
+    return np.select([ratings <= 2, ratings == 3, ratings >= 4], [0, 1, 2], default=-1).astype(np.int8)
+
+
+GENRE_MASK_DTYPE = np.uint32
+MAX_GENRES = np.iinfo(GENRE_MASK_DTYPE).bits
+
+
+def encode_genres(genres, vocabulary=None):
+    """
+    Encodes 'Drama|Crime' strings as genre bitmasks. Only the distinct strings are split.
+    Returns the vocabulary (sorted genre names, unless given) and the mask of every value.
+    """
+    codes, uniques = pd.factorize(pd.Series(genres, dtype=object), use_na_sentinel=True)
+    tokens = pd.Series(uniques, dtype=object).str.split('|').explode().str.strip()
+    tokens = tokens[tokens.notna() & (tokens != '')]
+
+    if vocabulary is None:
+        vocabulary = sorted(set(tokens))
+    if len(vocabulary) > MAX_GENRES:
+        raise ValueError(f"{len(vocabulary)} genres do not fit in a {MAX_GENRES} bit mask.")
+
+    # genres outside a given vocabulary are ignored
+    bits = pd.Series(np.arange(len(vocabulary)), index=vocabulary).reindex(tokens.to_numpy()).to_numpy()
+    known = ~np.isnan(bits)
+
+    # one mask per distinct string, the extra last one (empty) is used for missing values
+    unique_masks = np.zeros(len(uniques) + 1, dtype=GENRE_MASK_DTYPE)
+    np.bitwise_or.at(unique_masks, tokens.index.to_numpy()[known],
+                     np.left_shift(1, bits[known].astype(np.int64)).astype(GENRE_MASK_DTYPE))
+    return list(vocabulary), unique_masks[codes]
+
+
+def genre_matrix(masks, n_genres):
+    """Multi-hot matrix (one row per mask, one int8 column per genre bit)."""
+    shifts = np.arange(n_genres, dtype=GENRE_MASK_DTYPE)
+    return ((np.asarray(masks, dtype=GENRE_MASK_DTYPE)[:, None] >> shifts) & 1).astype(np.int8)
+
+
+class MovieDimension:
+    """One row per movie, the position of the row is the movie_key used by the ratings."""
+
+    def __init__(self, table):
+        self.table = table.reset_index(drop=True)
+        movie_ids = self.table['movie_id'].to_numpy()
+        self._key_of = np.full(int(movie_ids.max()) + 1 if len(movie_ids) else 0, -1, dtype=np.int32)
+        self._key_of[movie_ids] = np.arange(len(movie_ids), dtype=np.int32)
+
+        self.genre_vocabulary, self.genre_masks = encode_genres(self.table['genres'])
+        self._genre_matrix = None
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def columns(self):
+        return list(self.table.columns)
+
+    def keys_for(self, movie_ids):
+        """movie_key of every movie id (-1 for the ids that are not in the dimension)."""
+        movie_ids = np.asarray(movie_ids)
+        inside = (movie_ids >= 0) & (movie_ids < len(self._key_of))
+        return np.where(inside, self._key_of[np.where(inside, movie_ids, 0)], -1)
+
+    def lookup(self, keys, col):
+        """Values of a movie attribute for an array of movie keys (missing for the keys -1)."""
+        return self.table[col].array.take(np.asarray(keys), allow_fill=True)
+
+    def resolve(self, df, col):
+        """Column of a ratings frame, taken from the dimension when it is a movie attribute."""
+        if col in df.columns:
+            return df[col]
+        return pd.Series(self.lookup(df['movie_key'].to_numpy(), col), index=df.index, name=col)
+
+    def has_column(self, df, col):
+        return col in df.columns or col in self.table.columns
+
+    def movie_totals(self, keys, ratings):
+        """Number and sum of the ratings of every movie (indexed by movie_key)."""
+        keys = np.asarray(keys)
+        counts = np.bincount(keys, minlength=len(self))
+        sums = np.bincount(keys, weights=np.asarray(ratings, dtype=np.float64), minlength=len(self))
+        return counts, sums
+
+    def group_ratings(self, keys, ratings, col):
+        """
+        rating_count and rating_avg per value of a movie attribute (e.g. decade). The ratings are
+        first summed per movie, then the movie totals are grouped: the grouping runs on the movies,
+        not on the ratings.
+        """
+        counts, sums = self.movie_totals(keys, ratings)
+        rated = counts > 0
+        totals = pd.DataFrame({
+            col: self.table[col].to_numpy()[rated],
+            'rating_count': counts[rated],
+            'rating_sum': sums[rated],
+        }).groupby(col, observed=True)[['rating_count', 'rating_sum']].sum()
+        totals['rating_avg'] = totals['rating_sum'] / totals['rating_count']
+        return totals.drop(columns='rating_sum').reset_index()
+
+    def genre_mask(self, genres):
+        """Bitmask of a list of genre names."""
+        mask = 0
+        for genre in genres:
+            mask |= 1 << self.genre_vocabulary.index(genre)
+        return GENRE_MASK_DTYPE(mask)
+
+    def has_genres(self, genres, match='any'):
+        """
+        Boolean array over the movies: the movies having any (match='any') or all (match='all')
+        of the genres. Index it with movie_key to filter ratings.
+        """
+        wanted = self.genre_mask(genres)
+        common = self.genre_masks & wanted
+        if match == 'all':
+            return common == wanted
+        return common != 0
+
+    def genre_matrix(self):
+        """Multi-hot (movies x genres) matrix, decoded from the bitmasks."""
+        if self._genre_matrix is None:
+            self._genre_matrix = genre_matrix(self.genre_masks, len(self.genre_vocabulary))
+        return self._genre_matrix
+
+    def genre_ratings(self, keys, ratings):
+        """
+        rating_count and rating_avg per genre, a rating counting once for each genre of its movie.
+        Genre names are capitalized like the exploded genre analysis of the notebook.
+        """
+        return self.genre_totals(*self.movie_totals(keys, ratings))
+
+    def genre_totals(self, counts, sums):
+        """Genre statistics from the rating counts and sums of every movie (see movie_totals)."""
+        # (genres x movies) @ (movies) : the totals of the movies having each genre bit
+        matrix = self.genre_matrix().T
+        totals = pd.DataFrame({
+            'genres': pd.Series(self.genre_vocabulary, dtype=object).str.capitalize(),
+            'rating_count': matrix @ counts.astype(np.int64),
+            'rating_sum': matrix @ sums,
+        })
+        totals = totals[totals['rating_count'] > 0].groupby('genres')[['rating_count', 'rating_sum']].sum()
+        totals['rating_avg'] = totals['rating_sum'] / totals['rating_count']
+        return totals.drop(columns='rating_sum').reset_index()[['genres', 'rating_avg', 'rating_count']]
+
+    def ranking_frame(self):
+        """Statistics of the rated movies, in the layout of movies_by_rating.csv (plus movie_key)."""
+        rated = self.table['rating_count'] > 0
+        ranking = self.table.loc[rated, ['movie_id', 'title'] + MOVIE_STATS].copy()
+        ranking.insert(0, 'movie_key', np.flatnonzero(rated.to_numpy()))
+        return ranking.reset_index(drop=True)
+
+    def save(self, data_dir):
+        """Writes movies.csv and its typed copy (written last, so it is never older than the CSV)."""
+        path = os.path.join(data_dir, DIMENSION_FILE)
+        self.table.to_csv(path, index=False)
+        write_columnar(self.table.astype({'year': 'Int64'}), path)
+        return path
+
+    @classmethod
+    def load(cls, data_dir):
+        path = os.path.join(data_dir, DIMENSION_FILE)
+        table = read_columnar(path)
+        if table is None:
+            table = pd.read_csv(path)
+            table['year'] = table['year'].astype('Int64')
+        return cls(table)
+
+    @classmethod
+    def from_denormalized(cls, df, movies_by_rating=None):
+        """
+        Builds the dimension from a main_df exported with the movie attributes on every rating
+        (netflix_data_manag_v2.ipynb), with the statistics of movies_by_rating.csv when given.
+        """
+        attributes = [col for col in MOVIE_ATTRIBUTES if col in df.columns]
+        table = df[attributes].drop_duplicates('movie_id').sort_values('movie_id')
+        if 'year' in table.columns:
+            table['year'] = pd.to_numeric(table['year'], errors='coerce').astype('Int64')
+        if 'genres' not in table.columns:
+            table['genres'] = ''
+        if movies_by_rating is not None:
+            stats = [col for col in MOVIE_STATS if col in movies_by_rating.columns]
+            table = table.merge(movies_by_rating[['movie_id'] + stats], on='movie_id', how='left')
+        return cls(table)
+
+
+def to_fact_table(df, movies):
+    """Replaces the movie attributes of a denormalized ratings frame by movie_key."""
+    fact = df.drop(columns=[col for col in MOVIE_ATTRIBUTES if col in df.columns])
+    fact.insert(0, 'movie_key', movies.keys_for(df['movie_id'].to_numpy()).astype(np.int32))
+    return fact
+
+
+def typed_fact_table(df):
+    """
+    Casts a fact table read from CSV to the dtypes of the app (see dtype_plan.py): uint16 day
+    codes, nullable Int8 ratings, narrow integer keys, ordered categoricals for rating_category /
+    activity_level.
+    """
+    # dates are dictionary encoded: each distinct day is parsed once (see date_codes.py),
+    # rating_day keeps the uint16 day code for table lookups of year / month / weekday
+    if 'date' in df.columns:
+        df['rating_day'] = encode_date_strings(df['date'])
+        df = df.drop(columns='date')
+
+    if 'rating' in df.columns:
+        df['rating'] = pd.to_numeric(df['rating'], errors='coerce')
+
+    # the star schema stores the categories as integer codes
+    if 'activity_level' in df.columns:
+        df['activity_level'] = _ordered_categorical(df['activity_level'], ACTIVITY_LEVELS)
+    if 'rating_category' in df.columns:
+        df['rating_category'] = _ordered_categorical(df['rating_category'], RATING_CATEGORIES)
+    return apply_dtype_plan(df)
+
+
+def _ordered_categorical(values, categories):
+    """Ordered categorical from integer codes (star schema export) or from the labels."""
+    if pd.api.types.is_integer_dtype(values):
+        return pd.Categorical.from_codes(values.to_numpy(), categories=categories, ordered=True)
+    return pd.Categorical(values, categories=categories, ordered=True)
+
+
+def store_fact_table(store, movies, activity_codes=None):
+    """
+    Fact table of the ratings of a store (see ratings_store.py) with the dtypes of typed_fact_table.
+    Nothing is parsed: the columns are read from the memory-mapped ones (the dates already are day
+    codes). Ratings of movies outside the dimension are dropped like in build_pipeline.py.
+    activity_codes are the activity level codes of the ratings (see customer_activity.write_store_levels).
+    """
+    movie_keys = movies.keys_for(store.column('movie_id')).astype(np.int32)
+    df = pd.DataFrame({
+        'movie_key': movie_keys,
+        'customer_id': store.column('customer_id'),
+        'rating': store.column('rating'),
+        'rating_day': store.column('date'),
+        'rating_category': rating_category_codes(store.column('rating')),
+    }, copy=False)
+    if activity_codes is not None:
+        df['activity_level'] = activity_codes
+    known = movie_keys >= 0
+    if not known.all():
+        df = df[known].reset_index(drop=True)
+    return typed_fact_table(df)
+
+
+def store_movie_totals(store, movies, block_rows=10_000_000):
+    """
+    Number and sum of the ratings of every movie of the dimension over a ratings store
+    (see ratings_store.py), read in blocks so the full corpus fits in a few arrays of 17,770 entries.
+    """
+    counts = np.zeros(len(movies), dtype=np.int64)
+    sums = np.zeros(len(movies), dtype=np.float64)
+    for start in range(0, len(store), block_rows):
+        keys = movies.keys_for(store.column('movie_id')[start:start + block_rows])
+        known = keys >= 0
+        block_counts, block_sums = movies.movie_totals(keys[known], store.column('rating')[start:start + block_rows][known])
+        counts += block_counts
+        sums += block_sums
+    return counts, sums
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genre analysis of every rating of a ratings store, through the movie dimension.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help="ratings store built by ratings_store.py")
+    parser.add_argument('--data-dir', default='data', help="directory holding movies.csv (see build_pipeline.py)")
+    args = parser.parse_args()
+
+    movies = MovieDimension.load(args.data_dir)
+    counts, sums = store_movie_totals(RatingsStore(args.store), movies)
+    genre_stats = movies.genre_totals(counts, sums).sort_values(by='rating_avg', ascending=False)
+    print(genre_stats.to_string(index=False))
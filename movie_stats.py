@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from movie_dimension import MovieDimension
+from ratings_store import RatingsStore
+
+# Incremental movie statistics.
+#
+# Instead of a groupby over every rating, the statistics are kept as sufficient statistics per
+# movie (number of ratings, sum and sum of squares of the ratings, indexed by movie id) plus the
+# global totals. A new batch of ratings (e.g. a daily delta) is added with one bincount over the
+# batch; avg_rating, the rating standard deviation, C (mean rating), m (quantile of the rating
+# counts) and weighted_rating are then derived from the per-movie arrays. The cost of an update
+# depends on the batch and the number of movies (17,770), never on the number of ratings already
+# aggregated.
+#
+#   python movie_stats.py --from-csv netflix_sampled_500k_proportional.csv      (initial build)
+#   python movie_stats.py --append ratings_2005-12-31.csv --dimension data      (daily delta)
+#
+# The statistics are saved in data/movie_stats (stats.npz + metadata.json). With --dimension the
+# rating_count / avg_rating / weighted_rating columns of data/movies.csv and movies_by_rating.csv
+# are refreshed from them (see movie_dimension.py), and the statistics are restricted to the movies
+# of the dimension: the ids are saved with the statistics, so later batches are filtered the same
+# way with or without --dimension.
+
+DEFAULT_STATS_DIR = os.path.join('data', 'movie_stats')
+ARRAYS_FILE = 'stats.npz'
+METADATA_FILE = 'metadata.json'
+
+# quantile of the rating counts used as minimum votes threshold m of the weighted rating
+MIN_VOTES_QUANTILE = 0.90
+
+
+class MovieStats:
+    """Per-movie count, sum and sum of squares of the ratings, updated batch by batch."""
+
+    def __init__(self, count=None, total=None, total_sq=None, min_votes_quantile=MIN_VOTES_QUANTILE, batches=None,
+                 movie_ids=None):
+        self.count = np.zeros(0, dtype=np.int64) if count is None else count
+        self.total = np.zeros(len(self.count), dtype=np.float64) if total is None else total
+        self.total_sq = np.zeros(len(self.count), dtype=np.float64) if total_sq is None else total_sq
+        self.min_votes_quantile = min_votes_quantile
+        self.batches = batches or []
+        # ids of the movies the statistics are restricted to (None: every movie)
+        self.movie_ids = None if movie_ids is None else np.asarray(movie_ids, dtype=np.int64)
+
+    @property
+    def n_ratings(self):
+        return int(self.count.sum())
+
+    def _grow(self, n_ids):
+        # arrays are indexed by movie id, they grow when a batch brings a higher id
+        if n_ids > len(self.count):
+            extra = n_ids - len(self.count)
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+            self.total = np.concatenate([self.total, np.zeros(extra, dtype=np.float64)])
+            self.total_sq = np.concatenate([self.total_sq, np.zeros(extra, dtype=np.float64)])
+
+    def add_batch(self, movie_ids, ratings, source=None):
+        """
+        Adds a batch of ratings (arrays of movie ids and ratings) to the statistics. Ratings of movies
+        outside of self.movie_ids are dropped.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if self.movie_ids is not None:
+            known = np.isin(movie_ids, self.movie_ids)
+            movie_ids, ratings = movie_ids[known], ratings[known]
+        if len(movie_ids) and movie_ids.min() < 0:
+            raise ValueError("Movie ids must be non-negative.")
+
+        self._grow(int(movie_ids.max()) + 1 if len(movie_ids) else 0)
+        n_ids = len(self.count)
+        self.count += np.bincount(movie_ids, minlength=n_ids)
+        self.total += np.bincount(movie_ids, weights=ratings, minlength=n_ids)
+        self.total_sq += np.bincount(movie_ids, weights=ratings * ratings, minlength=n_ids)
+
+        self.batches.append({'source': source, 'rows': len(movie_ids), 'added': time.strftime('%Y-%m-%d %H:%M:%S')})
+        return self
+
+    def merge(self, other):
+        """Adds the statistics of another MovieStats (e.g. computed on another part of the data)."""
+        self._grow(len(other.count))
+        n_ids = len(other.count)
+        self.count[:n_ids] += other.count
+        self.total[:n_ids] += other.total
+        self.total_sq[:n_ids] += other.total_sq
+        self.batches.extend(other.batches)
+        return self
+
+    # DERIVED STATISTICS
+
+    def rated(self):
+        """Ids of the movies having at least one rating."""
+        return np.flatnonzero(self.count)
+
+    def mean_rating(self):
+        """C: average of all the ratings."""
+        return self.total.sum() / self.n_ratings if self.n_ratings else np.nan
+
+    def min_votes(self):
+        """m: quantile of the rating counts of the rated movies."""
+        counts = self.count[self.count > 0]
+        return float(np.quantile(counts, self.min_votes_quantile)) if len(counts) else np.nan
+
+    def avg_rating(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+    def rating_std(self):
+        """Standard deviation of the ratings of every movie, from the sum of squares."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = self.total_sq / self.count - (self.total / self.count) ** 2
+        return np.where(self.count > 0, np.sqrt(np.maximum(variance, 0)), np.nan)
+
+    def weighted_rating(self):
+        """WR = v / (v + m) * R + m / (v + m) * C for every movie id (NaN without rating)."""
+        C, m = self.mean_rating(), self.min_votes()
+        v, R = self.count, self.avg_rating()
+        return (v / (v + m)) * R + (m / (v + m)) * C
+
+    def top(self, n=10):
+        """
+        Ids of the n movies with the highest weighted rating (best first, ties by movie id) among the
+        eligible movies, those with at least m ratings like the ranking of the notebook.
+        """
+        rated = self.rated()
+        rated = rated[self.count[rated] >= self.min_votes()]
+        weighted = self.weighted_rating()[rated]
+        n = min(n, len(rated))
+        if n == 0:
+            return rated[:0]
+        # partial selection over the movies, then only the n selected ones are sorted;
+        # movies tied with the n-th one are all kept so the tie order does not depend on the partition
+        threshold = -np.partition(-weighted, n - 1)[n - 1]
+        best = rated[weighted >= threshold]
+        best_weighted = weighted[weighted >= threshold]
+        return best[np.lexsort((best, -best_weighted))][:n]
+
+    def frame(self):
+        """Statistics of the rated movies (movie_id, rating_count, avg_rating, rating_std, weighted_rating)."""
+        rated = self.rated()
+        return pd.DataFrame({
+            'movie_id': rated,
+            'rating_count': self.count[rated],
+            'avg_rating': self.avg_rating()[rated],
+            'rating_std': self.rating_std()[rated],
+            'weighted_rating': self.weighted_rating()[rated],
+        })
+
+    # PERSISTENCE
+
+    def save(self, stats_dir=DEFAULT_STATS_DIR):
+        """Writes the statistics; files are written next to the old ones and renamed in place."""
+        os.makedirs(stats_dir, exist_ok=True)
+        arrays_path = os.path.join(stats_dir, ARRAYS_FILE)
+        with open(arrays_path + '.tmp', 'wb') as f:
+            arrays = {} if self.movie_ids is None else {'movie_ids': self.movie_ids}
+            np.savez(f, count=self.count, total=self.total, total_sq=self.total_sq, **arrays)
+        os.replace(arrays_path + '.tmp', arrays_path)
+
+        metadata_path = os.path.join(stats_dir, METADATA_FILE)
+        with open(metadata_path + '.tmp', 'w') as f:
+            json.dump({
+                'n_ratings': self.n_ratings,
+                'min_votes_quantile': self.min_votes_quantile,
+                'batches': self.batches,
+            }, f, indent=2)
+        os.replace(metadata_path + '.tmp', metadata_path)
+
+    @classmethod
+    def load(cls, stats_dir=DEFAULT_STATS_DIR):
+        with open(os.path.join(stats_dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        with np.load(os.path.join(stats_dir, ARRAYS_FILE)) as arrays:
+            return cls(arrays['count'], arrays['total'], arrays['total_sq'],
+                       metadata['min_votes_quantile'], metadata['batches'],
+                       arrays['movie_ids'] if 'movie_ids' in arrays.files else None)
+
+    @classmethod
+    def from_store(cls, store, block_rows=10_000_000, min_votes_quantile=MIN_VOTES_QUANTILE, movie_ids=None):
+        """Statistics of every rating of a ratings store, added block by block."""
+        stats = cls(min_votes_quantile=min_votes_quantile, movie_ids=movie_ids)
+        for start in range(0, len(store), block_rows):
+            stats.add_batch(store.column('movie_id')[start:start + block_rows],
+                            store.column('rating')[start:start + block_rows])
+        stats.batches = [{'source': store.store_dir, 'rows': len(store), 'added': time.strftime('%Y-%m-%d %H:%M:%S')}]
+        return stats
+
+
+def update_dimension(stats, data_dir='data'):
+    """
+    Copies the statistics into the movie dimension of data_dir (movies.csv) and rewrites
+    movies_by_rating.csv, so the app shows the updated ranking without a rebuild.
+    """
+    movies = MovieDimension.load(data_dir)
+    movie_ids = movies.table['movie_id'].to_numpy()
+    inside = movie_ids < len(stats.count)
+    ids = np.where(inside, movie_ids, 0)
+
+    movies.table['rating_count'] = np.where(inside, stats.count[ids], 0)
+    movies.table['avg_rating'] = np.where(inside, stats.avg_rating()[ids], np.nan)
+    movies.table['weighted_rating'] = np.where(inside, stats.weighted_rating()[ids], np.nan)
+    movies.save(data_dir)
+    movies.ranking_frame().drop(columns='movie_key').to_csv(os.path.join(data_dir, 'movies_by_rating.csv'), index=False)
+    return movies
+
+
+def _read_batch(csv_path):
+    df = pd.read_csv(csv_path, usecols=['movie_id', 'rating'])
+    return df['movie_id'].to_numpy(), df['rating'].to_numpy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds or updates the incremental movie statistics.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-csv', help="initial build from a ratings CSV (movie_id, rating columns)")
+    source.add_argument('--from-store', help="initial build from a ratings store (see ratings_store.py)")
+    source.add_argument('--append', nargs='+', help="ratings CSV batch(es) to add to the saved statistics")
+    parser.add_argument('--stats-dir', default=DEFAULT_STATS_DIR)
+    parser.add_argument('--min-votes-quantile', type=float, default=MIN_VOTES_QUANTILE)
+    parser.add_argument('--dimension', help="data directory whose movies.csv / movies_by_rating.csv are refreshed")
+    parser.add_argument('--top', type=int, default=10, help="number of movies of the printed top list")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    # with a movie dimension, ratings of movies outside of it are dropped like in build_pipeline.py
+    movie_ids = MovieDimension.load(args.dimension).table['movie_id'].to_numpy() if args.dimension else None
+    if args.from_csv:
+        stats = MovieStats(min_votes_quantile=args.min_votes_quantile, movie_ids=movie_ids)
+        stats.add_batch(*_read_batch(args.from_csv), source=args.from_csv)
+    elif args.from_store:
+        stats = MovieStats.from_store(RatingsStore(args.from_store), min_votes_quantile=args.min_votes_quantile,
+                                      movie_ids=movie_ids)
+    else:
+        # the restriction saved with the statistics applies unless a dimension is given
+        stats = MovieStats.load(args.stats_dir)
+        if movie_ids is not None:
+            stats.movie_ids = movie_ids
+        for batch_path in args.append:
+            stats.add_batch(*_read_batch(batch_path), source=batch_path)
+    stats.save(args.stats_dir)
+
+    if args.dimension:
+        update_dimension(stats, args.dimension)
+
+    print(f"{stats.n_ratings:,} ratings, C = {stats.mean_rating():.3f}, m = {stats.min_votes():.1f} "
+          f"({time.perf_counter() - start_time:.2f}s)")
+    top = stats.frame().set_index('movie_id').loc[stats.top(args.top)]
+    print(top.to_string())
@@ -0,0 +1,381 @@
+import bz2
+import fnmatch
+import glob
+import gzip
+import lzma
+import os
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+
+# Vectorized parser for the combined_data_*.txt layout:
+#
+#   1:
+#   1488844,3,2005-09-06
+#   822109,5,2005-05-13
+#   2:
+#   ...
+#
+# Instead of looping over lines in python, the file is read in large blocks of bytes and every
+# block is parsed with numpy array operations: newline and comma positions are located once,
+# header lines ("<movie_id>:") are detected from their last character and the movie id is
+# forward-filled onto the rating lines that follow them.
+
+# size of the blocks read from disk (bytes)
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# dtypes of the parsed columns
+COLUMN_DTYPES = {
+    'movie_id': np.int32,
+    'customer_id': np.int32,
+    'rating': np.int8,
+    'date': 'datetime64[D]',
+}
+
+_NEWLINE, _CR, _COMMA, _COLON, _ZERO = (ord(c) for c in '\n\r,:0')
+
+# a rating line is 'customer,r,YYYY-MM-DD': everything after the first comma has a fixed width
+_TAIL_WIDTH = len(',5,2005-09-06')
+
+
+# SOURCES
+# The combined_data files can be read as extracted text files, as compressed files
+# (combined_data_1.txt.gz / .bz2 / .xz) or directly out of the Kaggle zip archive. Members of a
+# zip archive are written 'archive.zip::combined_data_1.txt'. Everything is decompressed on the
+# fly block by block, nothing is extracted to disk.
+
+ARCHIVE_SEPARATOR = '::'
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+SOURCE_PATTERN = 'combined_data_*.txt'
+
+
+@contextmanager
+def open_source(source):
+    """Opens a source (plain file, compressed file or zip member) as a binary file object."""
+    if ARCHIVE_SEPARATOR in source:
+        archive_path, member = source.split(ARCHIVE_SEPARATOR, 1)
+        with zipfile.ZipFile(archive_path) as archive, archive.open(member) as f:
+            yield f
+        return
+
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(source)[1], open)
+    with opener(source, 'rb') as f:
+        yield f
+
+
+def is_plain_source(source):
+    """True for uncompressed files (the only ones that support seeking to a byte range)."""
+    return ARCHIVE_SEPARATOR not in source and os.path.splitext(source)[1] not in COMPRESSED_OPENERS
+
+
+def source_name(source):
+    """File name of the text file behind a source: 'data.zip::x/combined_data_1.txt.gz' -> 'combined_data_1.txt'."""
+    name = os.path.basename(source.split(ARCHIVE_SEPARATOR)[-1])
+    root, ext = os.path.splitext(name)
+    return root if ext in COMPRESSED_OPENERS else name
+
+
+def _archive_members(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        return [
+            f"{archive_path}{ARCHIVE_SEPARATOR}{member}" for member in archive.namelist()
+            if fnmatch.fnmatch(os.path.basename(member), SOURCE_PATTERN)
+        ]
+
+
+def discover_sources(data_path):
+    """
+    Lists the combined_data sources of a directory (plain, compressed or inside zip archives)
+    or of a single zip archive, sorted by file name. When the same file exists in several forms
+    the plain text file wins, then the compressed file, then the zip member.
+    """
+    if os.path.isfile(data_path) and zipfile.is_zipfile(data_path):
+        candidates = _archive_members(data_path)
+    else:
+        candidates = sorted(glob.glob(os.path.join(data_path, SOURCE_PATTERN)))
+        for ext in COMPRESSED_OPENERS:
+            candidates += sorted(glob.glob(os.path.join(data_path, SOURCE_PATTERN + ext)))
+        for archive_path in sorted(glob.glob(os.path.join(data_path, '*.zip'))):
+            candidates += _archive_members(archive_path)
+
+    sources = {}
+    for source in candidates:
+        sources.setdefault(source_name(source), source)
+    return [sources[name] for name in sorted(sources)]
+
+
+def empty_columns():
+    """Returns a dict of empty typed columns."""
+    return {col: np.empty(0, dtype=dtype) for col, dtype in COLUMN_DTYPES.items()}
+
+
+def concat_columns(parts):
+    """Concatenates a list of column dicts into a single dict."""
+    parts = list(parts)
+    if not parts:
+        return empty_columns()
+    return {col: np.concatenate([part[col] for part in parts]) for col in COLUMN_DTYPES}
+
+
+def _parse_uint(buf, starts, ends):
+    """
+    Parses the unsigned integers written in buf[starts[i]:ends[i]] for every i.
+    Returns the values and a mask telling which fields only contained digits.
+    """
+    widths = ends - starts
+    values = np.zeros(len(starts), dtype=np.int64)
+    valid = widths > 0
+    if len(starts) == 0:
+        return values, valid
+
+    last = len(buf) - 1
+    for j in range(int(widths.max())):
+        in_field = j < widths
+        digits = buf[np.minimum(starts + j, last)].astype(np.int64) - _ZERO
+        valid &= ~in_field | ((digits >= 0) & (digits <= 9))
+        values = np.where(in_field, values * 10 + digits, values)
+    return values, valid
+
+
+def _days_from_civil(year, month, day):
+    """Number of days since 1970-01-01 for proleptic gregorian dates (vectorized)."""
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse_block(block, current_movie_id=-1):
+    """
+    Parses a block of complete lines (bytes ending with a newline).
+
+    Parameters
+    ----------
+    block : bytes
+        Raw content of the file, cut on a line boundary.
+    current_movie_id : int
+        Movie id of the last header seen before this block (-1 if none).
+
+    Returns
+    -------
+    tuple
+        (dict of typed numpy columns, movie id of the last header seen at the end of the block)
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == _NEWLINE)
+    if len(line_ends) == 0:
+        return empty_columns(), current_movie_id
+
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+
+    # strip the '\r' of windows line endings
+    has_cr = (line_ends > line_starts) & (buf[np.maximum(line_ends - 1, 0)] == _CR)
+    line_ends = line_ends - has_cr
+
+    non_empty = line_ends > line_starts
+    is_header = non_empty & (buf[np.maximum(line_ends - 1, 0)] == _COLON)
+
+    # 1. Header lines: parse the movie ids
+    header_lines = np.flatnonzero(is_header)
+    header_ids, header_ok = _parse_uint(buf, line_starts[header_lines], line_ends[header_lines] - 1)
+    header_ids = np.where(header_ok, header_ids, -1)
+    last_movie_id = int(header_ids[-1]) if len(header_ids) else current_movie_id
+
+    # 2. Rating lines: locate the first comma of each line
+    rating_lines = np.flatnonzero(non_empty & ~is_header)
+    starts = line_starts[rating_lines]
+    ends = line_ends[rating_lines]
+
+    comma_pos = np.flatnonzero(buf == _COMMA)
+    first_comma_idx = np.searchsorted(comma_pos, starts)
+    found = first_comma_idx < len(comma_pos)
+    if len(comma_pos):
+        first_comma = np.where(found, comma_pos[np.minimum(first_comma_idx, len(comma_pos) - 1)], ends)
+    else:
+        first_comma = ends
+
+    # malformed rating lines (wrong number of fields, wrong widths) are skipped
+    last = len(buf) - 1
+    valid = found & (ends - first_comma == _TAIL_WIDTH)
+    valid &= buf[np.minimum(first_comma + 2, last)] == _COMMA
+
+    customer_ids, ok = _parse_uint(buf, starts, first_comma)
+    valid &= ok
+    ratings, ok = _parse_uint(buf, first_comma + 1, first_comma + 2)
+    valid &= ok
+    years, ok = _parse_uint(buf, first_comma + 3, first_comma + 7)
+    valid &= ok
+    months, ok = _parse_uint(buf, first_comma + 8, first_comma + 10)
+    valid &= ok
+    days, ok = _parse_uint(buf, first_comma + 11, first_comma + 13)
+    valid &= ok
+
+    # 3. Forward-fill the movie id: each rating line takes the id of the last header above it
+    # (lines above the first header of the block keep the id carried over from the previous block)
+    header_idx = np.searchsorted(header_lines, rating_lines, side='right')
+    movie_ids = np.concatenate([[current_movie_id], header_ids])[header_idx]
+    valid &= movie_ids >= 0
+
+    columns = {
+        'movie_id': movie_ids[valid].astype(COLUMN_DTYPES['movie_id']),
+        'customer_id': customer_ids[valid].astype(COLUMN_DTYPES['customer_id']),
+        'rating': ratings[valid].astype(COLUMN_DTYPES['rating']),
+        'date': _days_from_civil(years[valid], months[valid], days[valid]).astype(COLUMN_DTYPES['date']),
+    }
+    return columns, last_movie_id
+
+
+def iter_blocks(f, block_size=BLOCK_SIZE):
+    """
+    Reads a binary file object in blocks of about block_size bytes, each cut after its last newline.
+    """
+    remainder = b''
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        data = remainder + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            remainder = data
+            continue
+        remainder = data[cut:]
+        yield data[:cut]
+
+    # last line without a trailing newline
+    if remainder:
+        yield remainder + b'\n'
+
+
+class _RangeReader:
+    """File object wrapper that stops reading at byte `end`."""
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def read(self, size):
+        size = min(size, self.end - self.f.tell())
+        return self.f.read(size) if size > 0 else b''
+
+
+def iter_parsed_blocks(file_path, block_size=BLOCK_SIZE, start=0, end=None):
+    """
+    Parses a combined_data file block by block, yielding a dict of typed columns per block.
+    Memory stays bounded by the block size. file_path can be any source accepted by open_source
+    (plain, compressed or zip member).
+
+    start and end restrict parsing to a byte range of the file; a range that does not start
+    at the beginning of the file must start on a movie header line (see split_file_ranges).
+    Byte ranges are only supported for plain text files.
+    """
+    current_movie_id = -1
+    with open_source(file_path) as f:
+        if end is not None or start:
+            if not is_plain_source(file_path):
+                raise ValueError(f"Byte ranges are not supported for compressed source '{file_path}'.")
+            f.seek(start)
+            f = _RangeReader(f, end if end is not None else os.fstat(f.fileno()).st_size)
+        for block in iter_blocks(f, block_size):
+            columns, current_movie_id = parse_block(block, current_movie_id)
+            yield columns
+
+
+def parse_file(file_path, block_size=BLOCK_SIZE, start=0, end=None):
+    """
+    Parses a whole combined_data file (or a byte range of it) and returns a dict of typed
+    numpy columns (movie_id, customer_id, rating, date).
+    """
+    return concat_columns(iter_parsed_blocks(file_path, block_size, start, end))
+
+
+def count_rating_lines(file_path, block_size=BLOCK_SIZE):
+    """
+    Counts the rating lines of a combined_data file without parsing it
+    (lines minus movie header lines, ':' only appears in headers).
+    """
+    n_lines = n_headers = 0
+    with open_source(file_path) as f:
+        for block in iter_blocks(f, block_size):
+            n_lines += block.count(b'\n')
+            n_headers += block.count(b':')
+    return n_lines - n_headers
+
+
+# BYTE RANGES
+
+# files smaller than this are never split
+MIN_RANGE_SIZE = 32 * 1024 * 1024
+
+# how far we read past a split point to find the next movie header
+_SCAN_SIZE = 1024 * 1024
+
+
+def _next_header_offset(f, offset, file_size):
+    """Returns the offset of the first movie header line starting at or after offset."""
+    f.seek(offset)
+    pos = offset
+    # start from the next full line unless offset is already at the beginning of a line
+    if offset > 0:
+        f.seek(offset - 1)
+        if f.read(1) != b'\n':
+            f.readline()
+        pos = f.tell()
+
+    while pos < file_size:
+        window = f.read(_SCAN_SIZE)
+        if not window:
+            break
+        # only look at complete lines of the window
+        cut = window.rfind(b'\n') + 1
+        if cut == 0:
+            window += f.readline()
+            cut = len(window)
+        lines = window[:cut].split(b'\n')
+        line_start = pos
+        for line in lines:
+            if line.rstrip(b'\r').endswith(b':'):
+                return line_start
+            line_start += len(line) + 1
+        pos += cut
+        f.seek(pos)
+    return file_size
+
+
+def split_file_ranges(file_path, n_parts, min_size=None):
+    """
+    Splits a combined_data file into at most n_parts byte ranges [start, end)
+    (a single (0, None) range for compressed sources).
+    Every range after the first starts on a 'NNN:' movie header line, so the ranges can be
+    parsed independently (movie blocks never straddle two ranges).
+    """
+    if not is_plain_source(file_path):
+        # compressed streams cannot be entered in the middle, they are read by a single worker
+        return [(0, None)]
+
+    file_size = os.path.getsize(file_path)
+    min_size = MIN_RANGE_SIZE if min_size is None else min_size
+    n_parts = max(1, min(n_parts, file_size // max(min_size, 1)))
+    if n_parts <= 1:
+        return [(0, file_size)]
+
+    bounds = [0]
+    with open(file_path, 'rb') as f:
+        for i in range(1, n_parts):
+            offset = _next_header_offset(f, file_size * i // n_parts, file_size)
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    bounds.append(file_size)
+
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
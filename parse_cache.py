@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from netflix_parser import ARCHIVE_SEPARATOR, iter_parsed_blocks, source_name
+from ratings_store import METADATA_FILE, STORE_VERSION, RatingsStore, StoreWriter
+
+# Cache of the parsed combined_data files.
+#
+# Every source file is parsed once and saved as a ratings store (see ratings_store.py) under
+# <cache_dir>/<key>/, where key is derived from the content hash of the file. Later runs with
+# another seed, target or strategy read the typed columns from the cache instead of parsing text.
+#
+# The cache is opt-in (sampling.py --cache-dir .cache/parsed): the entries take about as much disk
+# as a ratings store of the same files, ~1 GB for the full dataset.
+#
+# Hashing a file still reads it, so manifest.json remembers the hash of every file with its size
+# and modification time: as long as those do not change the file is not read again.
+
+DEFAULT_CACHE_DIR = os.path.join('.cache', 'parsed')
+
+MANIFEST_FILE = 'manifest.json'
+
+_HASH_CHUNK = 8 * 1024 * 1024
+
+
+def file_content_hash(path):
+    """blake2b hash of the raw bytes of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _build_entry(source, entry_dir):
+    # parses a source into a cache entry, runs in a worker process when several files are missing
+    start_time = time.perf_counter()
+    writer = StoreWriter(entry_dir)
+    for columns in iter_parsed_blocks(source):
+        writer.append(columns)
+    writer.add_source(source_name(source), 0)
+    parse_seconds = time.perf_counter() - start_time
+    writer.close({'source': source, 'parse_seconds': parse_seconds})
+    return parse_seconds
+
+
+class ParseCache:
+    """Content-addressed cache of parsed sources, with hit / miss statistics."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+        self.hits = []
+        self.misses = []
+        self.saved_seconds = 0.0
+        self.parse_seconds = 0.0
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def file_hash(self, path):
+        """Content hash of a file, recomputed only when its size or modification time changed."""
+        stat = os.stat(path)
+        known = self.manifest.get(os.path.abspath(path))
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['hash']
+
+        content_hash = file_content_hash(path)
+        self.manifest[os.path.abspath(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash}
+        self._save_manifest()
+        return content_hash
+
+    def entry_dir(self, source):
+        """Directory of the cache entry of a source (a file or a member of a zip archive)."""
+        path, _, member = source.partition(ARCHIVE_SEPARATOR)
+        key = hashlib.blake2b(f"{self.file_hash(path)}:{member}:{STORE_VERSION}".encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def prepare(self, sources, workers=1):
+        """
+        Makes sure every source has a cache entry, parsing the missing ones (in parallel with workers > 1).
+        Returns {file name: entry directory}.
+        """
+        entries = {}
+        missing = []
+        for source in sources:
+            entry_dir = self.entry_dir(source)
+            entries[source_name(source)] = entry_dir
+            if os.path.exists(os.path.join(entry_dir, METADATA_FILE)):
+                self.hits.append(source)
+                self.saved_seconds += RatingsStore(entry_dir).metadata.get('parse_seconds', 0.0)
+            else:
+                self.misses.append(source)
+                missing.append((source, entry_dir))
+
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                self.parse_seconds += sum(executor.map(_build_entry, *zip(*missing)))
+        else:
+            for source, entry_dir in missing:
+                self.parse_seconds += _build_entry(source, entry_dir)
+        return entries
+
+    def disk_bytes(self):
+        """Size of the cache directory on disk."""
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(self.cache_dir) for name in names)
+
+    def report(self):
+        """One line summary of the cache usage of this run."""
+        return (
+            f"Parse cache: {len(self.hits)} hit(s), {len(self.misses)} miss(es), "
+            f"{self.parse_seconds:.1f}s spent parsing, ~{self.saved_seconds:.1f}s of parsing saved, "
+            f"{self.disk_bytes() / 1024 ** 2:.0f} MB in {self.cache_dir}."
+        )
@@ -1,19 +1,32 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import numpy as np
-from article_netflix import get_wordcloud_figure_from_url 
+from ratings_index import take_rows
+from partitioned_store import yearly_movie_ratings
+from date_codes import date_part
+from movie_dimension import encode_genres, genre_matrix
+from disk_cache import DERIVED_CACHE, cache_key
+from dtype_plan import DATE_CODE_COLUMNS, date_column
+
+# The plotting libraries are imported by the functions that use them, not when the app starts:
+# plotly.express by the first chart, seaborn / matplotlib by the heatmap, the scraping and word
+# cloud libraries by the word cloud (see import_report.py for the import times).
 
 
 # HISTOGRAM FUNCTION WITH PLOTLY EXPRESS 
-def plot_plotly_histogram(df, x_col, bins, title):
+def plot_plotly_histogram(df, x_col, bins, title, movies=None):
     """
     Generates a histogram for the numerical variables of the dataset 
+    Movie attributes (e.g. year) are taken from the movie dimension `movies` (see movie_dimension.py).
     """
+    import plotly.express as px
+
+    # rating_date is rebuilt from the day codes (see dtype_plan.py), a movie attribute is resolved
+    # by indexing the dimension with movie_key
+    if x_col in DATE_CODE_COLUMNS and x_col not in df.columns:
+        df = date_column(df, x_col).to_frame()
+    elif x_col not in df.columns and movies is not None:
+        df = movies.resolve(df, x_col).to_frame()
     
     # Create the Plotly Express Histogram
     fig = px.histogram(
@@ -70,18 +83,28 @@ def plot_plotly_histogram(df, x_col, bins, title):
 # PIE CHART FUNCTION WITH PLOTLY EXPRESS 
 
 
-def plot_plotly_pie(df, category_col, title):
+def plot_plotly_pie(df, category_col, title, movies=None, cube=None):
     """
     Generates a  pie chart for the categorical variables 
+    Movie attributes (e.g. decade) are counted per movie and grouped through the movie dimension `movies`.
+    With the aggregate cube (see aggregate_cube.py) the counts are read from its cells instead.
     """
+    import plotly.express as px
     
     #  Calculate counts
-    category_counts = df[category_col].value_counts().reset_index()
+    if cube is not None and category_col in cube.dimensions:
+        category_counts = cube.query(category_col)[[category_col, 'rating_count']].sort_values(by='rating_count', ascending=False)
+    elif category_col not in df.columns and movies is not None:
+        category_counts = movies.group_ratings(
+            df['movie_key'].to_numpy(), df['rating'].to_numpy(dtype=np.float64, na_value=0), category_col
+        )[[category_col, 'rating_count']].sort_values(by='rating_count', ascending=False)
+    else:
+        category_counts = df[category_col].value_counts().reset_index()
     category_counts.columns = [category_col, 'Count']
 
     
     # Sort dataframes 
-    original_col = df[category_col] 
+    original_col = df[category_col] if category_col in df.columns else category_counts[category_col]
     
     if pd.api.types.is_categorical_dtype(original_col) and original_col.cat.ordered:
         
@@ -139,11 +162,14 @@ def plot_plotly_pie(df, category_col, title):
 
 # BAR PLOT AGGREGATING FUNCTION WITH PLOTLY EXPRESS  
 
-def plot_plotly_bar(df, category_col, metric_type, title, genre_analysis_df=None):
+def plot_plotly_bar(df, category_col, metric_type, title, genre_analysis_df=None, movies=None, cube=None):
     """
     Generates a single bar chart for either Count or Average Rating 
     for a selected category.
+    Movie attributes (e.g. decade) are aggregated per movie and grouped through the movie dimension `movies`.
+    With the aggregate cube (see aggregate_cube.py) the metrics are read from its cells instead.
     """
+    import plotly.express as px
     
     # Define column names based on the metric type selected by the user
     if metric_type == 'Average Rating':
@@ -153,8 +179,12 @@ def plot_plotly_bar(df, category_col, metric_type, title, genre_analysis_df=None
         metric_col_name = 'rating_count'
         y_axis_label = 'Total Ratings (Count)'
 
+    # precomputed aggregates: a groupby over the cells of the cube, not over the ratings
+    if cube is not None and category_col in cube.dimensions:
+        metric_df = cube.query(category_col)
+
     # conditional statement for category genre - use the dataframe where genres are split 
-    if category_col == 'genres':
+    elif category_col == 'genres':
         
         if genre_analysis_df is None:
             # Fallback for safety
@@ -165,6 +195,12 @@ def plot_plotly_bar(df, category_col, metric_type, title, genre_analysis_df=None
         metric_df = genre_analysis_df.copy()
 
 
+    elif category_col not in df.columns and movies is not None:
+        # Data Aggregation on the movies: ratings summed per movie_key, then grouped by the attribute
+        metric_df = movies.group_ratings(
+            df['movie_key'].to_numpy(), df['rating'].to_numpy(dtype=np.float64, na_value=0), category_col
+        )
+
     else: 
     # Data Aggregation: Calculate Count and Average Rating
         metric_df = df.groupby(category_col).agg(
@@ -214,6 +250,7 @@ def plot_plotly_bar_ranking(df, x_col, y_col, title, ascending_order=True):
     """
     generates a horizontal bar plot with specified order 
     """
+    import plotly.express as px
     fig = px.bar(
         df,
         x=x_col,
@@ -255,44 +292,18 @@ def plot_plotly_bar_ranking(df, x_col, y_col, title, ascending_order=True):
 
 # CORRELATION MATRIX HEATMAP WITH SEABORN 
 
-def plot_genre_rating_heatmap(df, title):
+def plot_genre_rating_heatmap(df, title, movies=None):
     """
     Generates a full correlation matrix heatmap showing the relationship 
     between 'rating' and all multi-hot encoded genres. 
     Not customizable. 
+    The multi-hot rows are decoded from genre bitmasks (see movie_dimension.py), no row is exploded.
     
     """
     
-    # Check for required columns
-    required_cols = ['rating', 'genres']
-    if not all(col in df.columns for col in required_cols):
-        st.error(f"Cannot create Heatmap: Missing one or more required columns ({required_cols}).")
-        return
-        
-    # 1. Prepare Data (Multi-hot Encoding)
-    # ------------------------------------------------------------------
-    #  select only 'rating' and 'genres'
-    df_encoded = df[required_cols].copy().dropna(subset=required_cols)
-    
-    if df_encoded.empty:
-        st.warning("No data remains for Heatmap after dropping rows with missing ratings/genres.")
+    df_final_matrix_data = _genre_dummies(df, movies)
+    if df_final_matrix_data is None:
         return
-        
-    df_encoded['genres'] = df_encoded['genres'].str.split("|")
-
-    # Explode and create multi-hot encoded genre columns
-    df_genre_dummies = (
-        df_encoded["genres"]
-        .explode()
-        .str.strip() 
-        .str.get_dummies()
-        .groupby(level=0)
-        .sum()
-    )
-
-    # Join the multi-hot encoded genre columns and drop the original 'genres' column
-    # The resulting DataFrame contains 'rating' and all the individual genre columns
-    df_final_matrix_data = df_encoded.drop(columns='genres').join(df_genre_dummies)
     
     # 2. Correlation Calculation
     # ------------------------------------------------------------------
@@ -304,6 +315,8 @@ def plot_genre_rating_heatmap(df, title):
     df_corr_matrix = df_corr_data.corr()
 
     # 3. Plotting (Using Matplotlib and Seaborn)
+    import matplotlib.pyplot as plt
+    import seaborn as sns
   
     fig, ax = plt.subplots(figsize=(14, 8)) 
     
@@ -325,25 +338,65 @@ def plot_genre_rating_heatmap(df, title):
     plt.close(fig)
 
 
+def _genre_dummies(df, movies=None):
+    """
+    'rating' and one multi-hot column per genre present in the data, decoded from genre bitmasks:
+    the masks of the movie dimension indexed by movie_key, or masks encoded once per distinct
+    genres string when df still carries the genres.
+    """
+    # 1. Prepare Data (Multi-hot Encoding)
+    # ------------------------------------------------------------------
+    if 'genres' not in df.columns and movies is not None:
+        df_encoded = df[['rating', 'movie_key']].dropna(subset=['rating'])
+        vocabulary = movies.genre_vocabulary
+        masks = movies.genre_masks[df_encoded['movie_key'].to_numpy()]
+    elif 'genres' in df.columns and 'rating' in df.columns:
+        df_encoded = df[['rating', 'genres']].dropna(subset=['rating', 'genres'])
+        vocabulary, masks = encode_genres(df_encoded['genres'])
+    else:
+        st.error("Cannot create Heatmap: Missing one or more required columns (['rating', 'genres']).")
+        return None
+
+    if df_encoded.empty:
+        st.warning("No data remains for Heatmap after dropping rows with missing ratings/genres.")
+        return None
+
+    dummies = genre_matrix(masks, len(vocabulary))
+    # keep the genres present in the data
+    present = dummies.any(axis=0)
+    df_genre_dummies = pd.DataFrame(
+        dummies[:, present],
+        columns=np.array(vocabulary, dtype=object)[present],
+        index=df_encoded.index
+    )
+
+    # The resulting DataFrame contains 'rating' and all the individual genre columns
+    return df_encoded[['rating']].join(df_genre_dummies)
+
+
 
 
 # STACKED BAR PLOT FUNCTION WITH PLOTLY EXPRESS 
-def plot_stacked_activity_rating_count(df, title):
+def plot_stacked_activity_rating_count(df, title, cube=None):
     """
     Generates a vertical bar plot per customer  activity level  with stacked bars - colors correspond to ranking category.
+    With the aggregate cube (see aggregate_cube.py) the counts are read from its cells instead.
     """
+    import plotly.express as px
     required_cols = ['activity_level', 'rating_category']
-    if not all(col in df.columns for col in required_cols):
+    if cube is not None:
+        plot_data = cube.query(required_cols)[required_cols + ['rating_count']]
+    elif not all(col in df.columns for col in required_cols):
         st.error(f"Cannot create Stacked Bar Chart: Missing one or more required columns ({required_cols}).")
         return
-
-    # Aggregate Data
-    # Calculate the count of ratings for each combination of Activity Level and Rating Category
-    plot_data = (
-        df.groupby(required_cols)
-        .size() # Counts the number of rows (ratings) in each group
-        .reset_index(name='rating_count')
-    )
+    else:
+        # Aggregate Data
+        # Calculate the count of ratings for each combination of Activity Level and Rating Category
+        plot_data = (
+            df.groupby(required_cols)
+            .size() # Counts the number of rows (ratings) in each group
+            .reset_index(name='rating_count')
+        )
     
     activity_order = ['Low', 'Medium', 'High']
     category_order = ['Low', 'Neutral', 'High']
@@ -388,11 +441,20 @@ def plot_stacked_activity_rating_count(df, title):
 
 
 # ANIMATED BAR PLOT WITH PLOTLY EXPRESS 
-def plot_animated_rating_evolution(df_main, movies_by_rating):
+def plot_animated_rating_evolution(df_main, movies_by_rating, movie_index=None, movies=None, engine=None,
+                                   partitioned=None, years=None):
     """
-    Creates an animated bar plot showing average ranking across years (date of ranking). Not customizable. 
+    Creates an animated bar plot showing average ranking across years (date of ranking), over the
+    rating years (first, last) of `years` (all of them when None).
+    If movie_index (CSR index of df_main by movie_key, see ratings_index.py) is given, the history of the
+    top movies is sliced from it instead of scanning every row. Titles are read from the movie dimension
+    `movies` when df_main only holds movie keys.
+    With the SQL engine (see query_engine.py) the yearly aggregates of the top movies are one query instead.
+    With the partitioned ratings store (see partitioned_store.py) they are read from the partitions of
+    the selected years only, over every rating of the store.
 
     """
+    import plotly.express as px
     
     
     N_TOP = 10 
@@ -409,28 +471,65 @@ def plot_animated_rating_evolution(df_main, movies_by_rating):
         .head(N_TOP)
     )
     
-    popular_movie_ids = df_top_movies_stats['movie_id'].tolist()
+    # rows of the star schema are keyed by movie_key, denormalized rows by movie_id
+    key_col = 'movie_key' if 'movie_key' in df_main.columns else 'movie_id'
+    popular_movie_ids = df_top_movies_stats[key_col].tolist()
     
-    # Filter the Main DataFrame for the history of these movies 
-    df_history = df_main[df_main['movie_id'].isin(popular_movie_ids)].copy()
-
-    # extract the year from rating date 
-    if 'rating_date' in df_history.columns:
-        
-        df_history['rating_year'] = df_history['rating_date'].dt.year 
+    if partitioned is not None and 'title' in df_top_movies_stats.columns:
+        # only the partitions of the selected years are opened, titles of the top movies by movie_id
+        titles = df_top_movies_stats.set_index('movie_id')['title']
+        movie_ratings_by_year = (
+            yearly_movie_ratings(partitioned, df_top_movies_stats['movie_id'].tolist(), years)
+            .rename(columns={'rating_count': 'yearly_count', 'rating_avg': 'yearly_avg_rating'})
+        )
+        movie_ratings_by_year.insert(0, 'title', titles.reindex(movie_ratings_by_year.pop('movie_id')).to_numpy())
+    elif engine is not None and key_col == 'movie_key':
+        # filtered aggregate: only the ratings of the top movies are scanned, titles joined from the dimension
+        movie_ratings_by_year = (
+            engine.aggregate(['title', 'rating_year'], where={'movie_key': popular_movie_ids})
+            .dropna(subset=['rating_year'])
+            .rename(columns={'rating_count': 'yearly_count', 'rating_avg': 'yearly_avg_rating'})
+            .drop(columns='rating_std')
+        )
     else:
-        st.warning("Cannot create animated chart: 'rating_date' column missing or invalid.")
-        return None
+        # Filter the Main DataFrame for the history of these movies 
+        if movie_index is not None:
+            df_history = take_rows(df_main, movie_index, popular_movie_ids).copy()
+        else:
+            df_history = df_main[df_main[key_col].isin(popular_movie_ids)].copy()
+
+        if 'title' not in df_history.columns and movies is not None:
+            df_history['title'] = movies.resolve(df_history, 'title')
+
+        # extract the year from rating date (lookup table on the day codes when they are available)
+        if 'rating_day' in df_history.columns:
+
+            rating_year = date_part(df_history['rating_day'].to_numpy(), 'year')
+            # missing dates (-1) are left out like NaT would be
+            df_history['rating_year'] = np.where(rating_year >= 0, rating_year, np.nan)
+        elif 'rating_date' in df_history.columns:
+        
+            df_history['rating_year'] = df_history['rating_date'].dt.year 
+        else:
+            st.warning("Cannot create animated chart: 'rating_date' column missing or invalid.")
+            return None
+
+        # Aggregate Data by Movie and Year (Average Rating Evolution)
+        movie_ratings_by_year = df_history.groupby(['title', 'rating_year']).agg(
+            yearly_count=('rating', 'count'), 
+            yearly_avg_rating=('rating', 'mean') 
+        ).reset_index()
 
-    # Aggregate Data by Movie and Year (Average Rating Evolution)
-    movie_ratings_by_year = df_history.groupby(['title', 'rating_year']).agg(
-        yearly_count=('rating', 'count'), 
-        yearly_avg_rating=('rating', 'mean') 
-    ).reset_index()
+    if years is not None:
+        # the partitions are already pruned to these years, the other paths filter their aggregates
+        movie_ratings_by_year = movie_ratings_by_year[movie_ratings_by_year['rating_year'].between(*years)]
+    if movie_ratings_by_year.empty:
+        st.warning("Cannot create animated chart: no ratings of the top movies in the selected years.")
+        return None
 
     # Fill Missing Years (Crucial for smooth animation)
     all_years_titles = pd.MultiIndex.from_product(
-        [movie_ratings_by_year['title'].unique(), movie_ratings_by_year['rating_year'].unique()],
+        [movie_ratings_by_year['title'].unique(), np.sort(movie_ratings_by_year['rating_year'].unique())],
         names=['title', 'rating_year']
     ).to_frame(index=False)
 
@@ -495,4 +594,15 @@ def plot_animated_rating_evolution(df_main, movies_by_rating):
 
 @st.cache_data
 def load_wordcloud_figure(url):
-    return get_wordcloud_figure_from_url(url)
\ No newline at end of file
+    import article_netflix
+
+    # also kept on disk: a restarted app does not scrape the article and draw the cloud again
+    key = cache_key('wordcloud', (article_netflix,), (), url)
+    return DERIVED_CACHE.get_or_compute(key, lambda: article_netflix.get_wordcloud_figure_from_url(url))
+
+
+def show_wordcloud_figure(figure):
+    """Displays the word cloud figure, then closes it (matplotlib is only imported here)."""
+    import matplotlib.pyplot as plt
+    st.pyplot(figure)
+    plt.close(figure)
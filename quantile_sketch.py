@@ -0,0 +1,327 @@
+import argparse
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from customer_activity import ACTIVITY_QUANTILES, CustomerActivity, write_store_levels
+from movie_stats import MIN_VOTES_QUANTILE
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+
+# Streaming quantile sketches for the thresholds of the pipeline.
+#
+# m (90th percentile of the rating counts of the movies) and the activity_level bins (quintiles of
+# the rating counts of the customers) are quantiles of count columns. A KLL sketch keeps a few
+# hundred weighted items instead of the column: values are added in one pass, sketches built per
+# chunk or per worker are merged, and any quantile is answered with a bounded rank error. The movie
+# counts are sketched per source file (the rows are grouped by movie), the customer counts per
+# partition of the customer ids, so neither count column is materialized.
+#
+# The rank error is the normalized rank error of KLL at 99% confidence (empirical formula of the
+# Apache DataSketches library): the value returned for q has a true rank in [q - eps, q + eps],
+# about 1.3% for k = 200.
+#
+#   python quantile_sketch.py --store data/ratings_store --k 200             (approx thresholds)
+#   python quantile_sketch.py --store data/ratings_store --k 200 --exact     (exact vs approx report)
+
+DEFAULT_K = 200
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch. Level h holds items of weight 2^h; when the sketch is full the lowest
+    over-capacity level is sorted and every other item (random offset) is promoted to level h + 1.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self.c = 2 / 3
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.c ** depth)))
+
+    def _size(self):
+        return sum(len(items) for items in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            level = next(h for h in range(len(self.levels)) if len(self.levels[h]) > self._capacity(h))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+
+            items = np.sort(self.levels[level])
+            # an odd item stays at its level so the total weight is kept exact
+            keep = items[:len(items) % 2]
+            pairs = items[len(items) % 2:]
+            promoted = pairs[self.rng.integers(2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def update(self, values):
+        """Adds an array of values."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return self
+        self.n += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        # values enter level 0 in pieces of k items so the sketch never grows past its capacity
+        for start in range(0, len(values), self.k):
+            self.levels[0] = np.concatenate([self.levels[0], values[start:start + self.k]])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Adds the items of another sketch (built on other data, e.g. by another worker)."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** h, dtype=np.int64)
+                                  for h, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        """Value whose normalized rank is about q (0 gives the minimum, 1 the maximum)."""
+        if self.n == 0:
+            return np.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        items, cumulative = self._weighted_items()
+        index = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(items[min(index, len(items) - 1)])
+
+    def rank(self, value):
+        """Approximate fraction of the values <= value."""
+        if self.n == 0:
+            return np.nan
+        items, cumulative = self._weighted_items()
+        index = np.searchsorted(items, value, side='right')
+        return float(cumulative[index - 1] / cumulative[-1]) if index else 0.0
+
+    @property
+    def rank_error(self):
+        """Normalized rank error at 99% confidence (DataSketches KLL formula)."""
+        return 2.296 / self.k ** 0.9723
+
+    def estimate(self, q):
+        """Quantile q with the values at q -/+ the rank error, between which the exact quantile lies."""
+        eps = self.rank_error
+        return {
+            'quantile': q,
+            'approx': self.quantile(q),
+            'low': self.quantile(max(0.0, q - eps)),
+            'high': self.quantile(min(1.0, q + eps)),
+            'rank_error': eps,
+        }
+
+
+def sketch_bins(sketch, quantiles=ACTIVITY_QUANTILES):
+    """Bin edges of pd.qcut(q=quantiles, duplicates='drop') read from a sketch."""
+    return np.unique([sketch.quantile(i / quantiles) for i in range(quantiles + 1)])
+
+
+# MOVIE RATING COUNTS
+
+def _source_movie_counts(task):
+    # rating counts of the movies of rows [start, stop) of a store, read block by block; the raw
+    # files are grouped by movie so a count is complete when its run of rows ends (a run can continue
+    # in the next block). Returns the sketch, the movies seen and whether the rows were grouped.
+    store_dir, start, stop, k, block_rows = task
+    store = RatingsStore(store_dir)
+    sketch = KLLSketch(k, seed=start)
+    seen = np.zeros(np.iinfo(np.int16).max + 1, dtype=bool)
+    grouped = True
+    carry_id, carry_count = -1, 0
+
+    for block_start in range(start, stop, block_rows):
+        movie_ids = np.asarray(store.column('movie_id')[block_start:min(block_start + block_rows, stop)])
+        run_starts = np.flatnonzero(np.r_[True, movie_ids[1:] != movie_ids[:-1]])
+        run_ids = movie_ids[run_starts]
+        run_lengths = np.diff(np.r_[run_starts, len(movie_ids)])
+
+        if run_ids[0] == carry_id:
+            run_lengths[0] += carry_count
+        elif carry_count:
+            sketch.update([carry_count])
+
+        # a movie starting a new run a second time means the rows are not grouped by movie
+        new_runs = run_ids[1:] if run_ids[0] == carry_id else run_ids
+        if seen[new_runs].any() or len(np.unique(new_runs)) != len(new_runs):
+            grouped = False
+        seen[new_runs] = True
+
+        sketch.update(run_lengths[:-1])
+        carry_id, carry_count = run_ids[-1], run_lengths[-1]
+
+    if carry_count:
+        sketch.update([carry_count])
+    return sketch, seen, grouped
+
+
+def movie_count_sketch(store_dir=DEFAULT_STORE_DIR, k=DEFAULT_K, block_rows=10_000_000, workers=1):
+    """
+    Sketch of the number of ratings of every movie of a store, built per source file (in parallel
+    with workers > 1) and merged. Stores that are not grouped by movie (e.g. built from a shuffled
+    sample) are counted with one bincount over the movie ids instead.
+    """
+    store = RatingsStore(store_dir)
+    tasks = [(store_dir, source['start'], source['start'] + source['rows'], k, block_rows)
+             for source in store.sources if source['rows']]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_source_movie_counts, tasks))
+    else:
+        parts = [_source_movie_counts(task) for task in tasks]
+
+    # sketches of the sources can be merged when every movie is in a single source
+    seen_total = sum(seen.astype(np.int64) for _, seen, _ in parts) if parts else np.zeros(0)
+    if all(grouped for _, _, grouped in parts) and not (seen_total > 1).any():
+        sketch = KLLSketch(k)
+        for part_sketch, _, _ in parts:
+            sketch.merge(part_sketch)
+        return sketch
+
+    counts = movie_counts(store, block_rows)
+    return KLLSketch(k).update(counts[counts > 0])
+
+
+def movie_counts(store, block_rows=10_000_000):
+    """Exact number of ratings of every movie id of a store, accumulated block by block."""
+    counts = np.zeros(0, dtype=np.int64)
+    for block_start in range(0, len(store), block_rows):
+        movie_ids = np.asarray(store.column('movie_id')[block_start:block_start + block_rows], dtype=np.int64)
+        block_counts = np.bincount(movie_ids)
+        counts = np.pad(counts, (0, max(0, len(block_counts) - len(counts))))
+        counts[:len(block_counts)] += block_counts
+    return counts
+
+
+# CUSTOMER RATING COUNTS
+
+def _partition_customer_counts(task):
+    # rating counts of the customers whose id is `partition` modulo n_partitions, accumulated over
+    # every row of a store; only the counts of this partition of the customers are in memory
+    store_dir, partition, n_partitions, k, block_rows = task
+    store = RatingsStore(store_dir)
+    counts = np.zeros(0, dtype=np.int64)
+    for start in range(0, len(store), block_rows):
+        customer_ids = np.asarray(store.column('customer_id')[start:start + block_rows])
+        local_ids = customer_ids[customer_ids % n_partitions == partition] // n_partitions
+        if len(local_ids):
+            block_counts = np.bincount(local_ids)
+            counts = np.pad(counts, (0, max(0, len(block_counts) - len(counts))))
+            counts[:len(block_counts)] += block_counts
+    return KLLSketch(k, seed=partition).update(counts[counts > 0])
+
+
+def customer_count_sketch(store_dir=DEFAULT_STORE_DIR, k=DEFAULT_K, block_rows=10_000_000, partitions=8, workers=1):
+    """
+    Sketch of the number of ratings of every customer of a store. A customer's ratings are spread
+    over the files, so the customers are split in partitions (id modulo partitions): the counts of
+    one partition are accumulated over the customer ids of the store, sketched and released, then
+    the partition sketches (built in parallel with workers > 1) are merged. The count column of all
+    the customers is never held in memory, at the cost of one read of the customer ids per partition.
+    """
+    tasks = [(store_dir, partition, partitions, k, block_rows) for partition in range(partitions)]
+    if workers > 1 and partitions > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_partition_customer_counts, tasks))
+    else:
+        parts = map(_partition_customer_counts, tasks)
+
+    sketch = KLLSketch(k)
+    for part in parts:
+        sketch.merge(part)
+    return sketch
+
+
+def threshold_report(store_dir=DEFAULT_STORE_DIR, k=DEFAULT_K, min_votes_quantile=MIN_VOTES_QUANTILE,
+                     activity_quantiles=ACTIVITY_QUANTILES, block_rows=10_000_000, workers=1,
+                     customer_sketch=None, exact=False):
+    """
+    Approximate m and activity bin edges of a store, with the error bound of each approximation
+    (value range [low, high] and normalized rank error). The customer sketch is computed when it is
+    not given. With exact, the exact values (from the exact movie and customer counts of the store)
+    and the observed rank error are added.
+    """
+    movie_sketch = movie_count_sketch(store_dir, k, block_rows, workers)
+    if customer_sketch is None:
+        customer_sketch = customer_count_sketch(store_dir, k, block_rows, workers=workers)
+    thresholds = [('m', movie_sketch, min_votes_quantile)]
+    thresholds += [(f'activity edge {i}/{activity_quantiles}', customer_sketch, i / activity_quantiles)
+                   for i in range(1, activity_quantiles)]
+
+    if not exact:
+        return pd.DataFrame([{'threshold': name, **sketch.estimate(q), 'sketch_items': sum(len(items) for items in sketch.levels)}
+                             for name, sketch, q in thresholds])
+
+    store = RatingsStore(store_dir)
+    counts = movie_counts(store, block_rows)
+    activity = CustomerActivity.from_store(store, block_rows, quantiles=None)
+    exact_counts = [counts[counts > 0]] + [activity.num_ratings] * (activity_quantiles - 1)
+
+    rows = []
+    for (name, sketch, q), exact_values in zip(thresholds, exact_counts):
+        estimate = sketch.estimate(q)
+        sorted_values = np.sort(exact_values)
+        # true normalized rank of the approximate value (the rank interval of its ties)
+        rank_low = np.searchsorted(sorted_values, estimate['approx'], side='left') / len(sorted_values)
+        rank_high = np.searchsorted(sorted_values, estimate['approx'], side='right') / len(sorted_values)
+        rows.append({
+            'threshold': name,
+            'exact': float(np.quantile(exact_values, q)),
+            **estimate,
+            'observed_rank_error': max(0.0, rank_low - q, q - rank_high),
+            'sketch_items': sum(len(items) for items in sketch.levels),
+            'values': len(exact_values),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exact vs sketched quantile thresholds (m, activity bins) of a ratings store.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help="sketch size parameter (rank error ~ 2.3 / k^0.97)")
+    parser.add_argument('--min-votes-quantile', type=float, default=MIN_VOTES_QUANTILE)
+    parser.add_argument('--activity-quantiles', type=int, default=ACTIVITY_QUANTILES)
+    parser.add_argument('--block-rows', type=int, default=10_000_000)
+    parser.add_argument('--workers', type=int, default=1, help="movie count and customer partition sketches built in parallel")
+    parser.add_argument('--partitions', type=int, default=8, help="customer partitions of the customer count sketch")
+    parser.add_argument('--exact', action='store_true',
+                        help="also compute the exact thresholds (full movie and customer counts) and the observed rank errors")
+    parser.add_argument('--write-levels', action='store_true',
+                        help="label the customers of the store with the sketched activity bins (see customer_activity.py)")
+    args = parser.parse_args()
+
+    # the customer sketch gives both the reported edges and the bins of the levels
+    customer_sketch = customer_count_sketch(args.store, args.k, args.block_rows, args.partitions, args.workers)
+    report = threshold_report(args.store, args.k, args.min_votes_quantile, args.activity_quantiles,
+                              args.block_rows, args.workers, customer_sketch, exact=args.exact)
+    print(report.to_string(index=False))
+
+    if args.write_levels:
+        bins = sketch_bins(customer_sketch, args.activity_quantiles)
+        activity = write_store_levels(args.store, args.block_rows, bins=bins)
+        print(activity.summary().to_string())
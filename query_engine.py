@@ -0,0 +1,218 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_files import read_columnar
+from customer_activity import ACTIVITY_DIR, LEVELS_FILE, load_store_levels
+from date_codes import MISSING_DAY
+from dtype_plan import apply_dtype_plan
+from movie_dimension import ACTIVITY_LEVELS, MovieDimension, typed_fact_table
+from ratings_store import RatingsStore
+
+# Embedded SQL engine over the ratings and the movie dimension.
+#
+# A new slice of the data used to mean a new pandas pipeline in plotting_utils.py or the notebook.
+# QueryEngine registers the app tables in an in-process DuckDB database (no server, no copy: DuckDB
+# scans the NumPy columns of the frames, memory-mapped ones included) and exposes them as views:
+#
+#   ratings         main_df (movie_key, customer_id, rating, rating_day, rating_category,
+#                   activity_level) + rating_date, rating_year
+#   movies          the movie dimension (movie_key, movie_id, title, year, decade, genres, statistics)
+#   movie_genres    (movie_key, genre): one row per genre of every movie
+#   store_ratings   every rating of the ratings store (movie_id, customer_id, rating, date code,
+#                   rating_date, rating_year, rating_category, activity_level), when one is given
+#
+# Queries are plain SQL (sql) or filtered aggregates built from dimension names (aggregate). DuckDB
+# only scans the columns a query uses, applies the filters during the scan and runs it on every
+# core: an aggregate over the 100M ratings of the store takes seconds, without a dedicated pipeline.
+#
+# The database is shared by the sessions of the app; every query runs on its own cursor, so
+# concurrent queries are safe.
+#
+#   python query_engine.py "SELECT decade, count(*) FROM ratings JOIN movies USING (movie_key) GROUP BY 1"
+#   python query_engine.py --store data/ratings_store --by rating_year --where decade=1990s
+
+DEFAULT_DATA_DIR = 'data'
+
+
+def _import_duckdb():
+    # imported by the first engine, not when the app starts (see import_report.py)
+    try:
+        import duckdb
+    except ImportError:  # without duckdb the app keeps its pandas aggregations (see data_loader.query_df)
+        return None
+    return duckdb
+
+# measures of an aggregate, same names as the aggregate cube (see aggregate_cube.py)
+MEASURES = {
+    'rating_count': 'count(r.rating)',
+    'rating_avg': 'avg(r.rating)',
+    'rating_std': 'stddev_samp(r.rating)',
+}
+
+_VIEWS = {
+    'ratings': f"""
+        SELECT *,
+               CASE WHEN rating_day = {MISSING_DAY} THEN NULL ELSE DATE '1970-01-01' + CAST(rating_day AS INTEGER) END AS rating_date,
+               CASE WHEN rating_day = {MISSING_DAY} THEN NULL ELSE year(DATE '1970-01-01' + CAST(rating_day AS INTEGER)) END AS rating_year
+        FROM _ratings""",
+    'movies': "SELECT * FROM _movies",
+    'movie_genres': "SELECT * FROM _movie_genres",
+    'store_ratings': f"""
+        SELECT *,
+               CASE WHEN date = {MISSING_DAY} THEN NULL ELSE DATE '1970-01-01' + CAST(date AS INTEGER) END AS rating_date,
+               CASE WHEN date = {MISSING_DAY} THEN NULL ELSE year(DATE '1970-01-01' + CAST(date AS INTEGER)) END AS rating_year,
+               CASE WHEN rating <= 2 THEN 'Low' WHEN rating = 3 THEN 'Neutral' WHEN rating >= 4 THEN 'High' END AS rating_category,
+               {ACTIVITY_LEVELS!r}[activity_code + 1] AS activity_level
+        FROM _store""",
+}
+
+
+class QueryEngine:
+    """In-process DuckDB database over a ratings frame, its movie dimension and optionally a ratings store."""
+
+    def __init__(self, ratings, movies, store=None, activity_codes=None, threads=None):
+        duckdb = _import_duckdb()
+        if duckdb is None:
+            raise ImportError("The query engine needs duckdb (pip install duckdb).")
+        self.movies = movies
+
+        movie_table = movies.table.copy(deep=False)
+        movie_table.insert(0, 'movie_key', np.arange(len(movie_table), dtype=np.int32))
+        keys, genres = np.nonzero(movies.genre_matrix())
+        movie_genres = pd.DataFrame({
+            'movie_key': keys.astype(np.int32),
+            # capitalized like the genre analysis: genres only differing by their case are one genre
+            'genre': pd.Series(movies.genre_vocabulary, dtype=object).str.capitalize().to_numpy()[genres],
+        }).drop_duplicates()
+
+        # frames scanned by the views, registered on every cursor
+        self._frames = {'_ratings': ratings, '_movies': movie_table, '_movie_genres': movie_genres}
+        if store is not None:
+            columns = {col: store.column(col) for col in ('movie_id', 'customer_id', 'rating', 'date')}
+            if activity_codes is None:
+                activity_codes = np.full(len(store), -1, dtype=np.int8)
+            columns['activity_code'] = activity_codes
+            # a frame of the memory-mapped columns, nothing is copied
+            self._frames['_store'] = pd.DataFrame(columns, copy=False)
+
+        self.connection = duckdb.connect()
+        if threads:
+            self.connection.execute(f"SET threads = {int(threads)}")
+        cursor = self._cursor()
+        for name, query in _VIEWS.items():
+            if name != 'store_ratings' or store is not None:
+                cursor.execute(f"CREATE VIEW {name} AS {query}")
+
+    @classmethod
+    def for_data_dir(cls, data_dir=DEFAULT_DATA_DIR, store_dir=None, threads=None):
+        """Engine over the files written by build_pipeline.py (and a ratings store with its activity levels)."""
+        ratings_path = os.path.join(data_dir, 'main_df.csv')
+        ratings = read_columnar(ratings_path)
+        if ratings is None:
+            ratings = typed_fact_table(pd.read_csv(ratings_path))
+        # the views read the day codes of the plan (copies written before it have rating_date)
+        ratings = apply_dtype_plan(ratings)
+        store = activity_codes = None
+        if store_dir is not None:
+            store = RatingsStore(store_dir)
+            if os.path.exists(os.path.join(store_dir, ACTIVITY_DIR, LEVELS_FILE)):
+                activity_codes = load_store_levels(store_dir)
+        return cls(ratings, MovieDimension.load(data_dir), store, activity_codes, threads)
+
+    @property
+    def tables(self):
+        """Names of the views (the registered frames they scan start with '_')."""
+        views = self._cursor().execute("SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall()
+        return [name for name, in views if not name.startswith('_')]
+
+    def _cursor(self):
+        cursor = self.connection.cursor()
+        for name, frame in self._frames.items():
+            cursor.register(name, frame)
+        return cursor
+
+    def sql(self, query, params=None):
+        """Result of a SQL query (with ? parameters) as a DataFrame."""
+        return self._cursor().execute(query, params or []).df()
+
+    def aggregate(self, by, where=None, source='ratings'):
+        """
+        rating_count, rating_avg and rating_std per combination of the `by` columns of source
+        ('ratings' or 'store_ratings'), over the ratings whose columns are in the values of `where`
+        ({column: value or list of values}). Movie attributes (title, decade ...) are joined from
+        the dimension, 'genres' counts a rating once for every genre of its movie.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        source_columns = set(self.sql(f"SELECT * FROM {source} LIMIT 0").columns)
+        movie_columns = set(self.movies.columns) | {'movie_key'}
+
+        def column(name):
+            if name == 'genres':
+                return 'g.genre'
+            if name in source_columns:
+                return f'r."{name}"'
+            if name in movie_columns:
+                return f'm."{name}"'
+            raise ValueError(f"Unknown column '{name}' for {source}.")
+
+        names = [*by, *where]
+        joins = ''
+        if any(column(name).startswith(('m.', 'g.')) for name in names):
+            # ratings are keyed by movie_key, the store by movie_id
+            key = 'movie_key' if 'movie_key' in source_columns else 'movie_id'
+            joins += f' JOIN movies m ON m.{key} = r.{key}'
+        if 'genres' in names:
+            joins += ' JOIN movie_genres g ON g.movie_key = m.movie_key'
+
+        conditions, params = [], []
+        for name, values in where.items():
+            values = list(values) if isinstance(values, (list, tuple, set, np.ndarray, pd.Index)) else [values]
+            conditions.append(f"{column(name)} IN ({', '.join('?' * len(values))})")
+            params.extend(values.tolist() if isinstance(values, np.ndarray) else values)
+
+        select = [f'{column(name)} AS "{name}"' for name in by]
+        select += [f'{expression} AS {measure}' for measure, expression in MEASURES.items()]
+        query = f"SELECT {', '.join(select)} FROM {source} r{joins}"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if by:
+            positions = ', '.join(str(i + 1) for i in range(len(by)))
+            query += f' GROUP BY {positions} ORDER BY {positions}'
+        return self.sql(query, params)
+
+
+def _parse_where(text):
+    # "decade=1990s,2000s" -> ('decade', ['1990s', '2000s']), numbers converted
+    name, values = text.split('=', 1)
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(int(value))
+        except ValueError:
+            parsed.append(value)
+    return name, parsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a SQL query or a filtered aggregate on the app data.")
+    parser.add_argument('query', nargs='?', help="SQL query (views: ratings, movies, movie_genres, store_ratings)")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--store', default=None, help="ratings store exposed as store_ratings")
+    parser.add_argument('--by', action='append', default=[], help="aggregate by this column (repeatable)")
+    parser.add_argument('--where', action='append', default=[], type=_parse_where, help="filter column=value[,value...]")
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    engine = QueryEngine.for_data_dir(args.data_dir, args.store, args.threads)
+    start_time = time.perf_counter()
+    if args.query:
+        result = engine.sql(args.query)
+    else:
+        result = engine.aggregate(args.by, dict(args.where), 'store_ratings' if args.store else 'ratings')
+    print(result.to_string(index=False))
+    print(f"{len(result):,} rows in {time.perf_counter() - start_time:.2f}s.")
@@ -0,0 +1,125 @@
+import argparse
+import os
+
+import numpy as np
+
+from ratings_store import DEFAULT_STORE_DIR, RatingsStore
+
+# CSR style indexes over the ratings.
+#
+# For a key column (movie_id or customer_id) the index holds:
+#   perm     row positions sorted by key (stable, so the original order is kept inside a key)
+#   offsets  offsets[k]:offsets[k + 1] is the slice of perm holding the rows of key k
+#
+# Ids are used directly as positions in offsets (movie ids go up to 17,770 and customer ids up to
+# 2,649,429), so fetching the rows of one movie or one customer is an O(1) slice instead of a
+# scan of every row. When the rows are already sorted by the key (the raw files are grouped by
+# movie) perm is not stored and the rows of a key are a plain range.
+
+INDEX_DIR = 'indexes'
+INDEXED_COLUMNS = ('movie_id', 'customer_id')
+
+
+class CSRIndex:
+    """Offsets index of the rows of a table grouped by an integer key."""
+
+    def __init__(self, offsets, perm=None):
+        self.offsets = offsets
+        self.perm = perm
+
+    @classmethod
+    def build(cls, keys):
+        """Builds the index of an array of non-negative integer keys."""
+        keys = np.asarray(keys)
+        n_keys = int(keys.max()) + 1 if len(keys) else 0
+        counts = np.bincount(keys, minlength=n_keys)
+
+        offsets = np.zeros(n_keys + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        if len(keys) < 2 or np.all(keys[1:] >= keys[:-1]):
+            perm = None
+        else:
+            perm_dtype = np.int32 if len(keys) < np.iinfo(np.int32).max else np.int64
+            perm = np.argsort(keys, kind='stable').astype(perm_dtype)
+        return cls(offsets, perm)
+
+    @property
+    def n_keys(self):
+        return len(self.offsets) - 1
+
+    def bounds(self, key):
+        """Returns the (start, stop) slice of perm holding the rows of key."""
+        if key < 0 or key >= self.n_keys:
+            return 0, 0
+        return int(self.offsets[key]), int(self.offsets[key + 1])
+
+    def rows(self, key):
+        """Row positions of one key (O(1) slice)."""
+        start, stop = self.bounds(key)
+        if self.perm is None:
+            return np.arange(start, stop)
+        return self.perm[start:stop]
+
+    def rows_for(self, keys):
+        """Row positions of several keys, concatenated in the order of keys."""
+        parts = [self.rows(key) for key in keys]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def counts(self):
+        """Number of rows of every key (indexed by key)."""
+        return np.diff(self.offsets)
+
+    def keys(self):
+        """Keys that have at least one row."""
+        return np.flatnonzero(self.counts())
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, 'offsets.npy'), self.offsets)
+        perm_path = os.path.join(index_dir, 'perm.npy')
+        if self.perm is not None:
+            np.save(perm_path, self.perm)
+        elif os.path.exists(perm_path):
+            os.remove(perm_path)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        """Loads a saved index; with mmap the arrays are memory-mapped instead of read."""
+        mmap_mode = 'r' if mmap else None
+        offsets = np.load(os.path.join(index_dir, 'offsets.npy'), mmap_mode=mmap_mode)
+        perm_path = os.path.join(index_dir, 'perm.npy')
+        perm = np.load(perm_path, mmap_mode=mmap_mode) if os.path.exists(perm_path) else None
+        return cls(offsets, perm)
+
+
+def frame_index(df, col):
+    """Builds the index of a DataFrame column (e.g. movie_id of the 500k sample)."""
+    return CSRIndex.build(df[col].to_numpy())
+
+
+def take_rows(df, index, keys):
+    """Returns the rows of df whose key is in keys, using the index instead of a mask."""
+    return df.iloc[index.rows_for(keys)]
+
+
+def build_store_indexes(store_dir=DEFAULT_STORE_DIR, columns=INDEXED_COLUMNS):
+    """Builds and saves the indexes of a ratings store under <store_dir>/indexes/<column>."""
+    store = RatingsStore(store_dir)
+    for col in columns:
+        print(f"Indexing {col}...")
+        index = CSRIndex.build(store.column(col))
+        index.save(os.path.join(store_dir, INDEX_DIR, col))
+
+
+def load_store_index(store_dir, col):
+    """Loads (memory-mapped) a saved index of a ratings store."""
+    return CSRIndex.load(os.path.join(store_dir, INDEX_DIR, col))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the movie and customer indexes of a ratings store.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    build_store_indexes(args.store)
@@ -1,93 +1,634 @@
 import pandas as pd
 import numpy as np
-import glob
+import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from netflix_parser import ARCHIVE_SEPARATOR, concat_columns, count_rating_lines, discover_sources, iter_parsed_blocks, source_name, split_file_ranges
+from ratings_store import RatingsStore
+from parse_cache import DEFAULT_CACHE_DIR, ParseCache
 
-# define directory 
+# define directory
 
-data_dir = './Netflix_data/' 
+data_dir = './Netflix_data/'
 
-# Our data is divided in 4 files. we will take a proportional sample from each file. Here we define the number of rows to randomly select from each file
-PROPORTIONAL_TARGETS = {
-    'combined_data_1.txt': 119695,
-    'combined_data_2.txt': 134242,
-    'combined_data_3.txt': 112469,
-    'combined_data_4.txt': 133594
-}
+# Our data is divided in 4 files. We take a proportional sample from each file: the number of rows
+# to select from each file is computed from the actual line counts of the files (see proportional_targets)
 
-# get file names - they have the same structure 
-file_names = glob.glob(os.path.join(data_dir, 'combined_data_*.txt'))
-
-#define size of our sample 
+#define default size of our sample
 TOTAL_TARGET_LINES = 500000
 
-#initialize sampled dfs and film id 
-all_sampled_dfs = [] 
-current_film_id = None
-
-#start restructuring and sampling 
-print(f"Starting Proportional Restructuring and Sampling (Total Target: {TOTAL_TARGET_LINES:,})...")
-print("---")
-
-# Here we do a loop where for each file, we set the sample size and we restructure the data.
-
-for file_path in file_names:
-    # Use os.path.basename to get the key for the PROPORTIONAL_TARGETS dictionary
-    file_base_name = os.path.basename(file_path)
-    
-    # Get the required sample size for this specific file
-    target_sample_size = PROPORTIONAL_TARGETS.get(file_base_name, 0)
-    
-    if target_sample_size == 0:
-        print(f"Warning: Sample size not defined for {file_base_name}. Skipping.")
-        continue
-        
-    print(f"Processing and sampling {file_base_name} (Target: {target_sample_size:,} lines)...")
-    
-    data_rows = []
-    
-    # 1. Restructure: Read the data, estract film id if the row contains the film id, and separate customer id, rating and date if the row contains these data ù
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.endswith(':'):
-                current_film_id = int(line[:-1])
-            elif line:
-                try:
-                    customer_id, rating, date = line.split(',')
-                    # Store the complete, flattened row
-                    data_rows.append([current_film_id, int(customer_id), int(rating), date])
-                except ValueError:
-                    # Skip malformed rating lines
-                    continue
-    
-    # 2. Convert to DataFrame (only the current file's data)
-    current_file_df = pd.DataFrame(
-        data_rows, 
-        columns=['movie_id', 'customer_id', 'rating', 'date'])
-        
-# 3. Sample IMMEDIATELY
+# seed used by every sampling mode and strategy
+RANDOM_SEED = 42
+
+COLUMNS = ['movie_id', 'customer_id', 'rating', 'date']
+
+# rating line counts of the text sources, with the size and modification time of their file
+LINE_COUNTS_FILE = os.path.join('.cache', 'line_counts.json')
+
+
+# RESERVOIR
+
+def row_keys(movie_ids, customer_ids, seed):
+    """
+    Computes a pseudo-random 64 bit key for every rating (splitmix64 hash of movie id, customer id and seed).
+    Each (movie, customer) pair appears only once in the dataset, so the key of a row does not depend
+    on where or when the row is read.
+    """
+    x = (np.asarray(movie_ids, dtype=np.uint64) << np.uint64(32)) | np.asarray(customer_ids, dtype=np.uint64)
+    x = x + np.uint64((seed * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class RatingReservoir:
+    """
+    Fixed-size uniform sample of ratings built in a single pass.
+
+    The reservoir keeps the `size` rows with the smallest keys (see row_keys), so memory depends
+    only on the sample size and the result is the same whatever the order the rows arrive in.
+    """
+
+    def __init__(self, size, seed=RANDOM_SEED):
+        self.size = size
+        self.seed = seed
+        self.rows_seen = 0
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.columns = None
+
+    def add(self, columns):
+        """Offers a batch of rows (dict of equal-length arrays) to the reservoir."""
+        keys = row_keys(columns['movie_id'], columns['customer_id'], self.seed)
+        self.rows_seen += len(keys)
+
+        # once the reservoir is full only rows with a smaller key than the current maximum can enter
+        if len(self.keys) >= self.size:
+            mask = keys < self.keys.max()
+            keys = keys[mask]
+            columns = {col: np.asarray(values)[mask] for col, values in columns.items()}
+
+        if len(keys) == 0:
+            return
+
+        if self.columns is None:
+            merged = {col: np.asarray(columns[col]) for col in COLUMNS}
+        else:
+            merged = {col: np.concatenate([self.columns[col], np.asarray(columns[col])]) for col in COLUMNS}
+        keys = np.concatenate([self.keys, keys])
+
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size - 1)[:self.size]
+            keys = keys[keep]
+            merged = {col: values[keep] for col, values in merged.items()}
+
+        self.keys = keys
+        self.columns = merged
+
+    def to_frame(self):
+        """Returns the sample as a DataFrame, ordered by key so the output is reproducible."""
+        if self.columns is None:
+            return pd.DataFrame(columns=COLUMNS)
+        order = np.argsort(self.keys, kind='stable')
+        return pd.DataFrame({col: self.columns[col][order] for col in COLUMNS})
+
+    def merge(self, other):
+        """Merges another reservoir built with the same size and seed (e.g. by a worker process)."""
+        rows_seen = self.rows_seen + other.rows_seen
+        if other.columns is not None:
+            self.add(other.columns)
+        self.rows_seen = rows_seen
+
+
+class GroupCapReservoir:
+    """
+    Keeps at most `cap` rows per value of a group column (movie_id or customer_id), the ones with
+    the smallest keys. Like RatingReservoir the result does not depend on the row order, so
+    reservoirs built on different ranges can be merged.
+    """
+
+    def __init__(self, group_col, cap):
+        self.group_col = group_col
+        self.cap = cap
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.columns = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, columns, keys):
+        """Offers a batch of rows and their keys. Rows are buffered and compacted from time to time."""
+        if len(keys) == 0:
+            return
+        self._pending.append((columns, keys))
+        self._pending_rows += len(keys)
+        if self._pending_rows >= max(len(self.keys), 1_000_000):
+            self._compact()
+
+    def _compact(self):
+        if not self._pending:
+            return
+        parts = ([(self.columns, self.keys)] if self.columns is not None else []) + self._pending
+        columns = {col: np.concatenate([part[0][col] for part in parts]) for col in parts[0][0]}
+        keys = np.concatenate([part[1] for part in parts])
+
+        # sort by group then key and keep the first `cap` rows of every group
+        order = np.lexsort((keys, columns[self.group_col]))
+        groups = columns[self.group_col][order]
+        group_start = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+        keep = order[rank < self.cap]
+
+        self.columns = {col: values[keep] for col, values in columns.items()}
+        self.keys = keys[keep]
+        self._pending = []
+        self._pending_rows = 0
+
+    def merge(self, other):
+        other._compact()
+        if other.columns is not None:
+            self.add(other.columns, other.keys)
+
+    def result(self):
+        """Returns (columns, keys) of the kept rows."""
+        self._compact()
+        return self.columns, self.keys
+
+
+# SAMPLING CONFIGURATION
+
+class SamplingConfig:
+    """
+    Parameters of a sampling run.
+
+    Parameters
+    ----------
+    total : int
+        Requested number of rows. Split between the files proportionally to their line counts.
+    seed : int
+        Seed of the row keys, the same seed gives the same sample.
+    mode : str
+        'reservoir' (streaming) or 'full' (original in-memory sampling, plain proportional strategy only).
+    movie_cap, customer_cap : int or None
+        Maximum number of ratings kept per movie / per customer.
+    date_start, date_end : str or None
+        Only ratings with date_start <= date < date_end ('YYYY-MM-DD') are sampled.
+    whole_customers : bool
+        Sample customers instead of ratings and keep their full history (the number of rows is then
+        close to total, not exact).
+    """
+
+    def __init__(self, total=TOTAL_TARGET_LINES, seed=RANDOM_SEED, mode='reservoir', movie_cap=None,
+                 customer_cap=None, date_start=None, date_end=None, whole_customers=False):
+        self.total = total
+        self.seed = seed
+        self.mode = mode
+        self.movie_cap = movie_cap
+        self.customer_cap = customer_cap
+        self.date_start = np.datetime64(date_start, 'D') if date_start else None
+        self.date_end = np.datetime64(date_end, 'D') if date_end else None
+        self.whole_customers = whole_customers
+
+        if mode not in ('reservoir', 'full'):
+            raise ValueError(f"Unknown sampling mode '{mode}'.")
+        if mode == 'full' and not self.is_proportional:
+            raise ValueError("The 'full' mode only supports the plain proportional strategy.")
+        if whole_customers and customer_cap:
+            raise ValueError("whole_customers keeps full customer histories, it cannot be combined with customer_cap.")
+
+    @property
+    def has_caps(self):
+        return bool(self.movie_cap or self.customer_cap)
+
+    @property
+    def uses_file_reservoirs(self):
+        """True when each file can be sampled on its own with a reservoir (no cap, no customer sampling)."""
+        return not (self.has_caps or self.whole_customers)
+
+    @property
+    def is_proportional(self):
+        """True for the plain proportional strategy (no cap, no window, no customer sampling)."""
+        return not (self.has_caps or self.whole_customers or self.date_start is not None or self.date_end is not None)
+
+    def label(self):
+        """Short description of the strategy, used in the default output file name."""
+        parts = []
+        if self.whole_customers:
+            parts.append('customers')
+        if self.movie_cap:
+            parts.append(f'moviecap{self.movie_cap}')
+        if self.customer_cap:
+            parts.append(f'custcap{self.customer_cap}')
+        if self.date_start is not None or self.date_end is not None:
+            parts.append(f"{self.date_start or 'start'}_{self.date_end or 'end'}")
+        return '_'.join(parts) or 'proportional'
+
+    def output_file(self):
+        return f"netflix_sampled_{format_size(self.total)}_{self.label()}.csv"
+
+
+def format_size(n):
+    """500000 -> '500k', 5000000 -> '5M'."""
+    for unit, size in (('M', 1_000_000), ('k', 1_000)):
+        if n >= size and n % size == 0:
+            return f"{n // size}{unit}"
+    return str(n)
+
+
+def parse_size(text):
+    """'500k' -> 500000, '5M' -> 5000000."""
+    text = text.strip()
+    units = {'k': 1_000, 'm': 1_000_000}
+    if text[-1:].lower() in units:
+        return int(float(text[:-1]) * units[text[-1:].lower()])
+    return int(text)
+
+
+def proportional_targets(line_counts, total):
+    """
+    Splits total between the files proportionally to their line counts (largest remainder method,
+    so the targets add up exactly to total).
+    """
+    names = list(line_counts)
+    counts = np.array([line_counts[name] for name in names], dtype=np.float64)
+    if counts.sum() == 0:
+        return {name: 0 for name in names}
+
+    exact = counts / counts.sum() * min(total, counts.sum())
+    targets = np.floor(exact).astype(np.int64)
+    remainder = int(round(exact.sum())) - targets.sum()
+    for i in np.argsort(-(exact - targets), kind='stable')[:remainder]:
+        targets[i] += 1
+    return {name: int(target) for name, target in zip(names, targets)}
+
+
+# STREAMING SAMPLER
+# A sampler consumes the parsed blocks of one range and is merged with the samplers of the other
+# ranges. Every step depends only on the row keys, never on the row order, so the merged result is
+# the same whatever the number of ranges / processes.
+#
+#   1. filters: date window, whole-customer selection (customer hash below a threshold)
+#   2. the proportional and date-window strategies keep a RatingReservoir per file,
+#      the capped strategies keep a GroupCapReservoir per cap (intersected when both are set),
+#      the whole-customer strategy without caps keeps every selected row
+
+class StreamingSampler:
+
+    def __init__(self, config, target_sample_size, file_idx=0, customer_fraction=1.0):
+        self.config = config
+        self.file_idx = file_idx
+        self.customer_threshold = np.uint64(int(min(customer_fraction, 1.0) * (2 ** 64 - 1)))
+
+        self.reservoir = None
+        self.caps = []
+        self.kept = []
+        if config.has_caps:
+            if config.movie_cap:
+                self.caps.append(GroupCapReservoir('movie_id', config.movie_cap))
+            if config.customer_cap:
+                self.caps.append(GroupCapReservoir('customer_id', config.customer_cap))
+        elif config.uses_file_reservoirs:
+            self.reservoir = RatingReservoir(target_sample_size, seed=config.seed)
+
+    def add(self, columns):
+        config = self.config
+
+        # 1. Filters
+        mask = None
+        if config.date_start is not None:
+            mask = columns['date'] >= config.date_start
+        if config.date_end is not None:
+            before_end = columns['date'] < config.date_end
+            mask = before_end if mask is None else mask & before_end
+        if config.whole_customers:
+            selected = row_keys(np.zeros(1, dtype=np.uint64), columns['customer_id'], config.seed) < self.customer_threshold
+            mask = selected if mask is None else mask & selected
+        if mask is not None:
+            columns = {col: values[mask] for col, values in columns.items()}
+
+        # 2. Sampling
+        if self.reservoir is not None:
+            self.reservoir.add(columns)
+            return
+
+        columns = dict(columns, file_idx=np.full(len(columns['rating']), self.file_idx, dtype=np.int16))
+        if self.caps:
+            keys = row_keys(columns['movie_id'], columns['customer_id'], config.seed)
+            for cap in self.caps:
+                cap.add(columns, keys)
+        else:
+            self.kept.append(columns)
+
+    def merge(self, other):
+        if self.reservoir is not None:
+            self.reservoir.merge(other.reservoir)
+        for cap, other_cap in zip(self.caps, other.caps):
+            cap.merge(other_cap)
+        self.kept.extend(other.kept)
+
+    def candidates(self):
+        """Returns (columns, keys) of the rows that passed the filters and the caps."""
+        if self.caps:
+            columns, keys = self.caps[0].result()
+            for cap in self.caps[1:]:
+                _, other_keys = cap.result()
+                if columns is not None:
+                    in_both = np.isin(keys, other_keys)
+                    columns = {col: values[in_both] for col, values in columns.items()}
+                    keys = keys[in_both]
+        elif self.kept:
+            columns = {col: np.concatenate([part[col] for part in self.kept]) for col in self.kept[0]}
+            keys = row_keys(columns['movie_id'], columns['customer_id'], self.config.seed)
+        else:
+            columns = None
+        if columns is None:
+            return None, np.empty(0, dtype=np.uint64)
+        return columns, keys
+
+
+# SAMPLING MODES
+# Each range is consumed by a collect function (possibly in a worker process), the partial results
+# of the ranges are then combined by a finish function, in file and range order.
+
+def collect_full(blocks, config, target_sample_size, file_idx=0, customer_fraction=1.0):
+    """Original mode: keeps every parsed row of the range in memory."""
+    return concat_columns(blocks)
+
+
+def collect_streaming(blocks, config, target_sample_size, file_idx=0, customer_fraction=1.0):
+    """Streaming mode: walks the range once, each parsed block is handed to the sampler and released."""
+    sampler = StreamingSampler(config, target_sample_size, file_idx, customer_fraction)
+    for columns in blocks:
+        sampler.add(columns)
+    return sampler
+
+
+def finish_full(parts, file_name, target_sample_size, seed=RANDOM_SEED):
+    """
+    Original sampling mode: restructures the whole file in memory and samples it with pandas.
+    Peak memory follows the size of the file.
+    """
+    # Convert to DataFrame (only the current file's data)
+    current_file_df = pd.DataFrame(concat_columns(parts), columns=COLUMNS)
+
+    # Sample IMMEDIATELY
     if len(current_file_df) < target_sample_size:
-        print(f"Warning: File {file_base_name} had fewer lines than the target. Taking all {len(current_file_df):,} lines.")
-        sampled_df = current_file_df.copy()
+        print(f"Warning: File {file_name} had fewer lines than the target. Taking all {len(current_file_df):,} lines.")
+        return current_file_df.copy()
+
+    # random_state ensures this sample is reproducible
+    return current_file_df.sample(n=target_sample_size, random_state=seed)
+
+
+def finish_reservoir(parts, file_name, target_sample_size, seed=RANDOM_SEED):
+    """
+    Proportional (and date-window) strategy: only a reservoir of target_sample_size rows is kept per range.
+    The full DataFrame of the file is never built, peak memory follows the sample size.
+    """
+    reservoir = RatingReservoir(target_sample_size, seed=seed)
+    for part in parts:
+        reservoir.merge(part.reservoir)
+
+    if reservoir.rows_seen < target_sample_size:
+        print(f"Warning: File {file_name} had fewer lines than the target. Taking all {reservoir.rows_seen:,} lines.")
+
+    return reservoir.to_frame()
+
+
+def finish_stratified(parts, config, targets):
+    """
+    Capped / whole-customer strategies: the samplers of every range are merged globally
+    (a customer spans several files), then every file keeps its target number of candidates with the
+    smallest keys (all candidates for the whole-customer strategy).
+    """
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    columns, keys = merged.candidates()
+
+    all_sampled_dfs = []
+    for file_idx, (file_base_name, target_sample_size) in enumerate(targets.items()):
+        if columns is None:
+            sampled_df = pd.DataFrame(columns=COLUMNS)
+        else:
+            rows = np.flatnonzero(columns['file_idx'] == file_idx)
+            rows = rows[np.argsort(keys[rows], kind='stable')]
+            if not config.whole_customers:
+                if len(rows) < target_sample_size:
+                    print(f"Warning: File {file_base_name} had fewer eligible lines than the target. Taking all {len(rows):,} lines.")
+                rows = rows[:target_sample_size]
+            sampled_df = pd.DataFrame({col: columns[col][rows] for col in COLUMNS})
+        all_sampled_dfs.append(sampled_df)
+        print(f"Finished sampling from {file_base_name}. Sample size collected: {len(sampled_df):,}")
+    return all_sampled_dfs
+
+
+# RANGES
+# A range is a tuple ('file', path, start_byte, end_byte) over a combined_data text file
+# or ('store', store_dir, start_row, end_row) over a ratings store (see ratings_store.py).
+
+def open_range(source_range):
+    """Returns an iterator over the parsed blocks of a range."""
+    kind, path, start, end = source_range
+    if kind == 'store':
+        return RatingsStore(path).iter_blocks(start, end)
+    return iter_parsed_blocks(path, start=start, end=end)
+
+
+def _store_ranges(store_dir, start, rows, workers):
+    bounds = np.linspace(start, start + rows, max(workers, 1) + 1).astype(int)
+    return [('store', store_dir, int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def list_ranges(data_dir=data_dir, store_dir=None, workers=1, cache=None):
+    """
+    Lists the ranges of every input file, keyed by file name. data_dir can hold the extracted
+    files, compressed files (.gz/.bz2/.xz) or the Kaggle zip archive, or be the zip archive itself.
+    With workers > 1 the plain text files are split into byte ranges aligned on movie headers and
+    the store sources into equal row ranges.
+
+    With a cache (see parse_cache.py) the files are read from their cached parsed columns,
+    parsing only the files that are not in the cache yet.
+    """
+    if store_dir is not None:
+        return {
+            source['name']: _store_ranges(store_dir, source['start'], source['rows'], workers)
+            for source in RatingsStore(store_dir).sources
+        }
+
+    # get file names - they have the same structure (extracted, compressed or inside a zip archive)
+    sources = discover_sources(data_dir)
+
+    if cache is not None:
+        entries = cache.prepare(sources, workers)
+        print(cache.report())
+        return {
+            file_base_name: _store_ranges(entry_dir, 0, len(RatingsStore(entry_dir)), workers)
+            for file_base_name, entry_dir in entries.items()
+        }
+
+    return {
+        source_name(source): [('file', source, start, end) for start, end in split_file_ranges(source, workers)]
+        for source in sources
+    }
+
+
+def count_lines(ranges, counts_file=LINE_COUNTS_FILE):
+    """
+    Number of rating lines of every input file (read from the metadata for a store). A text file is
+    counted once: its count is kept in counts_file with the size and modification time of the file,
+    so later runs (another seed, total or strategy) do not read, or decompress, the file twice.
+    """
+    known = {}
+    if counts_file and os.path.exists(counts_file):
+        with open(counts_file) as f:
+            known = json.load(f)
+
+    line_counts = {}
+    changed = False
+    for file_base_name, file_ranges in ranges.items():
+        kind, path = file_ranges[0][:2]
+        if kind == 'store':
+            line_counts[file_base_name] = sum(end - start for _, _, start, end in file_ranges)
+            continue
+        # zip members are counted per member, the size and time are the ones of the archive
+        file_path, separator, member = path.partition(ARCHIVE_SEPARATOR)
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path) + separator + member
+        entry = known.get(key)
+        if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'rating_lines': count_rating_lines(path)}
+            known[key] = entry
+            changed = True
+        line_counts[file_base_name] = entry['rating_lines']
+
+    if changed and counts_file:
+        os.makedirs(os.path.dirname(counts_file) or '.', exist_ok=True)
+        with open(counts_file + '.tmp', 'w') as f:
+            json.dump(known, f, indent=2)
+        os.replace(counts_file + '.tmp', counts_file)
+    return line_counts
+
+
+def sample_file(file_path, target_sample_size, mode='reservoir', seed=RANDOM_SEED):
+    """Samples a single file in the current process (plain proportional strategy)."""
+    config = SamplingConfig(total=target_sample_size, seed=seed, mode=mode)
+    file_name = source_name(file_path)
+    if mode == 'full':
+        return finish_full([collect_full(iter_parsed_blocks(file_path), config, target_sample_size)], file_name, target_sample_size, seed)
+    part = collect_streaming(iter_parsed_blocks(file_path), config, target_sample_size)
+    return finish_reservoir([part], file_name, target_sample_size, seed)
+
+
+def _collect_range(task):
+    # runs in a worker process
+    config, source_range, target_sample_size, file_idx, customer_fraction = task
+    collect = collect_full if config.mode == 'full' else collect_streaming
+    return collect(open_range(source_range), config, target_sample_size, file_idx, customer_fraction)
+
+
+def run_sampling(config=None, data_dir=data_dir, output_file=None, workers=1, store_dir=None, cache_dir=None,
+                 counts_file=LINE_COUNTS_FILE):
+    """
+    Samples the combined_data files of data_dir (or a ratings store) according to config
+    and writes the result to output_file (default: name derived from the total and the strategy).
+
+    With workers > 1 the files are split into ranges processed by a pool of worker processes.
+    Partial results are combined in file and range order, so the output is identical to the
+    serial run for a given seed.
+
+    With cache_dir the parsed files are cached (see parse_cache.py): re-running with another seed,
+    total or strategy skips the text parsing. Without it the line counts of the text files are still
+    kept in counts_file (see count_lines).
+    """
+    config = config or SamplingConfig()
+    output_file = output_file or config.output_file()
+    cache = ParseCache(cache_dir) if cache_dir and store_dir is None else None
+    ranges = list_ranges(data_dir, store_dir, workers, cache)
+
+    # Compute the sample size of each file from the actual line counts
+    line_counts = count_lines(ranges, counts_file)
+    targets = proportional_targets(line_counts, config.total)
+    total_lines = sum(line_counts.values())
+    customer_fraction = config.total / total_lines if total_lines else 0.0
+
+    #start restructuring and sampling
+    print(f"Starting Sampling (Total Target: {config.total:,}, strategy: {config.label()}, mode: {config.mode}, workers: {workers})...")
+    for file_base_name, target_sample_size in targets.items():
+        print(f"{file_base_name}: {line_counts[file_base_name]:,} lines, target {target_sample_size:,}")
+    print("---")
+
+    # Collect the partial results of every range
+    tasks = [
+        (config, source_range, target_sample_size, file_idx, customer_fraction)
+        for file_idx, (file_base_name, target_sample_size) in enumerate(targets.items())
+        for source_range in ranges[file_base_name]
+    ]
+    print(f"Processing {len(targets)} files in {len(tasks)} ranges...")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_collect_range, tasks))
+    else:
+        # serial: ranges are collected on demand, so every file is finished (and its parsed columns
+        # released in full mode) before the next file is read
+        results = map(_collect_range, tasks)
+
+    # Build the samples from the partial results
+    if not tasks:
+        all_sampled_dfs = [pd.DataFrame(columns=COLUMNS)]
+    elif config.uses_file_reservoirs:
+        # results keep the task order: the ranges of a file are consecutive
+        results = iter(results)
+        finish = finish_full if config.mode == 'full' else finish_reservoir
+        all_sampled_dfs = []
+        for file_base_name, target_sample_size in targets.items():
+            parts = [next(results) for _ in ranges[file_base_name]]
+            sampled_df = finish(parts, file_base_name, target_sample_size, config.seed)
+            del parts
+            all_sampled_dfs.append(sampled_df)
+            print(f"Finished sampling from {file_base_name}. Sample size collected: {len(sampled_df):,}")
     else:
-        # random_state=42 ensures this sample is reproducible
-        sampled_df = current_file_df.sample(n=target_sample_size, random_state=42)
-    
-    # 4. Store the small sample and release the large intermediate DataFrame
-    all_sampled_dfs.append(sampled_df)
-    del current_file_df # Explicitly free up memory
-    
-    print(f"Finished sampling from {file_base_name}. Sample size collected: {len(sampled_df):,}")
-
-# 5. Combine the small samples into the final DataFrame
-print("---")
-print("Combining all small samples...")
-final_sampled_data = pd.concat(all_sampled_dfs, ignore_index=True)
-
-# 6. Final Output
-output_file = 'netflix_sampled_500k_proportional.csv'
-final_sampled_data.to_csv(output_file, index=False)
-
-print(f"Process complete! The final proportional dataset has **{len(final_sampled_data):,}** lines.")
-print(f"Saved to **{output_file}**.")
+        all_sampled_dfs = finish_stratified(list(results), config, targets)
+
+    # Combine the small samples into the final DataFrame
+    print("---")
+    print("Combining all small samples...")
+    final_sampled_data = pd.concat(all_sampled_dfs, ignore_index=True)
+
+    # Final Output
+    final_sampled_data.to_csv(output_file, index=False)
+
+    print(f"Process complete! The final dataset has **{len(final_sampled_data):,}** lines.")
+    print(f"Saved to **{output_file}**.")
+    return final_sampled_data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sampling of the Netflix Prize combined_data files.")
+    parser.add_argument('--data-dir', default=data_dir, help="directory containing combined_data_*.txt (plain, .gz/.bz2/.xz or in a .zip), or the .zip archive itself")
+    parser.add_argument('--store', help="read the ratings from a ratings store (see ratings_store.py) instead of --data-dir")
+    parser.add_argument('--total', type=parse_size, default=TOTAL_TARGET_LINES,
+                        help="number of rows to sample, e.g. 500k, 1M, 20M (split proportionally between the files)")
+    parser.add_argument('--mode', choices=['reservoir', 'full'], default='reservoir',
+                        help="'reservoir' streams each file once with bounded memory, 'full' loads each file in memory")
+    parser.add_argument('--seed', type=int, default=RANDOM_SEED)
+    parser.add_argument('--movie-cap', type=int, help="keep at most this many ratings per movie")
+    parser.add_argument('--customer-cap', type=int, help="keep at most this many ratings per customer")
+    parser.add_argument('--date-start', help="only sample ratings on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--date-end', help="only sample ratings before this date (YYYY-MM-DD)")
+    parser.add_argument('--whole-customers', action='store_true',
+                        help="sample customers and keep their full rating history")
+    parser.add_argument('--cache-dir', help=f"cache the parsed files in this directory, e.g. {DEFAULT_CACHE_DIR} "
+                                            "(about the size of a ratings store, ~1 GB for the full dataset)")
+    parser.add_argument('--output', help="output CSV (default: netflix_sampled_<total>_<strategy>.csv)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (0 = one per CPU core)")
+    args = parser.parse_args()
+
+    config = SamplingConfig(
+        total=args.total, seed=args.seed, mode=args.mode, movie_cap=args.movie_cap,
+        customer_cap=args.customer_cap, date_start=args.date_start, date_end=args.date_end,
+        whole_customers=args.whole_customers,
+    )
+    workers = args.workers or os.cpu_count() or 1
+    run_sampling(config, data_dir=args.data_dir, output_file=args.output, workers=workers, store_dir=args.store,
+                 cache_dir=args.cache_dir)
@@ -3,9 +3,8 @@ from data_loader import load_data, get_df
 
 # --- Data Loading ---
 data_store = load_data()
-df = get_df(data_store, 'main_df')
-movies_by_rating = get_df(data_store, 'movies_by_rating')
-genre_analysis_df = get_df(data_store, 'genre_analysis_df')
+# only the genres are read (resolved from the movie dimension), the other datasets are not loaded
+df = get_df(data_store, 'main_df', columns=['genres'])
 
 # %%
 print(df['genres'])
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from customer_activity import CustomerActivity, activity_levels
+from movie_dimension import ACTIVITY_LEVELS
+
+
+def test_three_bins_keep_the_qcut_labels():
+    num_ratings = pd.Series([1] * 60 + [2] * 20 + list(range(3, 23)))
+    expected = pd.qcut(num_ratings, q=5, labels=ACTIVITY_LEVELS, duplicates='drop')
+    pd.testing.assert_series_equal(activity_levels(num_ratings), expected)
+
+
+def test_five_bins_map_to_low_medium_high():
+    # distinct quintile edges, like the rating counts of the full corpus
+    num_ratings = pd.Series(np.arange(1, 101))
+    _, bins = pd.qcut(num_ratings, q=5, duplicates='drop', retbins=True)
+    assert len(bins) - 1 == 5
+
+    levels = activity_levels(num_ratings)
+    assert list(levels.cat.categories) == list(ACTIVITY_LEVELS)
+    assert (levels[:20] == 'Low').all()
+    assert (levels[20:80] == 'Medium').all()
+    assert (levels[80:] == 'High').all()
+
+
+def test_sketched_bins_label_the_customers():
+    customer_ids = np.repeat(np.arange(1, 101), np.arange(1, 101))
+    bins = np.array([1, 20, 40, 60, 80, 100])
+    activity = CustomerActivity.from_blocks([(customer_ids, np.ones(len(customer_ids)))], bins=bins)
+    codes = activity.levels_for([1, 50, 100, 101])
+    assert codes.tolist() == [0, 1, 2, -1]
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from date_codes import DATE_PARTS, MISSING_DAY, DateTable, codes_to_datetime, date_part, encode_date_strings, encode_datetimes
+
+DATES = ['1999-11-11', '2005-12-31', '2000-02-29', None, 'not a date', '1999-11-11', '2004-01-05']
+
+
+def test_strings_match_pandas():
+    codes = encode_date_strings(DATES)
+    expected = pd.to_datetime(pd.Series(DATES), errors='coerce', format='%Y-%m-%d')
+
+    assert codes.dtype == np.uint16
+    assert (codes == MISSING_DAY).tolist() == expected.isna().tolist()
+    np.testing.assert_array_equal(codes_to_datetime(codes), expected.to_numpy().astype('datetime64[D]'))
+
+
+def test_datetimes_round_trip():
+    values = np.array(['1970-01-01', '2005-12-31', 'NaT', '1969-12-31'], dtype='datetime64[D]')
+    codes = encode_datetimes(values)
+
+    assert codes.tolist() == [0, 13148, MISSING_DAY, MISSING_DAY]
+    assert np.isnat(codes_to_datetime(codes)[2:]).all()
+    np.testing.assert_array_equal(codes_to_datetime(codes)[:2], values[:2])
+
+
+@pytest.mark.parametrize('part', DATE_PARTS)
+def test_parts_match_pandas(part):
+    codes = encode_date_strings(DATES)
+    dates = pd.Series(codes_to_datetime(codes))
+    expected = getattr(dates.dt, part).fillna(-1).astype(int)
+
+    assert date_part(codes, part).tolist() == expected.tolist()
+    # codes outside of the table are missing too
+    assert DateTable(codes[0], codes[0]).lookup(codes[:2], part)[1] == -1
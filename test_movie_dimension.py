@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from movie_dimension import MovieDimension
+
+
+def _dimension():
+    return MovieDimension(pd.DataFrame({
+        'movie_id': [3, 7, 9],
+        'title': ['A', 'B', 'C'],
+        'year': pd.array([1999, 2001, 2004], dtype='Int64'),
+        'genres': ['Drama', 'Drama|Crime', None],
+    }))
+
+
+def test_unknown_movies_resolve_to_missing_values():
+    movies = _dimension()
+    keys = movies.keys_for([7, 5, 9])
+    assert keys.tolist() == [1, -1, 2]
+
+    titles = movies.lookup(keys, 'title')
+    assert titles[0] == 'B' and pd.isna(titles[1]) and titles[2] == 'C'
+    years = movies.lookup(keys, 'year')
+    assert years[0] == 2001 and pd.isna(years[1])
+
+
+def test_known_keys_keep_the_dtype():
+    movies = _dimension()
+    assert movies.lookup(np.array([0, 2]), 'year').dtype == 'Int64'
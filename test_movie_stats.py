@@ -0,0 +1,23 @@
+import numpy as np
+
+from movie_stats import MovieStats
+
+
+def test_saved_restriction_filters_later_batches(tmp_path):
+    stats = MovieStats(movie_ids=[1, 2])
+    stats.add_batch([1, 2, 3], [4, 5, 1])
+    stats.save(tmp_path)
+
+    loaded = MovieStats.load(tmp_path)
+    loaded.add_batch([2, 5000], [3, 3])
+    assert loaded.n_ratings == 3
+    assert len(loaded.count) == 3
+    assert loaded.avg_rating()[2] == 4.0
+
+
+def test_unrestricted_statistics_keep_every_movie(tmp_path):
+    stats = MovieStats().add_batch([1, 7], [2, 4])
+    stats.save(tmp_path)
+    loaded = MovieStats.load(tmp_path)
+    assert loaded.movie_ids is None
+    assert np.flatnonzero(loaded.count).tolist() == [1, 7]
@@ -0,0 +1,70 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from netflix_parser import parse_file
+
+
+def _combined_data(seed=0, n_movies=30, newline='\n'):
+    # combined_data layout with a few lines the parsers must skip
+    rng = np.random.default_rng(seed)
+    lines = []
+    for movie_id in range(1, n_movies + 1):
+        lines.append(f'{movie_id}:')
+        for _ in range(rng.integers(0, 40)):
+            day = np.datetime64('1999-11-11') + int(rng.integers(0, 2200))
+            lines.append(f'{rng.integers(1, 2_649_430)},{rng.integers(1, 6)},{day}')
+        if movie_id % 7 == 0:
+            lines += ['', '123456,4', 'not a rating line']
+    return newline.join(lines) + newline
+
+
+def _legacy_parse(path):
+    # line loop of the original sampling.py
+    data_rows = []
+    current_film_id = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith(':'):
+                current_film_id = int(line[:-1])
+            elif line:
+                try:
+                    customer_id, rating, date = line.split(',')
+                    data_rows.append([current_film_id, int(customer_id), int(rating), date])
+                except ValueError:
+                    continue
+    return pd.DataFrame(data_rows, columns=['movie_id', 'customer_id', 'rating', 'date'])
+
+
+def _as_frame(columns):
+    df = pd.DataFrame(columns)
+    df['date'] = pd.Series(df['date']).dt.strftime('%Y-%m-%d')
+    return df.astype({'movie_id': np.int64, 'customer_id': np.int64, 'rating': np.int64})
+
+
+@pytest.mark.parametrize('block_size', [7, 100, 4096, 16 * 1024 * 1024])
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_parse_file_matches_the_legacy_parser(tmp_path, block_size, newline):
+    path = tmp_path / 'combined_data_1.txt'
+    path.write_bytes(_combined_data(newline=newline).encode())
+    expected = _legacy_parse(path)
+    assert len(expected) > 100
+
+    parsed = _as_frame(parse_file(str(path), block_size=block_size))
+    pd.testing.assert_frame_equal(parsed, expected)
+
+
+def test_compressed_file_parses_like_the_text(tmp_path):
+    text = _combined_data(seed=1).encode()
+    (tmp_path / 'combined_data_1.txt').write_bytes(text)
+    with gzip.open(tmp_path / 'combined_data_2.txt.gz', 'wb') as f:
+        f.write(text)
+
+    plain = parse_file(str(tmp_path / 'combined_data_1.txt'), block_size=64)
+    compressed = parse_file(str(tmp_path / 'combined_data_2.txt.gz'), block_size=64)
+    for col in plain:
+        assert plain[col].dtype == compressed[col].dtype
+        np.testing.assert_array_equal(plain[col], compressed[col])
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from partitioned_store import PartitionedStore, write_partitioned_store, yearly_movie_ratings
+from ratings_store import write_store_from_frame
+
+
+def _partitioned(tmp_path):
+    ratings = pd.DataFrame({
+        'movie_id': [1, 1, 2, 1, 2, 2, 1, 3],
+        'customer_id': [10, 11, 12, 13, 14, 15, 16, 17],
+        'rating': [5, 3, 4, 2, 1, 5, 4, 3],
+        'date': ['2003-01-05', '2003-06-01', '2003-07-09', '2004-02-01',
+                 '2004-03-03', '2004-12-31', '2005-05-05', '2005-06-06'],
+    })
+    write_store_from_frame(ratings, str(tmp_path / 'store'))
+    write_partitioned_store(str(tmp_path / 'store'), str(tmp_path / 'by_year'))
+    return PartitionedStore(str(tmp_path / 'by_year')), ratings
+
+
+def test_year_filter_opens_only_the_matching_partitions(tmp_path):
+    pstore, _ = _partitioned(tmp_path)
+    assert [p['rating_year'] for p in pstore.partitions] == [2003, 2004, 2005]
+
+    selected = pstore.select([('rating_year', '==', 2004)])
+    assert [p['path'] for p in selected] == ['rating_year=2004']
+
+    blocks = list(pstore.iter_blocks([('rating_year', '==', 2004)], ['movie_id', 'rating']))
+    assert sorted(pstore._stores) == ['rating_year=2004']
+    assert np.concatenate([block['rating'] for block in blocks]).tolist() == [2, 1, 5]
+
+
+def test_yearly_movie_ratings_reads_the_selected_years(tmp_path):
+    pstore, ratings = _partitioned(tmp_path)
+    result = yearly_movie_ratings(pstore, [1, 2], years=(2003, 2004))
+    assert sorted(pstore._stores) == ['rating_year=2003', 'rating_year=2004']
+
+    ratings['rating_year'] = pd.to_datetime(ratings['date']).dt.year
+    expected = (ratings[ratings['movie_id'].isin([1, 2]) & ratings['rating_year'].between(2003, 2004)]
+                .groupby(['movie_id', 'rating_year'])['rating'].agg(['count', 'mean']).reset_index())
+    assert result['movie_id'].tolist() == expected['movie_id'].tolist()
+    assert result['rating_year'].tolist() == expected['rating_year'].tolist()
+    assert result['rating_count'].tolist() == expected['count'].tolist()
+    np.testing.assert_allclose(result['rating_avg'], expected['mean'])
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ratings_index import CSRIndex, frame_index, take_rows
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_rows_match_a_scan(ordered):
+    keys = np.random.default_rng(0).integers(0, 50, size=2000)
+    if ordered:
+        keys = np.sort(keys)
+    index = CSRIndex.build(keys)
+
+    assert (index.perm is None) == ordered
+    np.testing.assert_array_equal(index.counts(), np.bincount(keys, minlength=50))
+    np.testing.assert_array_equal(index.keys(), np.unique(keys))
+    for key in range(-1, 52):
+        np.testing.assert_array_equal(index.rows(key), np.flatnonzero(keys == key))
+    np.testing.assert_array_equal(index.rows_for([7, 3]),
+                                  np.concatenate([np.flatnonzero(keys == 7), np.flatnonzero(keys == 3)]))
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_and_load(tmp_path, mmap):
+    keys = np.array([4, 1, 1, 0, 4, 2])
+    index = CSRIndex.build(keys)
+    index.save(str(tmp_path / 'index'))
+    loaded = CSRIndex.load(str(tmp_path / 'index'), mmap=mmap)
+
+    np.testing.assert_array_equal(loaded.offsets, index.offsets)
+    np.testing.assert_array_equal(loaded.perm, index.perm)
+
+    # a sorted index saved over it removes the old permutation
+    CSRIndex.build(np.sort(keys)).save(str(tmp_path / 'index'))
+    assert CSRIndex.load(str(tmp_path / 'index'), mmap=mmap).perm is None
+
+
+def test_take_rows_of_a_frame():
+    df = pd.DataFrame({'movie_id': [3, 1, 3, 2, 1], 'rating': [5, 4, 3, 2, 1]})
+    index = frame_index(df, 'movie_id')
+
+    assert take_rows(df, index, [1, 3])['rating'].tolist() == [4, 1, 5, 3]
+    assert take_rows(df, index, []).empty
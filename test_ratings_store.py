@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from movie_dimension import MovieDimension, store_fact_table
+from netflix_parser import parse_file
+from ratings_store import STORE_DTYPES, RatingsStore, write_store_from_files, write_store_from_frame
+
+
+def _ratings():
+    return pd.DataFrame({
+        'movie_id': [1, 1, 2, 17770, 2],
+        'customer_id': [6, 2649429, 7, 8, 9],
+        'rating': [1, 5, 3, 4, 2],
+        'date': ['1999-11-11', '2005-12-31', '2003-02-28', '2004-07-04', '2000-01-01'],
+    })
+
+
+def test_frame_round_trip_keeps_the_values_and_dtypes(tmp_path):
+    ratings = _ratings()
+    write_store_from_frame(ratings, str(tmp_path / 'store'))
+    store = RatingsStore(str(tmp_path / 'store'))
+
+    assert len(store) == len(ratings)
+    for col, dtype in STORE_DTYPES.items():
+        assert store.column(col).dtype == dtype
+    df = store.to_frame()
+    assert df[['movie_id', 'customer_id', 'rating']].values.tolist() == ratings[['movie_id', 'customer_id', 'rating']].values.tolist()
+    assert pd.Series(df['date']).dt.strftime('%Y-%m-%d').tolist() == ratings['date'].tolist()
+
+
+def test_text_files_convert_like_the_parser(tmp_path):
+    path = tmp_path / 'combined_data_1.txt'
+    path.write_text('1:\n6,1,1999-11-11\n2649429,5,2005-12-31\n2:\n7,3,2003-02-28\n')
+    write_store_from_files([str(path)], str(tmp_path / 'store'))
+    store = RatingsStore(str(tmp_path / 'store'))
+
+    parsed = parse_file(str(path))
+    for col in ('movie_id', 'customer_id', 'rating'):
+        np.testing.assert_array_equal(store.column(col), parsed[col])
+    np.testing.assert_array_equal(store.dates(), parsed['date'])
+    assert store.sources == [{'name': 'combined_data_1.txt', 'start': 0, 'rows': 3}]
+
+
+def test_fact_table_of_a_store(tmp_path):
+    write_store_from_frame(_ratings(), str(tmp_path / 'store'))
+    store = RatingsStore(str(tmp_path / 'store'))
+    movies = MovieDimension(pd.DataFrame({'movie_id': [1, 2], 'title': ['A', 'B'], 'genres': ['Drama', 'Comedy']}))
+
+    fact = store_fact_table(store, movies)
+    # movie 17770 is not in the dimension
+    assert fact['movie_key'].tolist() == [0, 0, 1, 1]
+    assert str(fact['rating'].dtype) == 'Int8'
+    assert fact['rating_day'].dtype == np.uint16
+    assert fact['rating_category'].tolist() == ['Low', 'High', 'Neutral', 'Low']
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from netflix_parser import concat_columns, parse_file, split_file_ranges
+from sampling import RatingReservoir, SamplingConfig, row_keys, run_sampling
+
+
+def _write_combined_data(path, first_movie, n_movies, seed):
+    # combined_data layout, a customer rates a movie at most once
+    rng = np.random.default_rng(seed)
+    lines = []
+    for movie_id in range(first_movie, first_movie + n_movies):
+        lines.append(f'{movie_id}:')
+        for customer_id in rng.choice(5000, size=rng.integers(1, 120), replace=False):
+            day = np.datetime64('2001-01-01') + int(rng.integers(0, 1800))
+            lines.append(f'{customer_id + 1},{rng.integers(1, 6)},{day}')
+    path.write_text('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    _write_combined_data(tmp_path / 'combined_data_1.txt', 1, 80, seed=1)
+    _write_combined_data(tmp_path / 'combined_data_2.txt', 81, 60, seed=2)
+    return tmp_path
+
+
+def _sample(data_dir, tmp_path, workers, **config):
+    config = SamplingConfig(**{'total': 1500, **config})
+    return run_sampling(config, data_dir=str(data_dir), output_file=str(tmp_path / f'sample_{workers}.csv'),
+                        workers=workers, counts_file=None)
+
+
+def test_byte_ranges_start_on_movie_headers(data_dir):
+    path = str(data_dir / 'combined_data_1.txt')
+    ranges = split_file_ranges(path, 4, min_size=1)
+    assert len(ranges) == 4
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    for start, _ in ranges[1:]:
+        assert content[start - 1:start] == b'\n'
+        assert content[start:content.index(b'\n', start)].endswith(b':')
+
+    whole = parse_file(path)
+    parts = concat_columns(parse_file(path, start=start, end=end) for start, end in ranges)
+    for col in whole:
+        np.testing.assert_array_equal(parts[col], whole[col])
+
+
+@pytest.mark.parametrize('mode', ['reservoir', 'full'])
+def test_output_does_not_depend_on_the_workers(data_dir, tmp_path, monkeypatch, mode):
+    serial = _sample(data_dir, tmp_path, 1, mode=mode)
+    assert len(serial) == 1500
+    # small files are split into byte ranges too
+    monkeypatch.setattr('netflix_parser.MIN_RANGE_SIZE', 1)
+    parallel = _sample(data_dir, tmp_path, 3, mode=mode)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert (tmp_path / 'sample_1.csv').read_bytes() == (tmp_path / 'sample_3.csv').read_bytes()
+
+
+def test_reservoir_keeps_the_smallest_keys_in_any_order(data_dir):
+    columns = parse_file(str(data_dir / 'combined_data_1.txt'))
+    keys = row_keys(columns['movie_id'], columns['customer_id'], 7)
+    expected = np.sort(keys)[:300]
+
+    rng = np.random.default_rng(0)
+    for chunk in (1000, 97, len(keys)):
+        order = rng.permutation(len(keys))
+        reservoir = RatingReservoir(300, seed=7)
+        for start in range(0, len(order), chunk):
+            reservoir.add({col: values[order[start:start + chunk]] for col, values in columns.items()})
+        sample = reservoir.to_frame()
+        np.testing.assert_array_equal(row_keys(sample['movie_id'], sample['customer_id'], 7), expected)
+        assert reservoir.rows_seen == len(keys)
+
+
+@pytest.mark.parametrize('caps', [{'movie_cap': 5}, {'customer_cap': 1}, {'movie_cap': 8, 'customer_cap': 2}])
+def test_capped_sample_respects_the_caps(data_dir, tmp_path, monkeypatch, caps):
+    serial = _sample(data_dir, tmp_path, 1, total=400, **caps)
+    assert 0 < len(serial) <= 400
+    if 'movie_cap' in caps:
+        assert serial['movie_id'].value_counts().max() <= caps['movie_cap']
+    if 'customer_cap' in caps:
+        assert serial['customer_id'].value_counts().max() <= caps['customer_cap']
+
+    monkeypatch.setattr('netflix_parser.MIN_RANGE_SIZE', 1)
+    pd.testing.assert_frame_equal(serial, _sample(data_dir, tmp_path, 3, total=400, **caps))
+
+
+def test_date_window(data_dir, tmp_path):
+    sample = _sample(data_dir, tmp_path, 1, total=300, date_start='2002-01-01', date_end='2003-01-01')
+    dates = pd.to_datetime(sample['date'])
+    assert len(sample) == 300
+    assert dates.min() >= pd.Timestamp('2002-01-01') and dates.max() < pd.Timestamp('2003-01-01')